@@ -0,0 +1,412 @@
+'''
+Cold storage for old message history
+
+The messages of a channel or dm are held in a MessageHistory, which behaves
+like the list it replaces. Only the newest messages (the hot tier) are kept as
+Message records in memory. Older ones are moved by the archiver into a
+segment file (the cold tier) which is memory-mapped and read on demand.
+
+A segment is columnar: arrays of message ids, u_ids and timestamps followed by
+the offsets of each message's text in one packed utf-8 blob. All integers are
+little-endian.
+
+    magic   8 bytes         b'DRMSEG01'
+    count   uint32          number of messages n
+    ids     int64 * n
+    u_ids   int64 * n
+    times   int64 * n
+    offsets uint64 * n + 1  start of each text in the blob, then its end
+    blob
+
+Segment files are never modified. Edits, reacts and removals of archived
+messages are kept in small tables on the MessageHistory and folded into the
+next segment written for that container. Positions in a MessageHistory count
+both tiers, so archiving never moves a message to a different position.
+'''
+import bisect
+import mmap
+import os
+import struct
+import threading
+import uuid
+from time import sleep
+from src.data import data
+from src import persistence
+from src.indexes import container_lock
+from src.records import Message
+
+ARCHIVE_DIR = 'src/archive'
+
+# Number of the newest messages of each channel and dm kept in memory
+HOT_MESSAGES = 1000
+
+# Smallest number of messages moved into a segment at a time
+ARCHIVE_BATCH = 1000
+
+# Seconds between runs of the archiver
+ARCHIVE_INTERVAL = 300
+
+_MAGIC = b'DRMSEG01'
+_HEADER = struct.Struct('<8sI')
+_INT = struct.Struct('<q')
+_OFFSET = struct.Struct('<Q')
+
+# Segment files that were unreferenced the last time the archiver looked
+_unreferenced = set()
+
+
+class ColdSegment:
+    '''
+    A read-only segment file, mapped into memory the first time it is read.
+    '''
+
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+        self._map = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'path': self.path, 'count': self.count}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['count'])
+
+    def message_id(self, row):
+        return _INT.unpack_from(self._mapped(), _HEADER.size + row * _INT.size)[0]
+
+    def u_id(self, row):
+        return _INT.unpack_from(self._mapped(),
+                                _HEADER.size + (self.count + row) * _INT.size)[0]
+
+    def time_created(self, row):
+        return _INT.unpack_from(self._mapped(),
+                                _HEADER.size + (2 * self.count + row) * _INT.size)[0]
+
+    def message(self, row):
+        mapped = self._mapped()
+        offsets = _HEADER.size + 3 * self.count * _INT.size
+        blob = offsets + (self.count + 1) * _OFFSET.size
+        start = _OFFSET.unpack_from(mapped, offsets + row * _OFFSET.size)[0]
+        end = _OFFSET.unpack_from(mapped, offsets + (row + 1) * _OFFSET.size)[0]
+        return mapped[blob + start:blob + end].decode('utf-8')
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+
+    def _mapped(self):
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    with open(self.path, 'rb') as infile:
+                        self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+                    magic, count = _HEADER.unpack_from(self._map, 0)
+                    if magic != _MAGIC or count != self.count:
+                        raise ValueError('%s is not the expected segment' % self.path)
+        return self._map
+
+
+def write_segment(path, messages):
+    '''
+    Writes a segment file holding messages, which are read with message['field'],
+    and returns it as a ColdSegment.
+    '''
+    texts = [message['message'].encode('utf-8') for message in messages]
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as outfile:
+        outfile.write(_HEADER.pack(_MAGIC, len(messages)))
+        for field in ('message_id', 'u_id', 'time_created'):
+            outfile.write(b''.join(_INT.pack(message[field]) for message in messages))
+        outfile.write(b''.join(_OFFSET.pack(offset) for offset in offsets))
+        outfile.write(b''.join(texts))
+    os.replace(temp_file, path)
+    return ColdSegment(path, len(messages))
+
+
+class ColdMessage:
+    '''
+    An archived message, read from its segment. Setting a field records the
+    change on the MessageHistory, so fields must be replaced rather than
+    modified in place (reacts_list included). Fields are only set under the
+    container's lock, which archiving also holds, so a change is never made to
+    tiers that have since been replaced.
+    '''
+    __slots__ = ('_tiers', '_row')
+
+    def __init__(self, tiers, row):
+        self._tiers = tiers
+        self._row = row
+
+    def __getitem__(self, key):
+        tiers, row = self._tiers, self._row
+        if key == 'message_id':
+            return tiers.segment.message_id(row)
+        if key == 'u_id':
+            return tiers.segment.u_id(row)
+        if key == 'time_created':
+            return tiers.segment.time_created(row)
+        if key == 'message':
+            if row in tiers.edits:
+                return tiers.edits[row]
+            return tiers.segment.message(row)
+        if key == 'reacts_list':
+            return list(tiers.reacts.get(row, ()))
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'message':
+            self._tiers.edits[self._row] = value
+        elif key == 'reacts_list':
+            if value:
+                self._tiers.reacts[self._row] = list(value)
+            else:
+                self._tiers.reacts.pop(self._row, None)
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in Message.__slots__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        return {key: self[key] for key in Message.__slots__}
+
+
+class _Tiers:
+    '''
+    Everything a MessageHistory holds. Archiving replaces it as a whole, so a
+    reader that takes it once sees the history either before or after.
+    '''
+    __slots__ = ('segment', 'removed', 'edits', 'reacts', 'hot')
+
+    def __init__(self, segment, removed, edits, reacts, hot):
+        self.segment = segment
+        # Sorted rows of the segment whose messages have been removed
+        self.removed = removed
+        # Segment row -> edited text, and -> non-empty reacts_list
+        self.edits = edits
+        self.reacts = reacts
+        self.hot = hot
+
+    def cold_count(self):
+        if self.segment is None:
+            return 0
+        return self.segment.count - len(self.removed)
+
+    def __len__(self):
+        return self.cold_count() + len(self.hot)
+
+    def message(self, position):
+        cold_count = self.cold_count()
+        if position < cold_count:
+            return ColdMessage(self, self.row(position))
+        return self.hot[position - cold_count]
+
+    # Maps a position in the cold tier to its row in the segment, skipping the
+    # rows of removed messages
+    def row(self, position):
+        row = position
+        for removed_row in self.removed:
+            if removed_row > row:
+                break
+            row += 1
+        return row
+
+
+class MessageHistory:
+    '''
+    The messages of a channel or dm, oldest first. Supports the list operations
+    the rest of the code uses: len, indexing and slicing, iteration, append and
+    del of a single position.
+    '''
+
+    def __init__(self, messages=()):
+        self._tiers = _Tiers(None, [], {}, {}, list(messages))
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        tiers = self._tiers
+        return {key: getattr(tiers, key) for key in _Tiers.__slots__}
+
+    def __setstate__(self, state):
+        self._tiers = _Tiers(**{key: state[key] for key in _Tiers.__slots__})
+        self._lock = threading.Lock()
+
+    @property
+    def hot(self):
+        return self._tiers.hot
+
+    @property
+    def segment(self):
+        return self._tiers.segment
+
+    def cold_count(self):
+        return self._tiers.cold_count()
+
+    def __len__(self):
+        return len(self._tiers)
+
+    def __getitem__(self, position):
+        tiers = self._tiers
+        if isinstance(position, slice):
+            return [tiers.message(i) for i in range(*position.indices(len(tiers)))]
+        return tiers.message(_normalise(position, len(tiers)))
+
+    def __delitem__(self, position):
+        with self._lock:
+            tiers = self._tiers
+            position = _normalise(position, len(tiers))
+            cold_count = tiers.cold_count()
+            if position < cold_count:
+                row = tiers.row(position)
+                bisect.insort(tiers.removed, row)
+                tiers.edits.pop(row, None)
+                tiers.reacts.pop(row, None)
+            else:
+                del tiers.hot[position - cold_count]
+
+    def __iter__(self):
+        tiers = self._tiers
+        for position in range(len(tiers)):
+            yield tiers.message(position)
+
+    def __reversed__(self):
+        tiers = self._tiers
+        for position in range(len(tiers) - 1, -1, -1):
+            yield tiers.message(position)
+
+    def append(self, message):
+        self._tiers.hot.append(message)
+
+    def adopt_segment(self, path, count, archived, reacts):
+        '''
+        Replaces the cold tier with the segment at path, which holds count
+        messages: the current cold messages followed by the oldest archived
+        hot messages. reacts maps rows of the new segment to their reacts.
+        '''
+        # The old segment is left to close once nothing reads from it
+        with self._lock:
+            hot = self._tiers.hot[archived:]
+            self._tiers = _Tiers(ColdSegment(path, count), [], {}, dict(reacts), hot)
+
+    def segment_path(self):
+        segment = self._tiers.segment
+        return None if segment is None else segment.path
+
+
+def archive_container(kind, container_id, archive_dir=ARCHIVE_DIR,
+                      hot_messages=HOT_MESSAGES, batch=ARCHIVE_BATCH):
+    '''
+    Moves all but the newest hot_messages messages of a channel or dm into a
+    new segment once at least batch of them can be moved. Returns whether
+    anything was archived.
+    '''
+    # Removing, editing or reacting to a message takes the container's lock
+    # too, so none of them can land between copying the messages into the
+    # segment and adopting it
+    with container_lock(kind, container_id):
+        if container_id not in data[kind]:
+            return False
+        container = data[kind][container_id]
+        history = container['messages']
+        archived = len(history if isinstance(history, list) else history.hot) - hot_messages
+        if archived < batch:
+            return False
+
+        if isinstance(history, list):
+            # Stores created before this module existed hold plain lists
+            history = MessageHistory(history)
+            container['messages'] = history
+            persistence.journal('set', (kind, container_id, 'messages'), history)
+
+        cold = history[:history.cold_count() + archived]
+        reacts = {row: list(message['reacts_list'])
+                  for row, message in enumerate(cold) if message['reacts_list']}
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, '%s-%s-%s.seg' % (kind, container_id, uuid.uuid4().hex))
+        write_segment(path, cold)
+
+        history.adopt_segment(path, len(cold), archived, reacts)
+        persistence.journal('invoke', (kind, container_id, 'messages'),
+                            ('adopt_segment', path, len(cold), archived, reacts))
+        return True
+
+
+def archive_cold_messages(archive_dir=ARCHIVE_DIR, hot_messages=HOT_MESSAGES,
+                          batch=ARCHIVE_BATCH):
+    '''
+    Archives the old messages of every channel and dm, then deletes segment
+    files that are no longer used. Returns the number of containers archived.
+    '''
+    archived = 0
+    for kind in ('channel_list', 'dm_list'):
+        for container_id in list(data[kind]):
+            if archive_container(kind, container_id, archive_dir, hot_messages, batch):
+                archived += 1
+    _collect_garbage(archive_dir)
+    return archived
+
+
+def start_archiver(interval=ARCHIVE_INTERVAL, archive_dir=ARCHIVE_DIR):
+    '''
+    Starts a daemon thread that archives old messages every interval seconds.
+    '''
+    def _run():
+        while True:
+            sleep(interval)
+            archive_cold_messages(archive_dir)
+
+    archiver = threading.Thread(target=_run, daemon=True)
+    archiver.start()
+    return archiver
+
+
+######## Helper Functions ########
+
+# Deletes segment files that nothing has referenced since the previous run.
+# The snapshot may still reference a file the store has just stopped using,
+# so a file is only deleted once a compaction has happened since it was last
+# seen in use.
+def _collect_garbage(archive_dir):
+    global _unreferenced
+    if not os.path.isdir(archive_dir):
+        return
+    persistence.compact()
+    referenced = set()
+    for kind in ('channel_list', 'dm_list'):
+        for container in list(data[kind].values()):
+            history = container['messages']
+            if isinstance(history, MessageHistory) and history.segment is not None:
+                referenced.add(os.path.abspath(history.segment_path()))
+
+    unreferenced = set()
+    for name in os.listdir(archive_dir):
+        path = os.path.abspath(os.path.join(archive_dir, name))
+        if name.endswith('.seg') and path not in referenced:
+            if path in _unreferenced:
+                os.remove(path)
+            else:
+                unreferenced.add(path)
+    _unreferenced = unreferenced
+
+
+# Checks a position in a history of the given length, counting negative
+# positions from the end
+def _normalise(position, length):
+    if position < 0:
+        position += length
+    if not 0 <= position < length:
+        raise IndexError('message position out of range')
+    return position
@@ -1,6 +1,12 @@
 import src.error as er
-from src.data import data
-from src.validator import is_token_valid, decode_token, save, load
+from src.data import data, index
+from src.validator import is_token_valid, decode_token, load, forget_tokens
+from src.persistence import journal
+from src.indexes import index_user
+from src.records import User
+from src.notifications import NotificationRing
+from src.sessions import open_session, close_session
+from src.history import record_stats
 import re
 import jwt
 import hashlib
@@ -25,10 +31,8 @@ def auth_login_v2(email, password):
     if not re.search(regexmailex, email):
         raise er.InputError("Invalid email")
     _login_check(email, password)
-    _user_id = data['user_list'][email]['user_id']
-    _new_ses_id = _increment_session_Id()
-    data['user_list'][email]['session_list'].append(_new_ses_id)
-    save(data)
+    _user_id = index['emails'][email]
+    _new_ses_id = open_session(_user_id)
     return {'token': _generate_token(_new_ses_id, _user_id), 'auth_user_id': _user_id}
 
 
@@ -41,9 +45,8 @@ def auth_register_v2(email, password, name_first, name_last):
     if not re.search(regexmailex, email):
         raise er.InputError("Invalid email format")
     #Verifying email isnt already taken
-    for users_email in data['user_list']:
-        if users_email == email:
-            raise er.InputError("Email is already registered")
+    if email in index['emails']:
+        raise er.InputError("Email is already registered")
     # Verifying password longer than 6 characters
     pwlen = len(password)
     if pwlen < 6:
@@ -61,41 +64,35 @@ def auth_register_v2(email, password, name_first, name_last):
     handle = handle.strip()
     handle = handle[0:20]
     handle = handle.lower()
-    for handles in data['user_list']:
-        if handles == handle:
-            # handle_incrementer = (data['user_list'][handles]['handle_rep'])
-            handle += str(data['user_list'][handles]['handle_rep'])
-            data['user_list'][handles]['handle_rep'] += 1
+    handle = _unique_handle(handle)
     _user_id = data['user_id']
-    _new_ses_id = _increment_session_Id()
+    _new_ses_id = open_session(_user_id)
 
     # Generating user info
-    data['user_list'][_user_id] = {
-    'first_name': name_first,
-    'last_name': name_last,
-    'email': email,
-    'password': _hash(password),
-    'user_id': _user_id,
-    'handle_rep': 0,
-    'handle': handle,
-    'in_channels' : [],
-    'session_list': [_new_ses_id],
-    'token': _generate_token(_new_ses_id, _user_id),
-    'in_dms': [],
-    'is_removed': False,
-    'notifications': [],
-    'notification_count': 0,
-    'user_admin': 0,
-    }
+    data['user_list'][_user_id] = User(
+    first_name=name_first,
+    last_name=name_last,
+    email=email,
+    password=_hash(password),
+    user_id=_user_id,
+    handle=handle,
+    in_channels=[],
+    token=_generate_token(_new_ses_id, _user_id),
+    in_dms=[],
+    is_removed=False,
+    notifications=NotificationRing(),
+    user_admin=0,
+    )
     # If registered user is the first user, user will become admin
     if (_user_id == 0):
         data['user_list'][_user_id]['user_admin'] = 1
     
     data['user_id'] += 1
-    data['user_list'][email] = data['user_list'][_user_id]
-    data['user_list'][handle] = data['user_list'][_user_id]
+    index_user(data['user_list'][_user_id])
 
-    save(data)
+    journal('set', ('user_list', _user_id), data['user_list'][_user_id])
+    journal('set', ('user_id',), data['user_id'])
+    record_stats([_user_id])
     return {
         'token': _generate_token(_new_ses_id, _user_id),
         'auth_user_id': _user_id
@@ -111,12 +108,9 @@ def auth_logout_v1(token):
     token_data_struct = decode_token(token)
     token_user_id = token_data_struct['token']['user_id']
     token_ses_id = token_data_struct['token']['session_id']
-    # Finding session Id according to given token and removing it from session list
-    for curr_session in data['user_list'][token_user_id]['session_list']:
-        if curr_session == token_ses_id:
-            data['user_list'][token_user_id]['session_list'].remove(curr_session)
-            save(data)
-            return {'is_success': True}
+    close_session(token_ses_id)
+    forget_tokens(token_user_id, token_ses_id)
+    return {'is_success': True}
 
 
 # Sends a reset code to a given email so that user can reset password
@@ -126,7 +120,7 @@ def auth_passwordreset_request_v1(email):
     reset_code = _random_string()
     data['reset_codes'][reset_code]= email
 
-    save(data)
+    journal('set', ('reset_codes', reset_code), email)
     return reset_code
 
 
@@ -140,13 +134,11 @@ def auth_passwordreset_reset_v1(reset_code, new_password):
     for codes in data['reset_codes']:
         if codes == reset_code:
             email = data['reset_codes'][reset_code]
-            u_id = data['user_list'][email]['user_id']
-            handle = data['user_list'][email]['handle']
-            data['user_list'][email]['password'] = _hash(new_password)
+            u_id = index['emails'][email]
             data['user_list'][u_id]['password'] = _hash(new_password)
-            data['user_list'][handle]['password'] = _hash(new_password)
             data['reset_codes'].pop(reset_code)
-            save(data)
+            journal('set', ('user_list', u_id, 'password'), _hash(new_password))
+            journal('delete', ('reset_codes', reset_code))
             return {}
     raise er.InputError("Invalid reset code")
 
@@ -161,26 +153,32 @@ def _random_string():
 # that the user is allowed to be logged in.
 def _login_check(email, password):
     data = load()
-    for users_email in data['user_list']:
-        # If email is in data
-        if users_email == email:
-            # If password is correct
-            if data['user_list'][email]['password'] == _hash(password):
-                # If user has not been removed
-                if data['user_list'][email]['is_removed'] == False:
-                    return True
-                else:
-                    raise er.AccessError("User has been removed")
+    # If email is in data
+    if email in index['emails']:
+        user = data['user_list'][index['emails'][email]]
+        # If password is correct
+        if user['password'] == _hash(password):
+            # If user has not been removed
+            if user['is_removed'] == False:
+                return True
             else:
-                raise er.InputError("Incorrect Password")
+                raise er.AccessError("User has been removed")
+        else:
+            raise er.InputError("Incorrect Password")
     raise er.InputError("Email not registered")
 
     
-# Helper function which will increment the session id whenever user logs in again
-def _increment_session_Id():
-    data['session_id'] += 1
-    save(data)
-    return data['session_id']
+# Helper function which makes a generated handle unique by appending the
+# number of times it has been taken before. The counts are kept in
+# data['handle_counts'] so registering never has to look through the users.
+def _unique_handle(handle):
+    unique = handle
+    while unique in index['handles']:
+        count = data['handle_counts'].get(handle, 0)
+        unique = handle + str(count)
+        data['handle_counts'][handle] = count + 1
+        journal('set', ('handle_counts', handle), count + 1)
+    return unique
 
 
 # Generates a token given the session id and user id
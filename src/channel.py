@@ -2,8 +2,12 @@ from src.data import data
 from src.validator import is_user_in_channel, is_channel_id_valid, is_token_valid, decode_token, is_user_id_valid
 import src.error as er
 from src.other import notifications_append
-from src.validator import save, load
-from src.validator import valid_react_ids, user_specific_messages
+from src.validator import load
+from src.persistence import journal
+from src.validator import valid_react_ids, user_specific_messages, newest_messages
+from src.validator import messages_before, is_cursor_in_container
+from src.indexes import index_activity
+from src.history import record_stats
 import jwt
 
 SECRET = 'BLINKERTUES3'
@@ -32,7 +36,7 @@ def channel_leave_v1(token, channel_id):
     for user in data['channel_list'][channel_id]['all_members']:
         if user['u_id'] == token_user_id:
             data['channel_list'][channel_id]['all_members'].remove(user)
-    save(data)
+            journal('remove', ('channel_list', channel_id, 'all_members'), user)
     return {}
 
 
@@ -88,7 +92,7 @@ def channel_removeowner_v1(token, channel_id, u_id):
     for user in data['channel_list'][channel_id]['owner_members']:
         if user['u_id'] == u_id:
             data['channel_list'][channel_id]['owner_members'].remove(user)
-    save(data)
+            journal('remove', ('channel_list', channel_id, 'owner_members'), user)
     return {}
 
 '''
@@ -124,7 +128,6 @@ def channel_invite_v2(token, channel_id, u_id):
         'notification_message': "%s added you to %s" % (dm_inviter_handle,
         data['channel_list'][channel_id]['channel_name']),
     }
-    save(data)
     notifications_append(u_id, notification)
     return {}
 
@@ -175,21 +178,18 @@ def channel_messages_v2(token, channel_id, start):
     if len(data['channel_list'][channel_id]['messages']) < start:
         raise er.InputError
 
-    # Creates a new list to return by cloning message list, reversing and cutting it down
-    messages = data['channel_list'][channel_id]['messages'].copy()
-    messages.reverse()
-
     # If there are less than 50 messages, return end point as -1
-    if start + len(data['channel_list'][channel_id]['messages']) < 50:
-        messages = messages[start:]
+    history_length = len(data['channel_list'][channel_id]['messages'])
+    if start + history_length < 50:
+        messages = newest_messages(data['channel_list'][channel_id], start, history_length)
         end = -1
     else:
         end = start + 50
-        messages = messages[start:end]
+        messages = newest_messages(data['channel_list'][channel_id], start, end)
 
-    return_messages = user_specific_messages(messages, auth_user_id)
+    return_messages = user_specific_messages(messages, auth_user_id,
+                                             data['channel_list'][channel_id])
 
-    save(data)
     return {
         'messages': return_messages,
         'start': start,
@@ -197,6 +197,39 @@ def channel_messages_v2(token, channel_id, start):
     }
 
 
+'''
+Provides the 50 messages of a channel sent before the message with message_id
+before, or the 50 most recent messages if before is -1. The returned end is
+the cursor for the next page, or -1 if there are no older messages.
+'''
+def channel_messages_before_v1(token, channel_id, before):
+    if not is_token_valid(token):
+        raise er.AccessError
+
+    token_data_struct = decode_token(token)
+    auth_user_id = token_data_struct['token']['user_id']
+
+    if not is_channel_id_valid(channel_id):
+        raise er.InputError
+
+    if not is_user_in_channel(auth_user_id, channel_id):
+        raise er.AccessError
+
+    # The cursor has to be a message of this channel, though it may have been removed
+    if before != -1 and not is_cursor_in_container(before, 'channel_list', channel_id):
+        raise er.InputError
+
+    messages, end = messages_before('channel_list', channel_id, before)
+    return_messages = user_specific_messages(messages, auth_user_id,
+                                             data['channel_list'][channel_id])
+
+    return {
+        'messages': return_messages,
+        'before': before,
+        'end': end,
+    }
+
+
 '''
 Join a channel given a channel id
 '''
@@ -238,13 +271,16 @@ def _add_member_to_channel(user_id, channel_id):
     data = load()
     data['user_list'][user_id]['in_channels'].append(channel_id)
     data['user_list'][user_id]['in_channels'] = _no_duplicate_channel_id(data['user_list'][user_id]['in_channels'])
+    journal('set', ('user_list', user_id, 'in_channels'), data['user_list'][user_id]['in_channels'])
+    index_activity(user_id)
+    record_stats([user_id])
     new_member = {
         'u_id': user_id,
         'name_first': data['user_list'][user_id]['first_name'],
         'name_lastt': data['user_list'][user_id]['last_name'],
     }
     data['channel_list'][channel_id]['all_members'].append(new_member)
-    save(data)
+    journal('append', ('channel_list', channel_id, 'all_members'), new_member)
 
 
 # Adds user to the owner list of the channel
@@ -256,7 +292,7 @@ def _add_owner_to_channel(user_id, channel_id):
         'owner_last': data['user_list'][user_id]['last_name'],
     }
     data['channel_list'][channel_id]['owner_members'].append(new_owner)
-    save(data)
+    journal('append', ('channel_list', channel_id, 'owner_members'), new_owner)
 
 
 # Checks to see if channel_id is a valid channel
@@ -2,7 +2,12 @@ import src.error as er
 from src.validator import decode_token
 from src.validator import is_token_valid
 from src.channel import channel_details_v2
-from src.validator import save, load
+from src.validator import load
+from src.persistence import journal
+from src.records import Channel
+from src.archive import MessageHistory
+from src.indexes import index_activity
+from src.history import record_stats
 from src.data import data
 
 def channels_create_v2(token, name, is_public):
@@ -27,41 +32,46 @@ def channels_create_v2(token, name, is_public):
         raise er.InputError
 
     #creates dictionary inside channel_list listing details of the channel created
-    data['channel_list'][data['channel_id']] = {
-        'channel_name': name,
-        'channel_id': data['channel_id'],
-        'public_channel': is_public,
-        'owner_members': [
+    data['channel_list'][data['channel_id']] = Channel(
+        channel_name=name,
+        channel_id=data['channel_id'],
+        public_channel=is_public,
+        owner_members=[
             {
             'u_id': token_user_id,
             'owner_first': data['user_list'][token_user_id]['first_name'],
             'owner_last': data['user_list'][token_user_id]['last_name'],
             }
         ],
-        'all_members': [
+        all_members=[
             {
             'u_id': token_user_id,
             'name_first': data['user_list'][token_user_id]['first_name'],
             'name_last': data['user_list'][token_user_id]['last_name']
             }
         ],
-        'messages': [],
-        'pinned_messages': [],
-                'standup':
-            {
-                'active': False,
-                'message': '',
-                'time_start': 0,
-                'time_finish': 0,
-            },
-    }
+        messages=MessageHistory(),
+        pinned_messages={},
+        standup={
+            'active': False,
+            'buffer': [],
+            'time_start': 0,
+            'time_finish': 0,
+            'u_id': -1,
+        },
+    )
 
     #sets variable as channel_id of channel recently created so it returns it
     current_id = data['channel_id']
     data['channel_id_list'].append(data['channel_id'])
     data['user_list'][token_user_id]['in_channels'].append(data['channel_id'])
     data['channel_id'] += 1
-    save(data)
+    journal('set', ('channel_list', current_id), data['channel_list'][current_id])
+    journal('append', ('channel_id_list',), current_id)
+    journal('append', ('user_list', token_user_id, 'in_channels'), current_id)
+    journal('set', ('channel_id',), data['channel_id'])
+    index_activity(token_user_id)
+    record_stats([token_user_id])
     #returns channel_id of channel created
     return {'channel_id': current_id}
 
@@ -92,7 +102,6 @@ def channels_list_v2(token):
         channel_list.append(channel_dict)
 
     #return dictionary with 'channels' as a key
-    save(data)
     return {'channels': channel_list}
 
 def channels_listall_v2(token):
@@ -113,5 +122,4 @@ def channels_listall_v2(token):
             'name': data['channel_list'][channel_id]['channel_name'],
         }
         channel_list.append(details)
-    save(data)
     return {'channels': channel_list}
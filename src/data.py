@@ -1,14 +1,72 @@
-data = {
-    'user_id':0,
-    'channel_id': 0,
-    'message_id' : 0,
-    'user_list': {},
-    'channel_list': {},
-    'channel_id_list': [],
-    'session_id': 0,
-    'dm_id_list': [],
-    "dm_id": 0,
-    "dm_list": {},
-    "reset_codes": {},
+def default_data():
+    '''
+    Returns the layout of an empty store.
+    '''
+    return {
+        'user_id':0,
+        'channel_id': 0,
+        'message_id' : 0,
+        'user_list': {},
+        'channel_list': {},
+        'channel_id_list': [],
+        'session_id': 0,
+        'dm_id_list': [],
+        "dm_id": 0,
+        "dm_list": {},
+        "reset_codes": {},
+        # session_id -> {'user_id', 'issued_at', 'last_seen'} (see src/sessions.py)
+        "sessions": {},
+        # generated handle -> number to append to it the next time it is taken
+        "handle_counts": {},
+        # message_id -> {'message_id', 'u_id', 'channel_id', 'dm_id', 'message',
+        # 'time_sent'} for messages sent with sendlater that are yet to be delivered
+        "scheduled_messages": {},
+        # message_id -> {'kind', 'container_id', 'previous', 'time_created'} for
+        # removed messages, where previous is the message_id of the message just
+        # before it when it was removed (-1 if there was none), so a page cursor
+        # naming a removed message still has a place in its channel or dm
+        "removed_messages": {},
+        # Series of (timestamp, count) points for the stats counters (see
+        # src/history.py)
+        "stats_history": {
+            'workspace': {
+                'channels_exist': [],
+                'dms_exist': [],
+                'messages_exist': [],
+                'users_active': [],
+                'users_exist': [],
+            },
+            'users': {},
+        },
+    }
 
-}
\ No newline at end of file
+
+data = default_data()
+
+# Lookup tables derived from data. They are never persisted and are rebuilt
+# from data whenever the store is restored or cleared (see src/indexes.py).
+index = {
+    # message_id -> (container kind, container id, position in messages), where
+    # the kind is the key of the container's list in data ('channel_list' or
+    # 'dm_list')
+    'messages': {},
+    # (container kind, container id) -> trigram -> message_ids whose
+    # lowercased text contains that three character string
+    'trigrams': {},
+    # user_id -> ids of the user's open sessions
+    'sessions': {},
+    # email -> user_id of the user registered with it
+    'emails': {},
+    # handle -> user_id of the user with that handle
+    'handles': {},
+    # user_id -> message_ids of the user's scheduled messages
+    'scheduled': {},
+    # Running totals for the stats functions: the number of messages that
+    # exist, the number of those sent by each user and the ids of users that
+    # are in at least one channel or dm
+    'stats': {
+        'messages_exist': 0,
+        'messages_sent': {},
+        'active_users': set(),
+    },
+}
@@ -8,9 +8,15 @@ from src.validator import is_user_dm_creator
 from src.validator import decode_token
 from src.validator import is_token_valid
 from src.validator import valid_react_ids
-from src.validator import user_specific_messages
+from src.validator import user_specific_messages, newest_messages
+from src.validator import messages_before, is_cursor_in_container
 from src.other import notifications_append, notifications_msg
-from src.validator import is_user_in_channel, save, load
+from src.validator import is_user_in_channel, load
+from src.persistence import journal
+from src.records import Dm
+from src.archive import MessageHistory
+from src.indexes import unindex_container, index_activity, container_lock
+from src.history import record_stats
 from datetime import timezone, datetime
 
 
@@ -39,14 +45,14 @@ def dm_create_v1(token, u_ids):
     #sorts them in alphabetical order
     sorted_user_handle = sorted(user_handle)
     #creates a dm dictionary listing members, the dm id and the name
-    dm_dict = {
-        'creator_id': data['user_list'][token_user_id]['user_id'],
-        'dm_members': [],
-        'dm_id' : data['dm_id'],
-        'dm_name' : sorted_user_handle,
-        'messages' : [],
-        'pinned_messages': [],
-    }
+    dm_dict = Dm(
+        creator_id=data['user_list'][token_user_id]['user_id'],
+        dm_members=[],
+        dm_id=data['dm_id'],
+        dm_name=sorted_user_handle,
+        messages=MessageHistory(),
+        pinned_messages={},
+    )
     #'dm_members'-add the creator as a member to dm
     creator_dict = {
         'u_id': data['user_list'][token_user_id]['user_id'],
@@ -71,7 +77,6 @@ def dm_create_v1(token, u_ids):
             'notification_message': "%s added you to %s" %
             (data['user_list'][token_user_id]['handle'], dm_name_string),
         }
-        save(data)
         notifications_append(u_id, notification)
     data = load()
 
@@ -94,7 +99,15 @@ def dm_create_v1(token, u_ids):
     #increases dm_id by 1
     data['dm_id'] += 1
 
-    save(data)
+    journal('set', ('dm_list', current_id), dm_dict)
+    journal('append', ('dm_id_list',), current_id)
+    journal('append', ('user_list', token_user_id, 'in_dms'), current_id)
+    for u_id in u_ids:
+        journal('append', ('user_list', u_id, 'in_dms'), current_id)
+    journal('set', ('dm_id',), data['dm_id'])
+    for u_id in [token_user_id] + u_ids:
+        index_activity(u_id)
+    record_stats([token_user_id] + u_ids)
     return {
         'dm_id': current_id,
         'dm_name': dm_name_string
@@ -125,7 +138,6 @@ def dm_list_v1(token):
         }
         dm_list.append(dm_dict)
 
-    save(data)
     #return dictionary with 'channels' as a key.
     return {'dms': dm_list}
 
@@ -153,7 +165,6 @@ def dm_details_v1(token, dm_id):
     dm_name = data['dm_list'][dm_id]['dm_name']
     dm_name_string = ", ".join(dm_name)
 
-    save(data)
     return {
         'name': dm_name_string,
         'members': data['dm_list'][dm_id]['dm_members'],
@@ -208,7 +219,11 @@ def dm_invite_v1(token, dm_id, user_id):
     #add user_id to the 'all_members list.
     #dm_idx = find_dm_index(dm_id)
     data['dm_list'][dm_id]['dm_members'].append(new_member)
-    save(data)
+    journal('append', ('user_list', user_id, 'in_dms'), dm_id)
+    journal('set', ('dm_list', dm_id, 'dm_name'), new_dm_name)
+    journal('append', ('dm_list', dm_id, 'dm_members'), new_member)
+    index_activity(user_id)
+    record_stats([user_id])
     notifications_append(user_id, notification)
 
     return {}
@@ -235,16 +250,24 @@ def dm_remove_v1(token, dm_id):
         raise er.AccessError
 
     #Remove the specific dm dictionary from the dm_list
-    del data['dm_list'][dm_id]
+    with container_lock('dm_list', dm_id):
+        affected_users = unindex_container('dm_list', dm_id)
+        del data['dm_list'][dm_id]
+        journal('delete', ('dm_list', dm_id))
 
     #Remove the specific dm_id from the dm_id_list
     data['dm_id_list'] = [i for i in data['dm_id_list'] if i != dm_id]
+    journal('set', ('dm_id_list',), data['dm_id_list'])
 
     #Remove the dm_id from all the user's 'in_dms' list
     for user in data['user_list']:
-        data['user_list'][user]['in_dms'] = [i for i in
-        data['user_list'][user]['in_dms'] if i != dm_id]
-    save(data)
+        if dm_id in data['user_list'][user]['in_dms']:
+            data['user_list'][user]['in_dms'] = [i for i in
+            data['user_list'][user]['in_dms'] if i != dm_id]
+            journal('set', ('user_list', user, 'in_dms'), data['user_list'][user]['in_dms'])
+            index_activity(user)
+            affected_users.add(user)
+    record_stats(affected_users)
     return {}
 
 
@@ -280,7 +303,11 @@ def dm_leave_v1(token, dm_id):
     #Remove the dm_id from the user's 'in_dms' list.
     data['user_list'][token_user_id]['in_dms'] = [i for i in
     data['user_list'][token_user_id]['in_dms'] if i != dm_id]
-    save(data)
+    journal('set', ('dm_list', dm_id, 'dm_name'), data['dm_list'][dm_id]['dm_name'])
+    journal('set', ('dm_list', dm_id, 'dm_members'), data['dm_list'][dm_id]['dm_members'])
+    journal('set', ('user_list', token_user_id, 'in_dms'), data['user_list'][token_user_id]['in_dms'])
+    index_activity(token_user_id)
+    record_stats([token_user_id])
 
     return {}
 
@@ -314,23 +341,58 @@ def dm_messages_v1(token, dm_id, start):
     if len(data['dm_list'][dm_id]['messages']) < start:
         raise er.InputError("Start position too high")
 
-    # Creates a new list to return by cloning message list, reversing and cutting it down
-    messages = data['dm_list'][dm_id]['messages'].copy()
-    messages.reverse()
-
     # If there are less than 50 messages, return end point as -1
-    if start + len(data['dm_list'][dm_id]['messages']) < 50:
-        messages = messages[start:]
+    history_length = len(data['dm_list'][dm_id]['messages'])
+    if start + history_length < 50:
+        messages = newest_messages(data['dm_list'][dm_id], start, history_length)
         end = -1
     else:
         end = start + 50
-        messages = messages[start:end]
+        messages = newest_messages(data['dm_list'][dm_id], start, end)
 
-    return_messages = user_specific_messages(messages, auth_user_id)
+    return_messages = user_specific_messages(messages, auth_user_id,
+                                             data['dm_list'][dm_id])
 
-    save(data)
     return {
         'messages': return_messages,
         'start': start,
         'end': end,
     }
+
+
+def dm_messages_before_v1(token, dm_id, before):
+    '''
+    DM MESSAGES BEFORE VERSION 1
+
+    A function that returns up to 50 messages of a dm sent before the message with message_id
+    before, or the 50 most recent messages if before is -1. The returned end is the cursor for
+    the next page, or -1 if there are no older messages.
+    '''
+
+    data = load()
+
+    if not is_token_valid(token):
+        raise er.AccessError("Invalid session token")
+
+    token_data_struct = decode_token(token)
+    auth_user_id = token_data_struct['token']['user_id']
+
+    if not is_dm_id_valid(dm_id):
+        raise er.InputError("DM ID is not valid")
+
+    if not is_user_in_dm(auth_user_id, dm_id):
+        raise er.AccessError("User is not in DM")
+
+    # The cursor has to be a message of this dm, though it may have been removed
+    if before != -1 and not is_cursor_in_container(before, 'dm_list', dm_id):
+        raise er.InputError("Message ID is not in this DM")
+
+    messages, end = messages_before('dm_list', dm_id, before)
+    return_messages = user_specific_messages(messages, auth_user_id,
+                                             data['dm_list'][dm_id])
+
+    return {
+        'messages': return_messages,
+        'before': before,
+        'end': end,
+    }
@@ -0,0 +1,125 @@
+'''
+Time series of the stats counters
+
+data['stats_history'] keeps a series of (timestamp, count) points for each of
+the counters behind user_stats_v1 and users_stats_v1:
+
+    'workspace'     metric -> points, for channels_exist, dms_exist,
+                    messages_exist, users_active and users_exist
+    'users'         user_id -> metric -> points, for channels_joined,
+                    dms_joined and messages_sent
+
+A point is added whenever a counter changes, so a dashboard can plot a user's
+involvement or the workspace's utilization over time by reading the series
+instead of replaying every message and membership change. Each count holds
+until the next point in its series.
+
+Series are bounded. Once a series is longer than HISTORY_POINTS, points older
+than HISTORY_RETENTION are dropped (apart from the newest of them, which still
+gives the count at the start of the retained period) and the older half of
+what remains is downsampled by keeping every second point. Recent history
+therefore keeps its full resolution while older history becomes coarser.
+
+Points are journaled by their position in a series, so a series is changed
+and its journal record written under one lock, in the order they happen.
+'''
+import threading
+from time import time
+from src.data import data, index
+from src.persistence import journal
+
+# Number of points a series may hold before it is pruned and downsampled
+HISTORY_POINTS = 1000
+
+# Seconds for which points are kept once a series is pruned
+HISTORY_RETENTION = 90 * 24 * 60 * 60
+
+WORKSPACE_METRICS = ('channels_exist', 'dms_exist', 'messages_exist', 'users_active',
+                     'users_exist')
+USER_METRICS = ('channels_joined', 'dms_joined', 'messages_sent')
+
+# Held while points are added to the series and journaled
+_history_lock = threading.Lock()
+
+
+def record_stats(user_ids=()):
+    '''
+    Adds a point to each workspace series, and each series of the given users,
+    whose counter has changed since its last point.
+    '''
+    with _history_lock:
+        now = int(time())
+        history = data['stats_history']
+        counts = {
+            'channels_exist': len(data['channel_list']),
+            'dms_exist': len(data['dm_list']),
+            'messages_exist': index['stats']['messages_exist'],
+            'users_active': len(index['stats']['active_users']),
+            'users_exist': len(data['user_list']),
+        }
+        for metric in WORKSPACE_METRICS:
+            _record(history['workspace'], ('stats_history', 'workspace'), metric, now,
+                    counts[metric])
+
+        for user_id in user_ids:
+            if user_id not in history['users']:
+                history['users'][user_id] = {metric: [] for metric in USER_METRICS}
+                journal('set', ('stats_history', 'users', user_id), history['users'][user_id])
+            user = data['user_list'][user_id]
+            counts = {
+                'channels_joined': len(user['in_channels']),
+                'dms_joined': len(user['in_dms']),
+                'messages_sent': index['stats']['messages_sent'].get(user_id, 0),
+            }
+            for metric in USER_METRICS:
+                _record(history['users'][user_id], ('stats_history', 'users', user_id), metric,
+                        now, counts[metric])
+
+
+def workspace_history():
+    '''
+    Returns metric -> list of (timestamp, count) for the workspace.
+    '''
+    return {metric: list(data['stats_history']['workspace'].get(metric, []))
+            for metric in WORKSPACE_METRICS}
+
+
+def user_history(user_id):
+    '''
+    Returns metric -> list of (timestamp, count) for a user.
+    '''
+    series = data['stats_history']['users'].get(user_id, {})
+    return {metric: list(series.get(metric, [])) for metric in USER_METRICS}
+
+
+######## Helper Functions ########
+
+# Adds a point to one series if its count has changed. A change within the
+# same second replaces the last point rather than adding another.
+def _record(series_table, path, metric, now, count):
+    series = series_table.setdefault(metric, [])
+    path = path + (metric,)
+    if series and series[-1][1] == count:
+        return
+    if series and series[-1][0] == now:
+        series[-1] = (now, count)
+        journal('set', path + (len(series) - 1,), series[-1])
+        return
+    series.append((now, count))
+    journal('append', path, series[-1])
+    if len(series) > HISTORY_POINTS:
+        series_table[metric] = _downsample(series, now)
+        journal('set', path, series_table[metric])
+
+
+# Drops points older than the retention period, except the newest of them, and
+# keeps every second point of the older half of the rest
+def _downsample(series, now):
+    cutoff = now - HISTORY_RETENTION
+    first = 0
+    while first + 1 < len(series) and series[first + 1][0] < cutoff:
+        first += 1
+    series = series[first:]
+    half = len(series) // 2
+    # Keeps the later point of each pair, which is the count that held longest
+    return series[:half][1::2] + series[half:]
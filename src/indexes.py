@@ -0,0 +1,217 @@
+'''
+Maintenance of the derived lookup tables in src.data.index
+
+Each table is updated in place by the functions that mutate the store, so
+lookups never have to scan the workspace. rebuild_indexes() recomputes every
+table from scratch and is only used after the store is restored or cleared.
+'''
+import bisect
+import threading
+from src.data import data, index
+
+CONTAINER_KINDS = ('channel_list', 'dm_list')
+
+# (container kind, container id) -> lock held while a channel or dm's messages
+# are changed, their index entries updated and the change journaled, so that
+# journal records of one container are written in the order they were made and
+# positions stay valid until they are recorded
+_container_locks = {}
+_container_locks_lock = threading.Lock()
+
+# Length of the substrings message text is indexed by
+GRAM_LENGTH = 3
+
+
+# Returns the lock for a channel or dm's messages, creating it the first time
+# it is needed. It is reentrant so a change can be made up of other changes.
+def container_lock(kind, container_id):
+    with _container_locks_lock:
+        lock = _container_locks.get((kind, container_id))
+        if lock is None:
+            lock = threading.RLock()
+            _container_locks[(kind, container_id)] = lock
+        return lock
+
+
+# Records the location of a message that has just been appended to a container
+def index_message(kind, container_id, message_id, position):
+    index['messages'][message_id] = (kind, container_id, position)
+
+
+# Forgets a message removed from position in a container and shifts the
+# recorded positions of every message that came after it
+def unindex_message(kind, container_id, message_id, position):
+    del index['messages'][message_id]
+    messages = data[kind][container_id]['messages']
+    for new_position in range(position, len(messages)):
+        index['messages'][messages[new_position]['message_id']] = (
+            kind, container_id, new_position)
+
+
+# Forgets every message of a container that is about to be deleted, returning
+# the ids of the users who sent them
+def unindex_container(kind, container_id):
+    senders = set()
+    for message in data[kind][container_id]['messages']:
+        index['messages'].pop(message['message_id'], None)
+        uncount_message(message['u_id'])
+        senders.add(message['u_id'])
+    index['trigrams'].pop((kind, container_id), None)
+    return senders
+
+
+# Counts a message that has just been sent by a user
+def count_message(u_id):
+    index['stats']['messages_exist'] += 1
+    messages_sent = index['stats']['messages_sent']
+    messages_sent[u_id] = messages_sent.get(u_id, 0) + 1
+
+
+# Stops counting a message that has been removed
+def uncount_message(u_id):
+    index['stats']['messages_exist'] -= 1
+    index['stats']['messages_sent'][u_id] -= 1
+
+
+# Records whether a user whose channels or dms have just changed is still in
+# any of them
+def index_activity(user_id):
+    user = data['user_list'][user_id]
+    if user['in_channels'] or user['in_dms']:
+        index['stats']['active_users'].add(user_id)
+    else:
+        index['stats']['active_users'].discard(user_id)
+
+
+# Records the email and handle of a user so either can be looked up directly
+def index_user(user):
+    index['emails'][user['email']] = user['user_id']
+    index['handles'][user['handle']] = user['user_id']
+
+
+# Records a session that has just been opened for a user
+def index_session(user_id, session_id):
+    index['sessions'].setdefault(user_id, set()).add(session_id)
+
+
+# Forgets a session that has been closed
+def unindex_session(user_id, session_id):
+    index['sessions'].get(user_id, set()).discard(session_id)
+
+
+# Records a message that a user has scheduled with sendlater
+def index_scheduled(user_id, message_id):
+    index['scheduled'].setdefault(user_id, set()).add(message_id)
+
+
+# Forgets a scheduled message that has been delivered or cancelled
+def unindex_scheduled(user_id, message_id):
+    index['scheduled'].get(user_id, set()).discard(message_id)
+
+
+# Returns every distinct trigram of a string
+def trigrams(text):
+    return {text[i:i + GRAM_LENGTH] for i in range(len(text) - GRAM_LENGTH + 1)}
+
+
+# Adds the text of a message to the trigram index of its container
+def index_text(kind, container_id, message_id, text):
+    postings = index['trigrams'].setdefault((kind, container_id), {})
+    for gram in trigrams(text.lower()):
+        postings.setdefault(gram, set()).add(message_id)
+
+
+# Removes the text of a message from the trigram index of its container
+def unindex_text(kind, container_id, message_id, text):
+    postings = index['trigrams'].get((kind, container_id), {})
+    for gram in trigrams(text.lower()):
+        message_ids = postings.get(gram)
+        if message_ids is not None:
+            message_ids.discard(message_id)
+            if not message_ids:
+                del postings[gram]
+
+
+# Returns the messages of a container whose lowercased text contains
+# query_str, in the order they were sent
+def search_container(kind, container_id, query_str):
+    messages = data[kind][container_id]['messages']
+    return [messages[position] for position in _candidate_positions(kind, container_id, query_str)
+            if query_str in messages[position]['message'].lower()]
+
+
+# Returns the key messages are ordered by across channels and dms, oldest
+# first: the time a message was delivered, then its container and position.
+# Messages are appended in the order they are delivered, so within a container
+# this is the order of their positions. Message ids are not used since a
+# message sent with sendlater takes its id long before it is delivered.
+def delivery_key(kind, container_id, position, time_created):
+    return (time_created, kind, container_id, position)
+
+
+# Yields (delivery key, message) for the messages of a container whose
+# lowercased text contains query_str, newest first, starting after the
+# delivery key before (or from the newest message if before is None).
+# Messages are only checked as they are consumed, so a caller can stop once it
+# has enough. Positions are in delivery key order, so the candidates after
+# before are found by bisecting rather than by skipping every newer match.
+def search_container_newest(kind, container_id, query_str, before=None):
+    messages = data[kind][container_id]['messages']
+
+    def key_of(position):
+        return delivery_key(kind, container_id, position, messages[position]['time_created'])
+
+    candidates = _candidate_positions(kind, container_id, query_str)
+    if before is not None:
+        candidates = candidates[:bisect.bisect_left(candidates, before, key=key_of)]
+    for position in reversed(candidates):
+        message = messages[position]
+        if query_str in message['message'].lower():
+            yield key_of(position), message
+
+
+# Returns the positions, in ascending order, of the messages of a container
+# that may contain query_str. A matching message has to contain every trigram
+# of the query, so only messages in all of those postings are candidates.
+# Queries too short to have a trigram have every message as a candidate.
+def _candidate_positions(kind, container_id, query_str):
+    if len(query_str) < GRAM_LENGTH:
+        return range(len(data[kind][container_id]['messages']))
+
+    postings = index['trigrams'].get((kind, container_id), {})
+    gram_postings = []
+    for gram in trigrams(query_str):
+        if gram not in postings:
+            return []
+        gram_postings.append(postings[gram])
+    gram_postings.sort(key=len)
+    candidates = gram_postings[0].intersection(*gram_postings[1:])
+    return sorted(index['messages'][message_id][2] for message_id in candidates)
+
+
+def rebuild_indexes():
+    '''
+    Recomputes every lookup table from the resident store.
+    '''
+    index['messages'].clear()
+    index['trigrams'].clear()
+    index['sessions'].clear()
+    index['emails'].clear()
+    index['handles'].clear()
+    index['scheduled'].clear()
+    index['stats']['messages_exist'] = 0
+    index['stats']['messages_sent'].clear()
+    index['stats']['active_users'].clear()
+    for user in data['user_list'].values():
+        index_user(user)
+        index_activity(user['user_id'])
+    for session_id, session in data['sessions'].items():
+        index_session(session['user_id'], session_id)
+    for message_id, scheduled in data['scheduled_messages'].items():
+        index_scheduled(scheduled['u_id'], message_id)
+    for kind in CONTAINER_KINDS:
+        for container_id, container in data[kind].items():
+            for position, message in enumerate(container['messages']):
+                index_message(kind, container_id, message['message_id'], position)
+                index_text(kind, container_id, message['message_id'], message['message'])
+                count_message(message['u_id'])
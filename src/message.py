@@ -4,19 +4,34 @@ src.data imports all data
 src.validator imports importal global helperfunctions
 src.error import types of errors
 '''
+import threading
+from contextlib import contextmanager
 from datetime import timezone, datetime
 from time import mktime
-from time import sleep
-from src.data import data
+from src.data import data, index
 from src.validator import is_user_in_channel, is_channel_id_valid, is_user_id_valid, is_token_valid
 from src.validator import is_user_channel_owner, is_message_id_valid, decode_token, is_user_in_dm
 from src.validator import is_user_dm_creator, channeldm_id_from_message_id
-from src.validator import is_dm_id_valid, save, load, valid_react_ids
+from src.validator import is_dm_id_valid, load, valid_react_ids, authenticate
+from src.validator import get_message_details, message_location
+from src.persistence import journal
+from src.records import Message, React
+from src.indexes import index_message, unindex_message, index_text, unindex_text
+from src.indexes import count_message, uncount_message, index_scheduled, unindex_scheduled
+from src.indexes import container_lock
+from src.history import record_stats
+from src.scheduler import schedule
 from src.validator import is_pinned_message_in_list
 from src.other import notifications_msg, notifications_react
 import src.error as er
 from src.other import notifications_msg
 
+# Held while the next message_id is taken
+_message_id_lock = threading.Lock()
+
+# Held while a scheduled message is stored or taken out of the store, so a message that
+# is cancelled as it is delivered is only taken once
+_scheduled_lock = threading.Lock()
 
 
 def message_send_v2(token, channel_id, message):
@@ -27,27 +42,12 @@ def message_send_v2(token, channel_id, message):
     pertaining to the message into a list of messages for the channel
     '''
     data = load()
-    token_data_struct = decode_token(token)
-    auth_user_id = token_data_struct['token']['user_id']
-
-    _send_message_permission_validator_channel(token, auth_user_id, channel_id, message)
-
-    d_t = datetime.now()
-    new_message = {
-        'message_id': data['message_id'],
-        'u_id': auth_user_id,
-        'message': message,
-        'time_created': int(d_t.replace(tzinfo=timezone.utc).timestamp()),
-        'reacts_list': [],
-        'is_pinned': False,
-    }
+    auth_user_id = authenticate(token)['user_id']
 
-    notifications_msg(message, auth_user_id, -1, channel_id)
-    data = load()
-    data['message_id'] += 1
-    data['channel_list'][channel_id]['messages'].append(new_message)
-    save(data)
+    _send_message_permission_validator_channel(auth_user_id, channel_id, message)
 
+    new_message = _deliver_message('channel_list', channel_id, auth_user_id, message,
+                                   _new_message_id())
 
     return {
         'message_id': new_message['message_id'],
@@ -81,10 +81,6 @@ def message_remove_v1(token, message_id):
             not _does_user_own_message(message_id, auth_user_id)):
             raise er.AccessError("You do not have permission to send messages here")
 
-        for message in data['channel_list'][channel_id]['messages']:
-            if message['message_id'] == message_id:
-                data['channel_list'][channel_id]['messages'].remove(message)
-
     if location_info['channel_id'] == -1:
         dm_id = location_info['dm_id']
 
@@ -93,11 +89,26 @@ def message_remove_v1(token, message_id):
             not _does_user_own_message(message_id, auth_user_id)):
             raise er.AccessError("You do not have permission to send messages here")
 
-        for message in data['dm_list'][dm_id]['messages']:
-            if message['message_id'] == message_id:
-                data['dm_list'][dm_id]['messages'].remove(message)
-
-    save(data)
+    with _locked_message(message_id) as (kind, container_id, position):
+        messages = data[kind][container_id]['messages']
+        removed_message = messages[position]
+        # Remembers where the message sat for pages that use it as their cursor
+        data['removed_messages'][message_id] = {
+            'kind': kind,
+            'container_id': container_id,
+            'previous': messages[position - 1]['message_id'] if position > 0 else -1,
+            'time_created': removed_message['time_created'],
+        }
+        journal('set', ('removed_messages', message_id), data['removed_messages'][message_id])
+        unindex_text(kind, container_id, message_id, removed_message['message'])
+        uncount_message(removed_message['u_id'])
+        del data[kind][container_id]['messages'][position]
+        unindex_message(kind, container_id, message_id, position)
+        journal('delete', (kind, container_id, 'messages', position))
+        if message_id in data[kind][container_id]['pinned_messages']:
+            del data[kind][container_id]['pinned_messages'][message_id]
+            journal('delete', (kind, container_id, 'pinned_messages', message_id))
+    record_stats([removed_message['u_id']])
     return {}
 
 
@@ -138,9 +149,6 @@ def message_edit_v2(token, message_id, message):
             not _does_user_own_message(message_id, auth_user_id)):
             raise er.AccessError("You do not have permission to edit this message")
 
-        for message_dict in data['channel_list'][channel_id]['messages']:
-            if message_dict['message_id'] == message_id:
-                message_dict['message'] = message
 
     elif location_info['channel_id'] == -1:
         dm_id = location_info['dm_id']
@@ -152,11 +160,13 @@ def message_edit_v2(token, message_id, message):
             not _does_user_own_message(message_id, auth_user_id)):
             raise er.AccessError("You do not have permission to edit this message")
 
-        for message_dict in data['dm_list'][dm_id]['messages']:
-            if message_dict['message_id'] == message_id:
-                message_dict['message'] = message
+    with _locked_message(message_id) as (kind, container_id, position):
+        old_message = data[kind][container_id]['messages'][position]
+        unindex_text(kind, container_id, message_id, old_message['message'])
+        old_message['message'] = message
+        index_text(kind, container_id, message_id, message)
+        journal('set', (kind, container_id, 'messages', position, 'message'), message)
 
-    save(data)
     if location_info['dm_id'] == -1:
         notifications_msg(message, auth_user_id, -1, channel_id)
     elif location_info['channel_id'] == -1:
@@ -175,25 +185,10 @@ def message_senddm_v1(token, dm_id, message):
     '''
 
     data = load()
-    token_data_struct = decode_token(token)
-    auth_user_id = token_data_struct['token']['user_id']
-    _send_message_permission_validator_dm(token, auth_user_id, dm_id, message)
-
-    d_t = datetime.now()
-    new_message = {
-        'message_id': data['message_id'],
-        'u_id': auth_user_id,
-        'message': message,
-        'time_created': int(d_t.replace(tzinfo=timezone.utc).timestamp()),
-        'reacts_list': [],
-        'is_pinned': False,
-    }
-    notifications_msg(message, auth_user_id, dm_id, -1)
-    data = load()
-    data['message_id'] += 1
-    data['dm_list'][dm_id]['messages'].append(new_message)
+    auth_user_id = authenticate(token)['user_id']
+    _send_message_permission_validator_dm(auth_user_id, dm_id, message)
 
-    save(data)
+    new_message = _deliver_message('dm_list', dm_id, auth_user_id, message, _new_message_id())
 
     return {
         'message_id': new_message['message_id'],
@@ -214,7 +209,7 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
 
     token_data_struct = decode_token(token)
     auth_user_id = token_data_struct['token']['user_id']
-    og_message = _get_message_details(og_message_id)
+    og_message = get_message_details(og_message_id)
     location_info = channeldm_id_from_message_id(og_message_id)
 
     # If the user isn't in the channel from where it is being sent from
@@ -259,20 +254,21 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
     MESSAGE SEND LATER
 
     Sends a message at a given point in time to a channel. Time is assumed to be in Unix
-    format
+    format. The message_id is returned straight away and the message is delivered by the
+    scheduler once time_sent is reached
     '''
 
     right_now = datetime.now()
-    token_data_struct = decode_token(token)
-    auth_user_id = token_data_struct['token']['user_id']
+    auth_user_id = authenticate(token)['user_id']
 
-    _send_message_permission_validator_channel(token, auth_user_id, channel_id, message)
+    _send_message_permission_validator_channel(auth_user_id, channel_id, message)
 
     if time_sent - int(mktime(right_now.timetuple())) < 0:
         raise er.InputError("Message cannot be sent in the past")
 
-    sleep(time_sent - int(mktime(right_now.timetuple())))
-    return message_send_v2(token, channel_id, message)
+    return {
+        'message_id': _schedule_message(auth_user_id, channel_id, -1, message, time_sent),
+    }
 
 
 
@@ -281,22 +277,104 @@ def message_sendlaterdm_v1(token, dm_id, message, time_sent):
     MESSAGE SEND LATER DM
 
     Sends a message at a given point in time to a DM. Time is assumed to be in Unix
-    format
+    format. The message_id is returned straight away and the message is delivered by the
+    scheduler once time_sent is reached
     '''
 
-    data = load()
     right_now = datetime.now()
-    token_data_struct = decode_token(token)
-    auth_user_id = token_data_struct['token']['user_id']
+    auth_user_id = authenticate(token)['user_id']
 
-    _send_message_permission_validator_dm(token, auth_user_id, dm_id, message)
+    _send_message_permission_validator_dm(auth_user_id, dm_id, message)
 
     if time_sent - int(mktime(right_now.timetuple())) < 0:
         raise er.InputError("Message cannot be sent in the past")
 
-    sleep(time_sent - int(mktime(right_now.timetuple())))
-    save(data)
-    return message_senddm_v1(token, dm_id, message)
+    return {
+        'message_id': _schedule_message(auth_user_id, -1, dm_id, message, time_sent),
+    }
+
+
+
+def message_sendlater_list_v1(token):
+    '''
+    MESSAGE SEND LATER LIST
+
+    Lists the messages the user has scheduled with sendlater or sendlaterdm that are yet
+    to be sent, soonest first
+    '''
+
+    data = load()
+    auth_user_id = authenticate(token)['user_id']
+
+    scheduled = [data['scheduled_messages'][message_id]
+                 for message_id in index['scheduled'].get(auth_user_id, ())]
+    scheduled.sort(key=lambda entry: (entry['time_sent'], entry['message_id']))
+    return {
+        'messages': [{
+            'message_id': entry['message_id'],
+            'channel_id': entry['channel_id'],
+            'dm_id': entry['dm_id'],
+            'message': entry['message'],
+            'time_sent': entry['time_sent'],
+        } for entry in scheduled],
+    }
+
+
+
+def message_sendlater_cancel_v1(token, message_id):
+    '''
+    MESSAGE SEND LATER CANCEL
+
+    Cancels a message scheduled with sendlater or sendlaterdm before it is sent. Only the
+    user who scheduled it can cancel it
+    '''
+
+    data = load()
+    auth_user_id = authenticate(token)['user_id']
+
+    entry = data['scheduled_messages'].get(message_id)
+    if entry is None:
+        raise er.InputError("Message is not waiting to be sent")
+
+    if entry['u_id'] != auth_user_id:
+        raise er.AccessError("You can only cancel messages you scheduled")
+
+    # It may have been sent since it was checked
+    if _unschedule_message(message_id) is None:
+        raise er.InputError("Message is not waiting to be sent")
+    return {}
+
+
+
+def schedule_pending_messages():
+    '''
+    Hands every message in the store that is waiting to be sent to the scheduler. Called
+    once the store has been restored, so messages scheduled before a restart are still
+    sent. Any that became due while the server was down are sent straight away, in the
+    order they were due
+    '''
+
+    data = load()
+    pending = sorted(data['scheduled_messages'].values(),
+                     key=lambda entry: (entry['time_sent'], entry['message_id']))
+    for entry in pending:
+        schedule(entry['time_sent'], _deliver_scheduled_message, entry['message_id'])
+
+
+
+def send_message_as(auth_user_id, channel_id, message):
+    '''
+    SEND MESSAGE AS
+
+    Sends a message to a channel on behalf of a user without a token, for messages the
+    server posts itself such as the summary of a standup
+    '''
+
+    new_message = _deliver_message('channel_list', channel_id, auth_user_id, message,
+                                   _new_message_id())
+    return {
+        'message_id': new_message['message_id'],
+    }
 
 
 
@@ -327,10 +405,10 @@ def message_react_v1(token, message_id, react_id):
         raise er.AccessError("User does not have permission to react")
 
     # Actually react
-    new_react = {
-        'react_id': react_id,
-        'u_id': auth_user_id,
-    }
+    new_react = React(
+        react_id=react_id,
+        u_id=auth_user_id,
+    )
 
     if _has_reacting_user_reacted(message_id, new_react):
         raise er.InputError("User has already reacted to message")
@@ -338,7 +416,7 @@ def message_react_v1(token, message_id, react_id):
     _add_react_to_message(message_id, new_react)
 
     notifications_react(auth_user_id, message_id)
-    # save(data) is called in a helper function. Do not add it in.
+    # The react is journaled in a helper function. Do not add it in.
     return {}
 
 
@@ -347,7 +425,6 @@ def message_unreact_v1(token, message_id, react_id):
     '''
     MESSAGE UNREACT
     '''
-    data = load()
     # Test for invalid token
     if not is_token_valid(token):
         raise er.AccessError
@@ -363,15 +440,14 @@ def message_unreact_v1(token, message_id, react_id):
     if not _can_user_interact(message_id, auth_user_id):
         raise er.AccessError("User does not have permission to unreact")
 
-    new_react = {
-        'react_id': react_id,
-        'u_id': auth_user_id,
-    }
+    new_react = React(
+        react_id=react_id,
+        u_id=auth_user_id,
+    )
     # Test if user has not reacted to the message
     if not _has_reacting_user_reacted(message_id, new_react):
         raise er.InputError("User has not already reacted to message")
 
-    save(data)
     _delete_react_to_message(message_id, new_react)
 
 
@@ -391,12 +467,7 @@ def message_pin_v1(token, message_id):
     location_info = channeldm_id_from_message_id(message_id)
     channel_id = location_info['channel_id']
     dm_id = location_info['dm_id']
-    message_details = _get_message_details(message_id)
-    message = { 
-        'message_id': message_id,
-        'user_pin_id': token_user_id,
-        'message': message_details['message'],
-    }
+    message_details = get_message_details(message_id)
     if dm_id == -1:
         #If user is not a channel owner
         if not is_user_channel_owner(token_user_id, channel_id):
@@ -404,8 +475,9 @@ def message_pin_v1(token, message_id):
         #If message is already pinned in the channel
         if is_pinned_message_in_list(message_details['message'], message_id, -1, channel_id):
             raise er.InputError
-        #Add requested message to pinned messages in channels
-        data['channel_list'][channel_id]['pinned_messages'].append(message)
+        #Add requested message to pinned messages in channels, recording who pinned it
+        data['channel_list'][channel_id]['pinned_messages'][message_id] = token_user_id
+        journal('set', ('channel_list', channel_id, 'pinned_messages', message_id), token_user_id)
     elif channel_id == -1:
         #If user is not dm owner
         if not is_user_dm_creator(token_user_id, dm_id):
@@ -413,9 +485,9 @@ def message_pin_v1(token, message_id):
         #If message is already pinned in dms
         if is_pinned_message_in_list(message_details['message'], message_id, dm_id, -1):
                 raise er.InputError
-        #Add requested message to pinned messages in dms
-        data['dm_list'][dm_id]['pinned_messages'].append(message)
-    save(data)
+        #Add requested message to pinned messages in dms, recording who pinned it
+        data['dm_list'][dm_id]['pinned_messages'][message_id] = token_user_id
+        journal('set', ('dm_list', dm_id, 'pinned_messages', message_id), token_user_id)
     return {}
 
 
@@ -433,7 +505,7 @@ def message_unpin_v1(token, message_id):
     location_info = channeldm_id_from_message_id(message_id)
     channel_id = location_info['channel_id']
     dm_id = location_info['dm_id']
-    message_details = _get_message_details(message_id)
+    message_details = get_message_details(message_id)
     if dm_id == -1:
         #If user is not a channel owner
         if not is_user_channel_owner(token_user_id, channel_id):
@@ -442,8 +514,8 @@ def message_unpin_v1(token, message_id):
         if not is_pinned_message_in_list(message_details['message'], message_id, -1, channel_id):
                 raise er.InputError
         #delete requested message from the pinned messages dictionary in channels
-        data['channel_list'][channel_id]['pinned_messages'] = [i for i in
-        data['channel_list'][channel_id]['pinned_messages'] if not i['message_id'] == message_id]
+        del data['channel_list'][channel_id]['pinned_messages'][message_id]
+        journal('delete', ('channel_list', channel_id, 'pinned_messages', message_id))
     elif channel_id == -1:
         #If user is not dm owner
         if not is_user_dm_creator(token_user_id, dm_id):
@@ -452,31 +524,11 @@ def message_unpin_v1(token, message_id):
         if not is_pinned_message_in_list(message_details['message'], message_id, dm_id, -1):
                 raise er.InputError
         #delete requested message from the pinned messages dictionary in dms
-        data['dm_list'][dm_id]['pinned_messages'] = [i for i in
-        data['dm_list'][dm_id]['pinned_messages'] if not i['message_id'] == message_id]
-    save(data)
+        del data['dm_list'][dm_id]['pinned_messages'][message_id]
+        journal('delete', ('dm_list', dm_id, 'pinned_messages', message_id))
     return {}
 
 
-# Returns the dictionary containing all the information for a message
-# Note this assumes correct/allowed input so security needs to be
-# checked before function is called
-def _get_message_details(message_id):
-    data = load()
-    location = channeldm_id_from_message_id(message_id)
-    if location['dm_id'] == -1:
-        location_id = location['channel_id']
-        for message in data['channel_list'][location_id]['messages']:
-            if message['message_id'] == message_id:
-                return message
-
-    if location['channel_id'] == -1:
-        location_id = location['dm_id']
-        for message in data['dm_list'][location_id]['messages']:
-            if message['message_id'] == message_id:
-                return message
-
-
 # Verifies if a user owns a message OR the user is an owner of
 # the channel where the message is posted
 def _does_user_own_message(message_id, user_id):
@@ -491,18 +543,15 @@ def _does_user_own_message(message_id, user_id):
         if is_user_dm_creator(user_id, location_info['dm_id']):
             return True
 
-    message_dict = _get_message_details(message_id)
+    message_dict = get_message_details(message_id)
     if message_dict['u_id'] == user_id:
         return True
     return False
 
 
 # Verifies common inputs for message sending functions (since there are
-# four extremely similar ones). THIS IS FOR CHANNELS
-def _send_message_permission_validator_channel(token, auth_user_id, channel_id, message):
-
-    if not is_token_valid(token):
-        raise er.AccessError("Invalid token")
+# four extremely similar ones) once the token has been authenticated. THIS IS FOR CHANNELS
+def _send_message_permission_validator_channel(auth_user_id, channel_id, message):
 
     if len(message) > 1000 or len(message) == 0:
         raise er.InputError("Message length needs to be 0 to 1000")
@@ -514,16 +563,10 @@ def _send_message_permission_validator_channel(token, auth_user_id, channel_id,
         not is_user_in_channel(auth_user_id, channel_id)):
         raise er.AccessError("Incorrect permissions")
 
-    if not is_token_valid(token):
-        raise er.AccessError("Invalid token")
-
 
 # Verifies common inputs for message sending functions (since there are
-# four extremely similar ones). THIS IS FOR DMS
-def _send_message_permission_validator_dm(token, auth_user_id, dm_id, message):
-
-    if not is_token_valid(token):
-        raise er.AccessError("Invalid token")
+# four extremely similar ones) once the token has been authenticated. THIS IS FOR DMS
+def _send_message_permission_validator_dm(auth_user_id, dm_id, message):
 
     if not is_dm_id_valid(dm_id):
         raise er.InputError("DM ID is invalid")
@@ -552,43 +595,129 @@ def _can_user_interact(message_id, user_id):
 # Verifies that a user has reacted to a message with the same react_id
 def _has_reacting_user_reacted(message_id, new_react):
 
-    message_info = _get_message_details(message_id)
+    message_info = get_message_details(message_id)
     return new_react in message_info['reacts_list']
 
 
 # Adds reaction information into the message information
 def _add_react_to_message(message_id, react_dict):
     data = load()
-    message_details = channeldm_id_from_message_id(message_id)
+    with _locked_message(message_id) as (kind, container_id, position):
+        message = data[kind][container_id]['messages'][position]
+        # Replaced rather than appended to so that archived messages record it
+        message['reacts_list'] = message['reacts_list'] + [react_dict]
+        journal('set', (kind, container_id, 'messages', position, 'reacts_list'),
+                message['reacts_list'])
 
-    if message_details['dm_id'] == -1:
-        for message in data['channel_list'][message_details['channel_id']]['messages']:
-            if message_id == message['message_id']:
-                message['reacts_list'].append(react_dict)
-
-    if message_details['channel_id'] == -1:
-        for message in data['dm_list'][message_details['dm_id']]['messages']:
-            if message_id == message['message_id']:
-                message['reacts_list'].append(react_dict)
 
-    save(data)
+def _delete_react_to_message(message_id, react_dict):
+    data = load()
+    with _locked_message(message_id) as (kind, container_id, position):
+        message = data[kind][container_id]['messages'][position]
+        message['reacts_list'] = [i for i in
+        message['reacts_list'] if not i['react_id'] == react_dict['react_id'] and
+        i['u_id'] == react_dict['u_id']]
+        journal('set', (kind, container_id, 'messages', position, 'reacts_list'),
+                message['reacts_list'])
+
+
+# Holds the lock of the channel or DM a message is in and gives its (kind, container_id,
+# position), which stays valid until the lock is released. The message may have been
+# removed by another request since it was validated
+@contextmanager
+def _locked_message(message_id):
+    location = index['messages'].get(message_id)
+    if location is None:
+        raise er.InputError("Invalid message ID")
+    kind, container_id, _ = location
+    with container_lock(kind, container_id):
+        if not is_message_id_valid(message_id):
+            raise er.InputError("Invalid message ID")
+        yield message_location(message_id)
 
 
-def _delete_react_to_message(message_id, react_dict):
+# Takes the next message_id
+def _new_message_id():
     data = load()
-    message_details = channeldm_id_from_message_id(message_id)
+    with _message_id_lock:
+        message_id = data['message_id']
+        data['message_id'] += 1
+        journal('set', ('message_id',), data['message_id'])
+    return message_id
 
-    if message_details['dm_id'] == -1:
-        for message in data['channel_list'][message_details['channel_id']]['messages']:
-            if message_id == message['message_id']:
-                message['reacts_list'] = [i for i in
-                message['reacts_list'] if not i['react_id'] == react_dict['react_id'] and
-                i['u_id'] == react_dict['u_id']]
 
-    if message_details['channel_id'] == -1:
-        for message in data['dm_list'][message_details['dm_id']]['messages']:
-            if message_id == message['message_id']:
-                message['reacts_list'] = [i for i in
-                message['reacts_list'] if not i['react_id'] == react_dict['react_id'] and
-                i['u_id'] == react_dict['u_id']]
-    save(data)
+# Adds a message from auth_user_id to the end of a channel or DM, notifying anyone tagged in it
+def _deliver_message(kind, container_id, auth_user_id, message, message_id):
+    data = load()
+    if kind == 'channel_list':
+        notifications_msg(message, auth_user_id, -1, container_id)
+    else:
+        notifications_msg(message, auth_user_id, container_id, -1)
+    with container_lock(kind, container_id):
+        # Timed under the lock so that times never go down along a container
+        d_t = datetime.now()
+        new_message = Message(
+            message_id=message_id,
+            u_id=auth_user_id,
+            message=message,
+            time_created=int(d_t.replace(tzinfo=timezone.utc).timestamp()),
+            reacts_list=[],
+        )
+        data[kind][container_id]['messages'].append(new_message)
+        index_message(kind, container_id, message_id,
+                      len(data[kind][container_id]['messages']) - 1)
+        index_text(kind, container_id, message_id, message)
+        count_message(auth_user_id)
+        journal('append', (kind, container_id, 'messages'), new_message)
+    record_stats([auth_user_id])
+    return new_message
+
+
+# Stores a message to be sent at time_sent and schedules its delivery, returning the
+# message_id it will be sent with
+def _schedule_message(auth_user_id, channel_id, dm_id, message, time_sent):
+    data = load()
+    message_id = _new_message_id()
+    with _scheduled_lock:
+        data['scheduled_messages'][message_id] = {
+            'message_id': message_id,
+            'u_id': auth_user_id,
+            'channel_id': channel_id,
+            'dm_id': dm_id,
+            'message': message,
+            'time_sent': time_sent,
+        }
+        index_scheduled(auth_user_id, message_id)
+        journal('set', ('scheduled_messages', message_id),
+                data['scheduled_messages'][message_id])
+    schedule(time_sent, _deliver_scheduled_message, message_id)
+    return message_id
+
+
+# Removes a scheduled message from the store and returns it, or returns None if it has
+# already been removed. Its job is left with the scheduler and does nothing when it runs
+def _unschedule_message(message_id):
+    data = load()
+    with _scheduled_lock:
+        entry = data['scheduled_messages'].pop(message_id, None)
+        if entry is None:
+            return None
+        unindex_scheduled(entry['u_id'], message_id)
+        journal('delete', ('scheduled_messages', message_id))
+    return entry
+
+
+# Delivers a message sent with sendlater once it is due. Nothing is sent if the message
+# has been cancelled (or already sent), or if its channel or DM no longer exists
+def _deliver_scheduled_message(message_id):
+    data = load()
+    entry = _unschedule_message(message_id)
+    if entry is None:
+        return
+    if entry['dm_id'] == -1:
+        kind, container_id = 'channel_list', entry['channel_id']
+    else:
+        kind, container_id = 'dm_list', entry['dm_id']
+    if container_id not in data[kind]:
+        return
+    _deliver_message(kind, container_id, entry['u_id'], entry['message'], message_id)
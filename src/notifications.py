@@ -0,0 +1,61 @@
+'''
+Per-user notification storage
+
+Each user's notifications are kept in a NotificationRing, a fixed number of
+slots that are written in turn. Once every slot is used, a new notification
+overwrites the oldest one, so adding a notification takes the same time
+however many the user has had, and nothing is ever shifted along.
+
+A ring is changed only through push(), which is journaled as an 'invoke' of
+that method, and it is stored in snapshots as its state.
+'''
+import threading
+
+# Number of notifications kept for each user
+NOTIFICATION_CAPACITY = 19
+
+
+class NotificationRing:
+    '''
+    The most recent notifications of a user. Iterating over it gives them
+    newest first.
+    '''
+
+    def __init__(self, capacity=NOTIFICATION_CAPACITY):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        # Slot the next notification is written to, and the number in use
+        self.next = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        slot = self.next
+        for _ in range(self.count):
+            slot = (slot - 1) % self.capacity
+            yield self.slots[slot]
+
+    def __eq__(self, other):
+        if not isinstance(other, NotificationRing):
+            return NotImplemented
+        return self.capacity == other.capacity and list(self) == list(other)
+
+    __hash__ = None
+
+    def push(self, notification):
+        with self._lock:
+            self.slots[self.next] = notification
+            self.next = (self.next + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
@@ -1,11 +1,22 @@
+import heapq
+from itertools import islice
 import src.error as er
-from src.data import data
+from src.data import data, index
 from src.validator import decode_token
 from src.validator import is_token_valid
 from src.validator import is_user_id_valid
-from src.validator import save, load, user_specific_messages
+from src.validator import load, user_specific_messages, forget_tokens
+from src.persistence import journal, journal_batch
+from src.sessions import close_user_sessions
+from src.indexes import rebuild_indexes, index_text, unindex_text, search_container
+from src.indexes import search_container_newest, index_activity, container_lock
+from src.history import record_stats
+from src.scheduler import cancel_all
 from src.validator import channeldm_id_from_message_id
-from src.validator import get_message_details
+from src.validator import get_message_details, cursor_delivery_key
+
+# Largest number of messages returned by one page of search results
+SEARCH_PAGE_LIMIT = 50
 
 def clear_v1():
     # data = load()
@@ -20,9 +31,18 @@ def clear_v1():
     data['dm_id'] = 0
     data['dm_list'].clear()
     data['reset_codes'].clear()
+    data['sessions'].clear()
+    data['handle_counts'].clear()
+    data['scheduled_messages'].clear()
+    data['removed_messages'].clear()
+    for series in data['stats_history']['workspace'].values():
+        series.clear()
+    data['stats_history']['users'].clear()
+    cancel_all()
+    rebuild_indexes()
 
-    save(data)
-    # print(data)
+    for key in data:
+        journal('set', (key,), data[key])
 
 
 def search_v2(token, query_str):
@@ -47,17 +67,10 @@ def search_v2(token, query_str):
 
 
     for channel_id in data['user_list'][auth_user_id]['in_channels']:
-        for message in data['channel_list'][channel_id]['messages']:
-            if query_str in message['message'].lower():
-                message_list.append(message)
+        message_list.extend(search_container('channel_list', channel_id, query_str))
 
-    data = load()
     for dm_id in data['user_list'][auth_user_id]['in_dms']:
-        for message in data['dm_list'][dm_id]['messages']:
-            if query_str in message['message'].lower():
-                message_list.append(message)
-
-    save(data)
+        message_list.extend(search_container('dm_list', dm_id, query_str))
 
     return_messages = user_specific_messages(message_list, auth_user_id)
 
@@ -68,6 +81,57 @@ def search_v2(token, query_str):
 
 
 
+def search_page_v1(token, query_str, limit, before):
+    '''
+    SEARCH PAGE VERSION 1
+
+    Returns up to limit of the messages that a given query string is in, newest first, that were
+    delivered before the message with message_id before (or the newest matches if before is -1),
+    even if that message has since been removed. The returned end is the cursor for the next
+    page, or -1 if there are no more matches. Searching stops as soon as the page is full.
+    '''
+
+    data = load()
+    if not is_token_valid(token):
+        raise er.AccessError("Invalid token")
+
+    if len(query_str) > 1000 or len(query_str) == 0:
+        raise er.InputError("Query String needs to be between 1 and 1000 characters")
+
+    if limit < 1 or limit > SEARCH_PAGE_LIMIT:
+        raise er.InputError(f"Limit needs to be between 1 and {SEARCH_PAGE_LIMIT}")
+
+    token_data_struct = decode_token(token)
+    auth_user_id = token_data_struct['token']['user_id']
+
+    cursor = None
+    if before != -1:
+        cursor = cursor_delivery_key(before)
+        if cursor is None:
+            raise er.InputError("Before is not a message")
+
+    # Each container yields its matches newest first by delivery key, which
+    # orders messages the same way in every container, so merging them keeps
+    # the matches newest first overall
+    containers = [search_container_newest('channel_list', channel_id, query_str, cursor)
+                  for channel_id in data['user_list'][auth_user_id]['in_channels']]
+    containers += [search_container_newest('dm_list', dm_id, query_str, cursor)
+                   for dm_id in data['user_list'][auth_user_id]['in_dms']]
+    matches = heapq.merge(*containers, key=lambda match: match[0], reverse=True)
+    message_list = [message for _, message in islice(matches, limit + 1)]
+
+    end = -1
+    if len(message_list) > limit:
+        message_list = message_list[:limit]
+        end = message_list[-1]['message_id']
+
+    return {
+        'messages': user_specific_messages(message_list, auth_user_id),
+        'before': before,
+        'end': end,
+    }
+
+
 def admin_user_remove_v1(token, u_id):
     data = load()
     if not is_token_valid(token):
@@ -89,16 +153,25 @@ def admin_user_remove_v1(token, u_id):
     #loop through channels that user is part of
     for channel in data['user_list'][u_id]['in_channels']:
         #loop through messages that user has created
-        for user_message in data['channel_list'][channel]['messages']:
-            #if user created message, change to 'Removed User'
-            if user_message['u_id'] == u_id:
-                user_message['message'] = 'Removed User'
+        with container_lock('channel_list', channel):
+            for idx, user_message in enumerate(data['channel_list'][channel]['messages']):
+                #if user created message, change to 'Removed User'
+                if user_message['u_id'] == u_id:
+                    unindex_text('channel_list', channel, user_message['message_id'], user_message['message'])
+                    user_message['message'] = 'Removed User'
+                    index_text('channel_list', channel, user_message['message_id'], 'Removed User')
+                    journal('set', ('channel_list', channel, 'messages', idx, 'message'),
+                            'Removed User')
 
     #find the dms the user is in and remove every message they sent
     for dm in data['user_list'][u_id]['in_dms']:
-        for user_dm in data['dm_list'][dm]['messages']:
-            if user_dm['u_id'] == u_id:
-                user_dm['message'] = 'Removed User'
+        with container_lock('dm_list', dm):
+            for idx, user_dm in enumerate(data['dm_list'][dm]['messages']):
+                if user_dm['u_id'] == u_id:
+                    unindex_text('dm_list', dm, user_dm['message_id'], user_dm['message'])
+                    user_dm['message'] = 'Removed User'
+                    index_text('dm_list', dm, user_dm['message_id'], 'Removed User')
+                    journal('set', ('dm_list', dm, 'messages', idx, 'message'), 'Removed User')
 
     #delete user from channel_members
     for channel in data['user_list'][u_id]['in_channels']:
@@ -108,6 +181,10 @@ def admin_user_remove_v1(token, u_id):
         if not i['u_id'] == u_id]
         data['user_list'][u_id]['in_channels'] = [i for i in data['user_list'][u_id]['in_channels']
         if not i == channel]
+        journal('set', ('channel_list', channel, 'all_members'),
+                data['channel_list'][channel]['all_members'])
+        journal('set', ('channel_list', channel, 'owner_members'),
+                data['channel_list'][channel]['owner_members'])
         
     #delete user from dm_members
     for dm in data['user_list'][u_id]['in_dms']:
@@ -115,61 +192,54 @@ def admin_user_remove_v1(token, u_id):
         if not i['u_id'] == u_id]
         data['user_list'][u_id]['in_dms'] = [i for i in data['user_list'][u_id]['in_dms']
         if not i == dm]
+        journal('set', ('dm_list', dm, 'dm_members'), data['dm_list'][dm]['dm_members'])
 
     #set is_removed to True so users/all does not print the deleted user
     data['user_list'][u_id]['is_removed'] = True
-    email = data['user_list'][u_id]["email"]
-    data['user_list'][email]['is_removed'] = True
-    handle = data['user_list'][u_id]["handle"]
-    data['user_list'][handle]['is_removed'] = True
-    save(data)
+    journal('set', ('user_list', u_id, 'in_channels'), data['user_list'][u_id]['in_channels'])
+    journal('set', ('user_list', u_id, 'in_dms'), data['user_list'][u_id]['in_dms'])
+    journal('set', ('user_list', u_id, 'is_removed'), True)
+    index_activity(u_id)
+    record_stats([u_id])
+
+    #log the user out of every session
+    close_user_sessions(u_id)
+    forget_tokens(u_id)
 
 
 def notifications_msg(message, user_id, dm_id, channel_id):
     data = load()
+    #the users tagged in the message, each once, in the order they were first tagged
+    tagged_ids = []
+    seen = set()
+    for word in message.split():
+        if word.startswith('@'):
+            tagged_id = index['handles'].get(word[1:])
+            if tagged_id is not None and tagged_id not in seen:
+                seen.add(tagged_id)
+                tagged_ids.append(tagged_id)
+    if not tagged_ids:
+        return
+
+    message_creator_handle = data['user_list'][user_id]['handle']
+    first_20_chars = message[0:20]
     #send msg in channel
     if dm_id == -1:
-        #defining variables
-        channel_member_id = data['channel_list'][channel_id]['all_members']
-        message_creator_handle = data['user_list'][user_id]['handle']
-        channel_name = data['channel_list'][channel_id]['channel_name']
-        first_20_chars = message[0:20]
-        #split the message and iterate through each word
-        for word in message.split():
-        #iterate through each channel_member
-            for member in channel_member_id:
-                #if @user handle is in the message, add to notificatons dictionary of user
-                if word == ('@' + data['user_list'][member['u_id']]['handle']):
-                    notification = {
-                        "channel_id": channel_id,
-                        "dm_id": -1, 
-                        "notification_message": "%s tagged you in %s: %s" % (message_creator_handle, 
-                        channel_name, first_20_chars),
-                    }
-                    save(data)
-                    notifications_append(member['u_id'], notification)
-                    
+        member_ids = {member['u_id'] for member in data['channel_list'][channel_id]['all_members']}
+        name = data['channel_list'][channel_id]['channel_name']
     #send msg in dm
-    else: 
-        dm_member_id = data['dm_list'][dm_id]['dm_members']
-        message_creator_handle = data['user_list'][user_id]['handle']
-        dm_name = ', '.join(data['dm_list'][dm_id]['dm_name'])
-        first_20_chars = message[0:20]
-        # data = load()
-        #split the message and iterate through each word
-        for word in message.split():
-        #iterate through each channel_member
-            for member in dm_member_id:
-                #if @user handle is in the message, add to notificatons dictionary of user
-                if word == ('@' + data['user_list'][member['u_id']]['handle']):
-                    notification = {
-                        "channel_id": -1, 
-                        "dm_id": dm_id, 
-                        "notification_message": "%s tagged you in %s: %s" % (message_creator_handle, 
-                        dm_name, first_20_chars)
-                    }
-                    save(data)
-                    notifications_append(member['u_id'], notification)
+    else:
+        member_ids = {member['u_id'] for member in data['dm_list'][dm_id]['dm_members']}
+        name = ', '.join(data['dm_list'][dm_id]['dm_name'])
+
+    #only members of the channel or dm are notified, all once the message has been read
+    notification_message = "%s tagged you in %s: %s" % (message_creator_handle, name,
+                                                        first_20_chars)
+    notifications_extend([(tagged_id, {
+        "channel_id": channel_id,
+        "dm_id": dm_id,
+        "notification_message": notification_message,
+    }) for tagged_id in tagged_ids if tagged_id in member_ids])
 
 
 def admin_userpermission_change_v1(token, u_id, permission_id):
@@ -185,12 +255,12 @@ def admin_userpermission_change_v1(token, u_id, permission_id):
     
     if (permission_id == 1):
         data['user_list'][u_id]['user_admin'] = 1
-        save(data)
+        journal('set', ('user_list', u_id, 'user_admin'), 1)
         return
 
     elif (permission_id == 2):
         data['user_list'][u_id]['user_admin'] = 0
-        save(data)
+        journal('set', ('user_list', u_id, 'user_admin'), 0)
         return
 
     raise er.InputError
@@ -201,19 +271,17 @@ def users_all_v1(token):
     if not is_token_valid(token):
         raise er.AccessError
     users_all = []
-    num = data['user_id']
-    for user_id in range(num):
-        if data['user_list'][user_id]['is_removed'] == False:
+    for user in data['user_list'].values():
+        if user['is_removed'] == False:
             dictionary = { 
-                'u_id': data['user_list'][user_id]['user_id'],
-                'email': data['user_list'][user_id]['email'],
-                'name_first': data['user_list'][user_id]['first_name'],
-                'name_last': data['user_list'][user_id]['last_name'],
-                'handle_str': data['user_list'][user_id]['handle'],
+                'u_id': user['user_id'],
+                'email': user['email'],
+                'name_first': user['first_name'],
+                'name_last': user['last_name'],
+                'handle_str': user['handle'],
             }
     
             users_all.append(dictionary)
-    save(data)
     return {'users': users_all}
 
 
@@ -223,12 +291,8 @@ def notifications_get_v1(token):
         raise er.AccessError
     token_data_struct = decode_token(token)
     token_user_id = token_data_struct['token']['user_id']
-    new_list = []
-    for i in reversed(data['user_list'][token_user_id]['notifications']):
-        new_list.append(i)
-
     return {
-        'notifications': new_list
+        'notifications': list(data['user_list'][token_user_id]['notifications'])
     }
 
 
@@ -249,7 +313,6 @@ def notifications_react(user_id, message_id):
             "notification_message": "%s reacted to your message in %s" % (message_reactor_handle, 
             channel_name)
         }
-        save(data)
         notifications_append(creator_message, notification)
     #react in dms
     if location['channel_id'] == -1:
@@ -262,7 +325,6 @@ def notifications_react(user_id, message_id):
             "notification_message": "%s reacted to your message in %s" % (message_reactor_handle, 
             dm_name)
         }
-        save(data)
         notifications_append(creator_message, notification)
 
 
@@ -278,12 +340,15 @@ def is_user_admin(u_id):
 
 def notifications_append(u_id, notification):
     data = load()
-    #if user notifications is full add the most recent notifcation and remove the oldest
-    if data['user_list'][u_id]['notification_count'] == 19:
-        (data['user_list'][u_id]['notifications']).pop(0)
-        data['user_list'][u_id]['notifications'].append(notification)
-        save(data)
-    else:
-        data['user_list'][u_id]['notifications'].append(notification)
-        data['user_list'][u_id]['notification_count'] += 1
-    save(data)
+    #the ring keeps the most recent notifications, replacing the oldest once it is full
+    data['user_list'][u_id]['notifications'].push(notification)
+    journal('invoke', ('user_list', u_id, 'notifications'), ('push', notification))
+
+
+def notifications_extend(notifications):
+    data = load()
+    #adds a (u_id, notification) pair for each user at once, journaling them as one record
+    for u_id, notification in notifications:
+        data['user_list'][u_id]['notifications'].push(notification)
+    journal_batch([('invoke', ('user_list', u_id, 'notifications'), ('push', notification))
+                   for u_id, notification in notifications])
@@ -0,0 +1,282 @@
+'''
+Durability layer for the resident datastore
+
+The dictionary in src.data is the single source of truth while the server is
+running and every module reads and writes it in place. This module is the only
+code that touches the disk.
+
+Every mutation of the store is followed by a call to journal(), which appends
+one small record describing that change to an append-only journal. A write
+therefore costs time in proportion to its own size, not to the size of the
+workspace. In the background the journal is periodically folded into the
+snapshot file and truncated, and on startup the snapshot is loaded and any
+journal records newer than it are replayed. Snapshots are written in the
+binary format of src/snapshot.py; pickled snapshots from older versions are
+still read, and stores pickled before the journal existed are upgraded by
+src/upgrade.py.
+
+Journal records are (lsn, op, path, value) tuples where path is a tuple of keys
+leading from the root of the store and op is one of
+    'set'       store[path] = value
+    'append'    store[path].append(value)
+    'remove'    store[path].remove(value)
+    'delete'    del store[path]
+    'link'      store[path] = store[value], keeping both keys on one object
+    'invoke'    store[path].method(*args) where value is (method, *args), for
+                objects that keep their own state such as a MessageHistory
+    'batch'     each (op, path, value) in value in turn, for a group of
+                mutations written with journal_batch() as one record
+'''
+import os
+import pickle
+import struct
+import threading
+from src.data import data, default_data
+from src.indexes import rebuild_indexes
+from src.snapshot import is_snapshot, read_snapshot, write_snapshot
+from src.upgrade import upgrade_store
+
+SNAPSHOT_FILE = 'src/export.p'
+JOURNAL_FILE = 'src/export.journal'
+
+# Number of journal records that triggers an early compaction
+COMPACT_THRESHOLD = 1000
+
+# Seconds between background compactions of a non-empty journal
+COMPACT_INTERVAL = 60
+
+_HEADER = struct.Struct('>I')
+
+_lock = threading.Lock()
+_compact_lock = threading.Lock()
+_compact_due = threading.Event()
+_store = {
+    'snapshot_file': None,
+    'journal_file': None,
+    'journal': None,
+    'lsn': 0,
+    'pending': 0,
+}
+
+
+def journal(op, path, value=None):
+    '''
+    Appends one record describing a mutation that has just been made to the
+    resident store. Does nothing if durability is not enabled.
+    '''
+    with _lock:
+        outfile = _store['journal']
+        if outfile is None:
+            return
+        _store['lsn'] += 1
+        payload = pickle.dumps((_store['lsn'], op, path, value))
+        outfile.write(_HEADER.pack(len(payload)) + payload)
+        outfile.flush()
+        _store['pending'] += 1
+        if _store['pending'] >= COMPACT_THRESHOLD:
+            _compact_due.set()
+
+
+def journal_batch(records):
+    '''
+    Journals several mutations that have just been made, each given as an
+    (op, path, value) tuple, as a single record.
+    '''
+    if records:
+        journal('batch', (), list(records))
+
+
+def restore(snapshot_file=SNAPSHOT_FILE, journal_file=JOURNAL_FILE):
+    '''
+    Loads the last snapshot into the resident store, replays any journal
+    records written after it and starts journaling to the same files.
+    '''
+    with _lock:
+        if _store['journal'] is not None:
+            _store['journal'].close()
+        # Nothing is journaled until the store has been restored, even if
+        # restoring fails
+        _store['journal'] = None
+        if os.path.exists(snapshot_file):
+            lsn, snapshot = _read_snapshot(snapshot_file)
+            data.clear()
+            data.update(snapshot)
+        else:
+            lsn = 0
+            _write_snapshot(snapshot_file, lsn, data)
+
+        pending = 0
+        for record in _read_journal(journal_file):
+            if record[0] > lsn:
+                _apply(data, *record[1:])
+                lsn = record[0]
+                pending += 1
+        rebuild_indexes()
+
+        _store['snapshot_file'] = snapshot_file
+        _store['journal_file'] = journal_file
+        _store['journal'] = open(journal_file, 'ab')
+        _store['lsn'] = lsn
+        _store['pending'] = pending
+
+
+def compact():
+    '''
+    Folds the journal into a new snapshot and truncates it. The new snapshot is
+    built from the old snapshot plus the journal rather than from the live
+    store, so requests can keep mutating the store while this runs.
+    '''
+    with _compact_lock:
+        with _lock:
+            if _store['journal'] is None or _store['pending'] == 0:
+                return
+            snapshot_file = _store['snapshot_file']
+            journal_file = _store['journal_file']
+            folded_size = _store['journal'].tell()
+            folded_lsn = _store['lsn']
+
+        lsn, snapshot = _read_snapshot(snapshot_file)
+        for record in _read_journal(journal_file, folded_size):
+            if record[0] > lsn:
+                _apply(snapshot, *record[1:])
+        _write_snapshot(snapshot_file, folded_lsn, snapshot)
+
+        # Carry over whatever was journaled while the snapshot was written
+        with _lock:
+            _store['journal'].close()
+            with open(journal_file, 'rb') as infile:
+                infile.seek(folded_size)
+                tail = infile.read()
+            temp_file = journal_file + '.tmp'
+            with open(temp_file, 'wb') as outfile:
+                outfile.write(tail)
+            os.replace(temp_file, journal_file)
+            _store['journal'] = open(journal_file, 'ab')
+            _store['pending'] = _store['lsn'] - folded_lsn
+            _compact_due.clear()
+
+
+def close():
+    '''
+    Compacts the journal and detaches the store from its files.
+    '''
+    compact()
+    with _lock:
+        if _store['journal'] is not None:
+            _store['journal'].close()
+        _store['journal'] = None
+        _store['snapshot_file'] = None
+        _store['journal_file'] = None
+
+
+def start_compactor(interval=COMPACT_INTERVAL):
+    '''
+    Starts a daemon thread that compacts the journal every interval seconds,
+    or sooner once COMPACT_THRESHOLD records have built up.
+    '''
+    def _run():
+        while True:
+            _compact_due.wait(interval)
+            compact()
+
+    compactor = threading.Thread(target=_run, daemon=True)
+    compactor.start()
+    return compactor
+
+
+######## Helper Functions ########
+
+# Applies a single journal record to a store
+def _apply(store, op, path, value):
+    if op == 'batch':
+        for record in value:
+            _apply(store, *record)
+        return
+    op, path, value = _upgrade_record(op, path, value)
+    if op is None:
+        return
+    parent = _resolve(store, path[:-1])
+    key = path[-1]
+    if op == 'set':
+        parent[key] = value
+    elif op == 'append':
+        parent[key].append(value)
+    elif op == 'remove':
+        parent[key].remove(value)
+    elif op == 'delete':
+        del parent[key]
+    elif op == 'link':
+        parent[key] = _resolve(store, value)
+    elif op == 'invoke':
+        getattr(parent[key], value[0])(*value[1:])
+
+
+# Translates a record journaled by an earlier version into the current ops.
+# Notifications used to be a list with a separate count: an append is now a
+# push onto the user's ring, and the count and the removal of the oldest
+# notification are dropped, since the ring keeps its own size and push
+# overwrites the oldest notification once it is full.
+def _upgrade_record(op, path, value):
+    if path[0] == 'user_list' and len(path) >= 3:
+        if path[2] == 'notification_count':
+            return None, path, value
+        if path[2] == 'notifications':
+            if op == 'append':
+                return 'invoke', path, ('push', value)
+            if op == 'delete':
+                return None, path, value
+    return op, path, value
+
+
+# Follows a path of keys down from the root of the store
+def _resolve(store, path):
+    node = store
+    for key in path:
+        node = node[key]
+    return node
+
+
+# Yields every complete record in a journal file, stopping at a torn tail
+def _read_journal(journal_file, limit=None):
+    if not os.path.exists(journal_file):
+        return
+    with open(journal_file, 'rb') as infile:
+        contents = infile.read() if limit is None else infile.read(limit)
+    offset = 0
+    while offset + _HEADER.size <= len(contents):
+        (length,) = _HEADER.unpack_from(contents, offset)
+        offset += _HEADER.size
+        if offset + length > len(contents):
+            return
+        yield pickle.loads(contents[offset:offset + length])
+        offset += length
+
+
+# Returns the (lsn, store) pair held in a snapshot file. Parts of the store
+# added since the snapshot was written start out empty, so the journal written
+# after it can be replayed on top.
+def _read_snapshot(snapshot_file):
+    lsn, snapshot = _load_snapshot(snapshot_file)
+    for key, value in default_data().items():
+        snapshot.setdefault(key, value)
+    return lsn, snapshot
+
+
+def _load_snapshot(snapshot_file):
+    if is_snapshot(snapshot_file):
+        return read_snapshot(snapshot_file)
+    # Snapshots written before the binary format existed were pickled
+    with open(snapshot_file, 'rb') as infile:
+        snapshot = pickle.load(infile)
+    # and those written before the journal existed hold the bare store, in the
+    # layout of that time
+    if isinstance(snapshot, dict):
+        return 0, upgrade_store(snapshot)
+    return snapshot
+
+
+# Atomically replaces a snapshot file
+def _write_snapshot(snapshot_file, lsn, store):
+    temp_file = snapshot_file + '.tmp'
+    write_snapshot(temp_file, lsn, store)
+    os.replace(temp_file, snapshot_file)
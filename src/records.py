@@ -0,0 +1,144 @@
+'''
+Compact record types for the entities held in the store
+
+Users, channels, DMs, messages and reacts are the bulk of a large workspace,
+so instead of a dict each one is stored as an instance of a class with
+__slots__. An instance has no per-object key table, and it pickles as its
+class and a tuple of values rather than a dict of field names and values.
+
+Records pickled or snapshotted before a class gained or lost a field are
+read back through the class's _layouts, its earlier field names keyed by how
+many there were, and _upgrade(), which converts the values of a field whose
+type has changed.
+
+Records can still be read and written with record['field'] like the dicts
+they replace, so journal paths and existing lookups keep working. Anything
+returned to a client is built from the fields explicitly, or with to_dict().
+'''
+from src.notifications import NotificationRing
+
+
+class Record:
+    __slots__ = ()
+
+    # Earlier layouts with more fields than __slots__, by number of fields
+    _layouts = {}
+
+    def __init__(self, *values, **fields):
+        if len(values) > len(self.__slots__):
+            layout = self._layouts.get(len(values))
+            if layout is None:
+                raise TypeError('%s takes at most %d values, got %d' % (
+                    type(self).__name__, len(self.__slots__), len(values)))
+            self._fill(dict(zip(layout, values)))
+        else:
+            for key, value in zip(self.__slots__, values):
+                setattr(self, key, value)
+        for key, value in fields.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return (type(self), self._values())
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(
+            '%s=%r' % (key, getattr(self, key)) for key in self.__slots__))
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        '''
+        Returns the record as a plain dict with the same keys.
+        '''
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def _values(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    @classmethod
+    def _from_fields(cls, fields):
+        '''
+        Builds a record from a dict of field names and values, such as one
+        read back from a snapshot written when the class had other fields.
+        Fields the class no longer has are dropped and new ones are None.
+        '''
+        record = cls.__new__(cls)
+        record._fill(fields)
+        return record
+
+    @classmethod
+    def _upgrade(cls, fields):
+        '''
+        Converts the fields of a record written with an earlier layout.
+        '''
+        return fields
+
+    def _fill(self, fields):
+        fields = self._upgrade(fields)
+        for key in self.__slots__:
+            setattr(self, key, fields.get(key))
+
+
+class User(Record):
+    __slots__ = ('first_name', 'last_name', 'email', 'password', 'user_id',
+                 'handle', 'in_channels', 'token', 'in_dms', 'is_removed',
+                 'notifications', 'user_admin')
+
+    _layouts = {
+        13: ('first_name', 'last_name', 'email', 'password', 'user_id',
+             'handle', 'in_channels', 'token', 'in_dms', 'is_removed',
+             'notifications', 'notification_count', 'user_admin'),
+    }
+
+    @classmethod
+    def _upgrade(cls, fields):
+        # Notifications used to be a list, oldest first, kept alongside a
+        # separate notification_count
+        if isinstance(fields.get('notifications'), list):
+            ring = NotificationRing()
+            for notification in fields['notifications']:
+                ring.push(notification)
+            fields = dict(fields, notifications=ring)
+        return fields
+
+
+class Channel(Record):
+    __slots__ = ('channel_name', 'channel_id', 'public_channel', 'owner_members',
+                 'all_members', 'messages', 'pinned_messages', 'standup')
+
+
+class Dm(Record):
+    __slots__ = ('creator_id', 'dm_members', 'dm_id', 'dm_name', 'messages',
+                 'pinned_messages')
+
+
+class Message(Record):
+    __slots__ = ('message_id', 'u_id', 'message', 'time_created', 'reacts_list')
+
+
+class React(Record):
+    __slots__ = ('react_id', 'u_id')
@@ -0,0 +1,125 @@
+'''
+Timed jobs
+
+Work that has to happen at some point in the future, such as delivering a
+message sent with message_sendlater_v1, is scheduled here rather than done by
+sleeping in the thread that handled the request. Jobs are kept in a min-heap
+keyed on the time they are due. A single dispatcher thread sleeps until the
+earliest job is due, runs every job that is due and goes back to sleep, so
+any number of pending jobs share one thread.
+
+The dispatcher is started the first time a job is scheduled.
+'''
+import heapq
+import itertools
+import threading
+import traceback
+from time import time
+
+# (when, job_id, callback, args) for every pending job
+_heap = []
+# job_ids of the jobs in the heap that have not been cancelled
+_pending = set()
+# job_ids of cancelled jobs that are still in the heap
+_cancelled = set()
+_job_ids = itertools.count()
+_condition = threading.Condition()
+_dispatcher = {'thread': None}
+
+
+def schedule(when, callback, *args):
+    '''
+    Arranges for callback(*args) to be called by the dispatcher once the unix
+    time when has passed, and returns a job_id that can be used to cancel it.
+    '''
+    job_id = next(_job_ids)
+    with _condition:
+        heapq.heappush(_heap, (when, job_id, callback, args))
+        _pending.add(job_id)
+        _start_dispatcher()
+        # Wake the dispatcher in case this job is due before the one it is
+        # waiting for
+        _condition.notify()
+    return job_id
+
+
+def cancel(job_id):
+    '''
+    Stops a pending job from running. Does nothing if it has already run.
+    '''
+    with _condition:
+        if job_id in _pending:
+            _pending.discard(job_id)
+            _cancelled.add(job_id)
+
+
+def cancel_all():
+    '''
+    Drops every pending job.
+    '''
+    with _condition:
+        _heap.clear()
+        _pending.clear()
+        _cancelled.clear()
+
+
+def pending_count():
+    return len(_pending)
+
+
+def run_due(now=None):
+    '''
+    Runs every job due at or before now, in order, and returns how many ran.
+    '''
+    if now is None:
+        now = time()
+    ran = 0
+    while True:
+        job = _pop_due(now)
+        if job is None:
+            return ran
+        _run(job)
+        ran += 1
+
+
+######## Helper Functions ########
+
+# Removes and returns the earliest job if it is due, skipping cancelled jobs
+def _pop_due(now):
+    with _condition:
+        while _heap and _heap[0][0] <= now:
+            job = heapq.heappop(_heap)
+            if job[1] in _cancelled:
+                _cancelled.discard(job[1])
+                continue
+            _pending.discard(job[1])
+            return job
+        return None
+
+
+# Runs a job. A job that fails must not stop the dispatcher, so its error is
+# printed and the dispatcher carries on
+def _run(job):
+    _, _, callback, args = job
+    try:
+        callback(*args)
+    except Exception:
+        traceback.print_exc()
+
+
+def _start_dispatcher():
+    if _dispatcher['thread'] is None:
+        _dispatcher['thread'] = threading.Thread(target=_dispatch, daemon=True)
+        _dispatcher['thread'].start()
+
+
+# Sleeps until the earliest job is due, or a new job is scheduled, then runs
+# whatever is due
+def _dispatch():
+    while True:
+        with _condition:
+            if _heap:
+                _condition.wait(max(_heap[0][0] - time(), 0))
+            else:
+                _condition.wait()
+        run_due()
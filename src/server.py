@@ -5,6 +5,9 @@ from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
 import src.error as er
 from src import config
+from src import persistence
+from src import sessions
+from src import archive
 
 from src.auth import auth_login_v2
 from src.auth import auth_register_v2
@@ -17,6 +20,7 @@ from src.user import user_profile_v2
 from src.user import user_profile_setemail_v2
 from src.user import user_profile_sethandle_v1
 from src.user import user_profile_sethandle_v1
+from src.user import user_stats_history_v1, users_stats_history_v1
 
 from src.message import message_send_v2
 from src.message import message_edit_v2
@@ -25,6 +29,8 @@ from src.message import message_share_v1
 from src.message import message_senddm_v1
 from src.message import message_sendlater_v1
 from src.message import message_sendlaterdm_v1
+from src.message import message_sendlater_list_v1, message_sendlater_cancel_v1
+from src.message import schedule_pending_messages
 from src.message import message_react_v1
 from src.message import message_unreact_v1
 from src.message import message_pin_v1
@@ -33,6 +39,7 @@ from src.message import message_unpin_v1
 from src.channel import channel_invite_v2
 from src.channel import channel_details_v2
 from src.channel import channel_messages_v2
+from src.channel import channel_messages_before_v1
 from src.channel import channel_addowner_v1
 from src.channel import channel_leave_v1
 from src.channel import channel_removeowner_v1
@@ -43,6 +50,7 @@ from src.channels import channels_listall_v2
 from src.channels import  channels_list_v2
 
 from src.dm import dm_messages_v1
+from src.dm import dm_messages_before_v1
 from src.dm import dm_list_v1
 from src.dm import dm_details_v1
 from src.dm import dm_invite_v1
@@ -51,6 +59,7 @@ from src.dm import dm_leave_v1
 from src.dm import dm_create_v1
 
 from src.other import search_v2
+from src.other import search_page_v1
 from src.other import notifications_get_v1
 from src.other import admin_user_remove_v1
 from src.other import admin_userpermission_change_v1
@@ -60,6 +69,7 @@ from src.other import users_all_v1
 from src.standup import standup_active_v1
 from src.standup import standup_start_v1
 from src.standup import standup_send_v1
+from src.standup import schedule_active_standups
 
 from flask_mail import Mail, Message
 import smtplib
@@ -158,6 +168,18 @@ def http_profile():
     return dumps(user_profile_v2(token, u_id))
 
 
+@APP.route("/user/stats/history/v1",methods=['GET'])
+def http_user_stats_history():
+    token = request.args.get('token')
+    return dumps(user_stats_history_v1(token))
+
+
+@APP.route("/users/stats/history/v1",methods=['GET'])
+def http_users_stats_history():
+    token = request.args.get('token')
+    return dumps(users_stats_history_v1(token))
+
+
 @APP.route("/user/profile/setname/v2",methods=['PUT'])
 def http_profile_setname():
     payload = request.get_json()
@@ -260,6 +282,17 @@ def http_messages():
     return dumps(channel_messages_v2(token, channel_id, start))
 
 
+# channel_messages_before_v1
+@APP.route("/channel/messages/before/v1",methods=['GET'])
+def http_messages_before():
+    token = request.args.get('token')
+    channel_id = request.args.get('channel_id')
+    channel_id = int(channel_id)
+    before = request.args.get('before', -1)
+    before = int(before)
+    return dumps(channel_messages_before_v1(token, channel_id, before))
+
+
 # channel_addowner_v1
 @APP.route("/channel/addowner/v1", methods=['POST'])
 def http_addowner():
@@ -364,6 +397,22 @@ def http_message_sendlaterdm():
         )
 
 
+@APP.route("/message/sendlater/list/v1", methods=['GET'])
+def http_message_sendlater_list():
+    token = request.args.get('token')
+    return dumps(message_sendlater_list_v1(token))
+
+
+@APP.route("/message/sendlater/cancel/v1", methods=['POST'])
+def http_message_sendlater_cancel():
+    payload = request.get_json()
+    return dumps(message_sendlater_cancel_v1(
+                payload['token'],
+                payload['message_id'],
+            )
+        )
+
+
 @APP.route("/message/react/v1", methods=['POST'])
 def http_message_react():
     payload = request.get_json()
@@ -488,6 +537,17 @@ def http_dm_messages():
             )
         )
 
+
+@APP.route("/dm/messages/before/v1", methods=['GET'])
+def http_dm_messages_before():
+    request_args = dict(request.args)
+    return jsonify(dm_messages_before_v1(
+                request_args['token'],
+                int(request_args['dm_id']),
+                int(request_args.get('before', -1))
+            )
+        )
+
 @APP.route("/standup/start/v1", methods=['POST'])
 def http_standup_start_v1():
     payload = request.get_json()
@@ -526,6 +586,18 @@ def http_other_search():
         )
 
 
+@APP.route("/search/page/v1", methods=['GET'])
+def http_other_search_page():
+    request_args = dict(request.args)
+    return jsonify(search_page_v1(
+                request_args['token'],
+                request_args['query_str'],
+                int(request_args.get('limit', 50)),
+                int(request_args.get('before', -1))
+            )
+        )
+
+
 @APP.route("/clear/v1", methods=['DELETE'])
 def http_clear_v1():
     clear_v1()
@@ -535,4 +607,10 @@ def http_clear_v1():
 
 
 if __name__ == "__main__":
+    persistence.restore()
+    schedule_pending_messages()
+    schedule_active_standups()
+    persistence.start_compactor()
+    sessions.start_sweeper()
+    archive.start_archiver()
     APP.run(port=config.port) # Do not edit this port
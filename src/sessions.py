@@ -0,0 +1,110 @@
+'''
+The session table
+
+Every login opens a session in data['sessions'], which maps each session_id to
+{'user_id', 'issued_at', 'last_seen'}. A token is only valid while its session
+is in the table, so checking one is a single dictionary lookup. Sessions are
+closed by logging out, by the user being removed, or, if SESSION_IDLE_TIMEOUT
+is set, by the sweeper once they have not been used for that long.
+'''
+import threading
+from time import sleep, time
+from src.data import data, index
+from src.persistence import journal
+from src.indexes import index_session, unindex_session
+
+# Seconds a session may go unused before the sweeper closes it, or None to
+# keep sessions until they are logged out. Should be well above
+# LAST_SEEN_RESOLUTION.
+SESSION_IDLE_TIMEOUT = None
+
+# Seconds between sweeps for idle sessions
+SWEEP_INTERVAL = 60
+
+# last_seen is only updated, and journaled, once it is this many seconds old so
+# that checking a token does not write to the journal on every request
+LAST_SEEN_RESOLUTION = 60
+
+
+def open_session(user_id):
+    '''
+    Opens a new session for a user and returns its session_id.
+    '''
+    data['session_id'] += 1
+    session_id = data['session_id']
+    now = int(time())
+    data['sessions'][session_id] = {
+        'user_id': user_id,
+        'issued_at': now,
+        'last_seen': now,
+    }
+    index_session(user_id, session_id)
+    journal('set', ('session_id',), data['session_id'])
+    journal('set', ('sessions', session_id), data['sessions'][session_id])
+    return session_id
+
+
+def is_session_valid(session_id, user_id):
+    '''
+    Checks that a session is open and belongs to the given user, and records
+    that it has just been used.
+    '''
+    session = data['sessions'].get(session_id)
+    if session is None or session['user_id'] != user_id:
+        return False
+    now = int(time())
+    if now - session['last_seen'] >= LAST_SEEN_RESOLUTION:
+        session['last_seen'] = now
+        journal('set', ('sessions', session_id, 'last_seen'), now)
+    return True
+
+
+def close_session(session_id):
+    '''
+    Closes a session if it is open, returning whether it was.
+    '''
+    session = data['sessions'].pop(session_id, None)
+    if session is None:
+        return False
+    unindex_session(session['user_id'], session_id)
+    journal('delete', ('sessions', session_id))
+    return True
+
+
+def close_user_sessions(user_id):
+    '''
+    Closes every session of a user.
+    '''
+    for session_id in list(index['sessions'].get(user_id, ())):
+        close_session(session_id)
+
+
+def sweep_sessions(idle_timeout=None):
+    '''
+    Closes every session that has not been used for idle_timeout seconds,
+    defaulting to SESSION_IDLE_TIMEOUT, and returns how many were closed.
+    '''
+    if idle_timeout is None:
+        idle_timeout = SESSION_IDLE_TIMEOUT
+    if idle_timeout is None:
+        return 0
+    cutoff = int(time()) - idle_timeout
+    stale = [session_id for session_id, session in list(data['sessions'].items())
+             if session['last_seen'] <= cutoff]
+    for session_id in stale:
+        close_session(session_id)
+    return len(stale)
+
+
+def start_sweeper(interval=SWEEP_INTERVAL):
+    '''
+    Starts a daemon thread that closes idle sessions every interval seconds.
+    '''
+    def _run():
+        while True:
+            sleep(interval)
+            sweep_sessions()
+
+    sweeper = threading.Thread(target=_run, daemon=True)
+    sweeper.start()
+    return sweeper
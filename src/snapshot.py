@@ -0,0 +1,347 @@
+'''
+Binary snapshot format
+
+Snapshots of the store are written in a versioned binary format that can be
+opened with mmap and read lazily, so that restoring the server or a read-only
+tool only decodes the parts of the workspace it touches.
+
+    header      magic b'DRMSNAP1', version uint32, lsn uint64, and the
+                offsets of the string table, root and container table (uint64)
+    strings     count uint32, offsets uint64 * count + 1, utf-8 blob
+    root        the store with every channel and dm left out
+    containers  count uint32, then per channel and dm: kind string uint32,
+                id int64, offset uint64, length uint64
+    ...         one encoded value per channel and dm
+
+Every string, whether a key, a name or a message, is stored once in the string
+table and referred to by its index. Values are encoded as a one byte tag
+followed by their contents, with all integers little-endian:
+
+    N T F       None, True, False
+    I           int64               J   an int too big for int64, as a string
+    D           float64
+    S           string index
+    L U E       list, tuple, set    count uint32 then each item
+    M           dict                count uint32 then each key and value
+    R           record              layout string, count uint32, field values
+    O           object              class string, then its __getstate__()
+    P           anything else       length uint32, pickled bytes
+
+Classes are referred to as 'module:name' and imported when first decoded.
+A record's layout string is its class followed by its field names, separated
+by spaces, so the names are stored once per class and each record is decoded
+by name. A record written before a field was added or dropped therefore still
+reads back correctly. Version 1 snapshots stored only the class, and their
+records are read by position.
+Objects of this package with a __setstate__, such as a MessageHistory, are
+stored as their state.
+'''
+import importlib
+import mmap
+import pickle
+import struct
+from src.records import Record
+
+VERSION = 2
+
+# Versions that can still be read
+_READABLE = (1, 2)
+
+_MAGIC = b'DRMSNAP1'
+_HEADER = struct.Struct('<8sIQQQQ')
+_U32 = struct.Struct('<I')
+_I64 = struct.Struct('<q')
+_U64 = struct.Struct('<Q')
+_F64 = struct.Struct('<d')
+_ENTRY = struct.Struct('<IqQQ')
+
+CONTAINER_KINDS = ('channel_list', 'dm_list')
+
+
+def is_snapshot(path):
+    '''
+    Checks whether a file was written in this format rather than pickled.
+    '''
+    with open(path, 'rb') as infile:
+        return infile.read(len(_MAGIC)) == _MAGIC
+
+
+def write_snapshot(path, lsn, store):
+    '''
+    Writes a store and the lsn of the last journal record in it to path.
+    '''
+    strings = _StringTable()
+    root = {key: ({} if key in CONTAINER_KINDS else value) for key, value in store.items()}
+    root_bytes = _encode(root, strings)
+
+    entries = []
+    blobs = []
+    offset = 0
+    for kind in CONTAINER_KINDS:
+        for container_id, container in store.get(kind, {}).items():
+            blob = _encode(container, strings)
+            entries.append((strings.add(kind), container_id, offset, len(blob)))
+            blobs.append(blob)
+            offset += len(blob)
+
+    string_bytes = strings.to_bytes()
+    strings_offset = _HEADER.size
+    root_offset = strings_offset + len(string_bytes)
+    table_offset = root_offset + len(root_bytes)
+    blobs_offset = table_offset + _U32.size + len(entries) * _ENTRY.size
+
+    with open(path, 'wb') as outfile:
+        outfile.write(_HEADER.pack(_MAGIC, VERSION, lsn, strings_offset, root_offset,
+                                   table_offset))
+        outfile.write(string_bytes)
+        outfile.write(root_bytes)
+        outfile.write(_U32.pack(len(entries)))
+        for kind, container_id, offset, length in entries:
+            outfile.write(_ENTRY.pack(kind, container_id, blobs_offset + offset, length))
+        for blob in blobs:
+            outfile.write(blob)
+
+
+class SnapshotReader:
+    '''
+    A snapshot file mapped into memory. Only the header and the container table
+    are read up front; strings, the root and each channel or dm are decoded
+    when they are asked for.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as infile:
+            self._map = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.lsn, strings_offset, self._root_offset,
+         table_offset) = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC:
+            raise ValueError('%s is not a snapshot' % path)
+        if version not in _READABLE:
+            raise ValueError('%s is snapshot version %d, expected %d' % (path, version, VERSION))
+        self.version = version
+
+        (self._string_count,) = _U32.unpack_from(self._map, strings_offset)
+        self._string_offsets = strings_offset + _U32.size
+        self._string_blob = self._string_offsets + (self._string_count + 1) * _U64.size
+        self._strings = {}
+        self._layouts = {}
+
+        self._containers = {kind: {} for kind in CONTAINER_KINDS}
+        (count,) = _U32.unpack_from(self._map, table_offset)
+        for entry in range(count):
+            kind, container_id, offset, length = _ENTRY.unpack_from(
+                self._map, table_offset + _U32.size + entry * _ENTRY.size)
+            self._containers[self.string(kind)][container_id] = (offset, length)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def string(self, number):
+        '''
+        Returns the string with the given index in the string table.
+        '''
+        string = self._strings.get(number)
+        if string is None:
+            start, end = struct.unpack_from('<QQ', self._map,
+                                            self._string_offsets + number * _U64.size)
+            string = self._map[self._string_blob + start:self._string_blob + end].decode('utf-8')
+            self._strings[number] = string
+        return string
+
+    def layout(self, number):
+        '''
+        Returns the (class, field names) of the record layout with the given
+        index in the string table. Version 1 layouts have no field names.
+        '''
+        layout = self._layouts.get(number)
+        if layout is None:
+            name, *fields = self.string(number).split(' ')
+            layout = (_load_class(name), fields if self.version > 1 else None)
+            self._layouts[number] = layout
+        return layout
+
+    def root(self):
+        '''
+        Returns the store with empty channel and dm lists.
+        '''
+        return _Decoder(self, self._root_offset).value()
+
+    def container_ids(self, kind):
+        return list(self._containers[kind])
+
+    def container(self, kind, container_id):
+        '''
+        Decodes a single channel or dm.
+        '''
+        offset, _ = self._containers[kind][container_id]
+        return _Decoder(self, offset).value()
+
+    def store(self):
+        '''
+        Decodes the whole store.
+        '''
+        store = self.root()
+        for kind in CONTAINER_KINDS:
+            store[kind] = {container_id: self.container(kind, container_id)
+                           for container_id in self._containers[kind]}
+        return store
+
+
+def read_snapshot(path):
+    '''
+    Returns the (lsn, store) pair held in a snapshot file.
+    '''
+    with SnapshotReader(path) as reader:
+        return reader.lsn, reader.store()
+
+
+######## Helper Functions ########
+
+# Collects the distinct strings of a snapshot
+class _StringTable:
+    def __init__(self):
+        self._numbers = {}
+        self._strings = []
+
+    def add(self, string):
+        number = self._numbers.get(string)
+        if number is None:
+            number = len(self._strings)
+            self._numbers[string] = number
+            self._strings.append(string)
+        return number
+
+    def to_bytes(self):
+        encoded = [string.encode('utf-8') for string in self._strings]
+        offsets = [0]
+        for string in encoded:
+            offsets.append(offsets[-1] + len(string))
+        return b''.join([_U32.pack(len(encoded))] +
+                        [_U64.pack(offset) for offset in offsets] + encoded)
+
+
+# Encodes a value into bytes, adding its strings to the string table
+def _encode(value, strings):
+    out = []
+    _encode_into(value, strings, out)
+    return b''.join(out)
+
+
+def _encode_into(value, strings, out):
+    # bool is checked before int since it is a subclass of it
+    if value is None:
+        out.append(b'N')
+    elif value is True:
+        out.append(b'T')
+    elif value is False:
+        out.append(b'F')
+    elif type(value) is int:
+        if -2 ** 63 <= value < 2 ** 63:
+            out.append(b'I' + _I64.pack(value))
+        else:
+            out.append(b'J' + _U32.pack(strings.add(str(value))))
+    elif type(value) is float:
+        out.append(b'D' + _F64.pack(value))
+    elif type(value) is str:
+        out.append(b'S' + _U32.pack(strings.add(value)))
+    elif type(value) in (list, tuple, set):
+        tag = {list: b'L', tuple: b'U', set: b'E'}[type(value)]
+        out.append(tag + _U32.pack(len(value)))
+        for item in value:
+            _encode_into(item, strings, out)
+    elif type(value) is dict:
+        out.append(b'M' + _U32.pack(len(value)))
+        for key, item in value.items():
+            _encode_into(key, strings, out)
+            _encode_into(item, strings, out)
+    elif isinstance(value, Record):
+        values = value._values()
+        layout = ' '.join((_class_name(value),) + type(value).__slots__)
+        out.append(b'R' + _U32.pack(strings.add(layout)) + _U32.pack(len(values)))
+        for item in values:
+            _encode_into(item, strings, out)
+    elif type(value).__module__.startswith('src.') and hasattr(value, '__setstate__'):
+        out.append(b'O' + _U32.pack(strings.add(_class_name(value))))
+        _encode_into(value.__getstate__(), strings, out)
+    else:
+        pickled = pickle.dumps(value)
+        out.append(b'P' + _U32.pack(len(pickled)) + pickled)
+
+
+def _class_name(value):
+    return '%s:%s' % (type(value).__module__, type(value).__qualname__)
+
+
+def _load_class(name, cache={}):
+    cls = cache.get(name)
+    if cls is None:
+        module, qualname = name.split(':')
+        cls = getattr(importlib.import_module(module), qualname)
+        cache[name] = cls
+    return cls
+
+
+# Decodes one value starting at an offset into a snapshot
+class _Decoder:
+    def __init__(self, reader, offset):
+        self._reader = reader
+        self._map = reader._map
+        self._offset = offset
+
+    def value(self):
+        tag = self._map[self._offset:self._offset + 1]
+        self._offset += 1
+        if tag == b'N':
+            return None
+        if tag == b'T':
+            return True
+        if tag == b'F':
+            return False
+        if tag == b'I':
+            return self._unpack(_I64)
+        if tag == b'J':
+            return int(self._reader.string(self._unpack(_U32)))
+        if tag == b'D':
+            return self._unpack(_F64)
+        if tag == b'S':
+            return self._reader.string(self._unpack(_U32))
+        if tag == b'L':
+            return [self.value() for _ in range(self._unpack(_U32))]
+        if tag == b'U':
+            return tuple(self.value() for _ in range(self._unpack(_U32)))
+        if tag == b'E':
+            return {self.value() for _ in range(self._unpack(_U32))}
+        if tag == b'M':
+            items = {}
+            for _ in range(self._unpack(_U32)):
+                key = self.value()
+                items[key] = self.value()
+            return items
+        if tag == b'R':
+            cls, fields = self._reader.layout(self._unpack(_U32))
+            values = [self.value() for _ in range(self._unpack(_U32))]
+            if fields is None:
+                return cls(*values)
+            return cls._from_fields(dict(zip(fields, values)))
+        if tag == b'O':
+            cls = _load_class(self._reader.string(self._unpack(_U32)))
+            value = cls.__new__(cls)
+            value.__setstate__(self.value())
+            return value
+        if tag == b'P':
+            length = self._unpack(_U32)
+            value = pickle.loads(self._map[self._offset:self._offset + length])
+            self._offset += length
+            return value
+        raise ValueError('unknown tag %r at offset %d' % (tag, self._offset - 1))
+
+    def _unpack(self, layout):
+        (value,) = layout.unpack_from(self._map, self._offset)
+        self._offset += layout.size
+        return value
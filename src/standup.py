@@ -1,6 +1,7 @@
 '''
 datetime module for message send times
-threading module for delaying code activation
+src.scheduler for ending standups once their time is up
+threading module for the per channel standup locks
 src.data imports all data
 src.validator imports importal global helperfunctions
 src.error import types of errors
@@ -10,10 +11,17 @@ import threading
 from datetime import timezone, datetime
 from src.validator import is_user_in_channel, is_channel_id_valid, is_token_valid
 from src.validator import decode_token
-from src.validator import save, load
-from src.message import message_send_v2
+from src.validator import load
+from src.persistence import journal
+from src.message import send_message_as
+from src.scheduler import schedule
 import src.error as er
 
+# channel_id -> lock held while a channel's standup is started, added to or ended, so
+# that standups in different channels never wait on each other
+_standup_locks = {}
+_standup_locks_lock = threading.Lock()
+
 
 def standup_start_v1(token, channel_id, length):
     '''
@@ -38,18 +46,22 @@ def standup_start_v1(token, channel_id, length):
     if not is_token_valid(token):
         raise er.AccessError("Invalid token")
 
-    data['channel_list'][channel_id]['standup']['active'] = True
-
-    d_t = datetime.now()
-    d_t = int(d_t.replace(tzinfo=timezone.utc).timestamp())
-
-    data['channel_list'][channel_id]['standup']['message'] = ''
-    data['channel_list'][channel_id]['standup']['time_start'] = (d_t)
-    data['channel_list'][channel_id]['standup']['time_finish'] = _stand_up_finish_time(d_t, length)
-
-    standup_message = threading.Thread(target=_channel_standup, args=(token, channel_id, length))
-    standup_message.start()
-    save(data)
+    d_t = _standup_time()
+
+    with _standup_lock(channel_id):
+        # Another request may have started a standup since it was checked above
+        if _is_channel_standup_active(channel_id):
+            raise er.InputError("Channel has current active standup")
+        data['channel_list'][channel_id]['standup'] = {
+            'active': True,
+            'buffer': [],
+            'time_start': d_t,
+            'time_finish': _stand_up_finish_time(d_t, length),
+            'u_id': auth_user_id,
+        }
+        journal('set', ('channel_list', channel_id, 'standup'),
+                data['channel_list'][channel_id]['standup'])
+    schedule(time.time() + length, _channel_standup, channel_id)
     return {
         'time_finish': data['channel_list'][channel_id]['standup']['time_finish'],
     }
@@ -113,17 +125,32 @@ def standup_send_v1(token, channel_id, message):
     user_handle = data['user_list'][token_user_id]['handle']
     user_message = "{}: {}".format(user_handle, message)
 
-    standup_message = data['channel_list'][channel_id]['standup']['message']
-    if not standup_message:
-        standup_message = standup_message + user_message
-    else:
-        standup_message = '\n'.join([standup_message, user_message])
-
-    data['channel_list'][channel_id]['standup']['message'] = standup_message
-    save(data)
+    # Lines are only joined into one message when the standup ends
+    with _standup_lock(channel_id):
+        # The standup may have ended since it was checked above
+        if not _is_channel_standup_active(channel_id):
+            raise er.InputError("Channel has no running standup")
+        data['channel_list'][channel_id]['standup']['buffer'].append(user_message)
+        journal('append', ('channel_list', channel_id, 'standup', 'buffer'), user_message)
     return {}
 
 
+def schedule_active_standups():
+
+    '''
+    SCHEDULE ACTIVE STANDUPS
+
+    Hands the end of every standup that is still active in the store to the scheduler.
+    Called once the store has been restored, so standups running when the server stopped
+    are still sent. Any whose time ran out while the server was down end straight away.
+    '''
+    data = load()
+    for channel_id, channel in data['channel_list'].items():
+        if channel['standup']['active']:
+            remaining = channel['standup']['time_finish'] - _standup_time()
+            schedule(time.time() + remaining, _channel_standup, channel_id)
+
+
 ######## Helper Functions ########
 
 # Checks if channel has a current standup active
@@ -136,17 +163,38 @@ def _stand_up_finish_time(d_t, length):
     end_time = (d_t) + (length)
     return end_time
 
-# Function begins the channel standup, sending the message ultilising message_send_v2
-def _channel_standup(token, channel_id, length):
-    data = load()
-    #Delay the code until the time length is reached
-    time.sleep(length)
-    data = load()
-    message_list = data['channel_list'][channel_id]['standup']['message']
-
-    data['channel_list'][channel_id]['standup']['active'] = False
-    data['channel_list'][channel_id]['standup']['time_finish'] = None
+# Returns the lock for a channel's standup, creating it the first time it is needed
+def _standup_lock(channel_id):
+    with _standup_locks_lock:
+        lock = _standup_locks.get(channel_id)
+        if lock is None:
+            lock = threading.Lock()
+            _standup_locks[channel_id] = lock
+        return lock
+
+# The current time in the form standups are timed with
+def _standup_time():
+    d_t = datetime.now()
+    return int(d_t.replace(tzinfo=timezone.utc).timestamp())
 
-    save(data)
+# Ends a channel standup once its time is up, sending the collected messages to the
+# channel as the user who started it. Run by the scheduler
+def _channel_standup(channel_id):
+    data = load()
+    if channel_id not in data['channel_list']:
+        return
+    # Closing the standup and taking its buffer happen together, so every line is either
+    # in this message or was refused because the standup had ended
+    with _standup_lock(channel_id):
+        if not _is_channel_standup_active(channel_id):
+            return
+        standup = data['channel_list'][channel_id]['standup']
+        message_list = standup['buffer']
+
+        standup['active'] = False
+        standup['time_finish'] = None
+        standup['buffer'] = []
+
+        journal('set', ('channel_list', channel_id, 'standup'), standup)
     if message_list:
-        return message_send_v2(token, channel_id, message_list)
+        send_message_as(standup['u_id'], channel_id, '\n'.join(message_list))
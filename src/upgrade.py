@@ -0,0 +1,86 @@
+'''
+Upgrades stores pickled before the journal existed
+
+Those versions pickled the whole store on every change, with every entity a
+plain dict. When such a store is read it is brought up to the current layout:
+
+    - user_list also held each user under their email and handle; those keys
+      are dropped, since users are looked up through src.indexes instead
+    - users, channels, dms, messages and reacts become records, and each
+      user's notification list becomes a NotificationRing
+    - each user's session_list becomes entries in data['sessions'], and the
+      handle_rep counter of a handle becomes data['handle_counts']
+    - pinned_messages becomes a map of message_id to the user who pinned it
+    - a standup's joined 'message' becomes its buffer of lines
+
+Entities that already have the current layout are left as they are.
+'''
+from time import time
+from src.records import User, Channel, Dm, Message, React
+
+
+def upgrade_store(store):
+    '''
+    Converts a pickled store to the current layout in place and returns it.
+    '''
+    users = store.get('user_list', {})
+    for key in [key for key in users if not isinstance(key, int)]:
+        del users[key]
+    for user_id, user in users.items():
+        if isinstance(user, dict):
+            users[user_id] = _upgrade_user(store, user)
+
+    for kind, record in (('channel_list', Channel), ('dm_list', Dm)):
+        containers = store.get(kind, {})
+        for container_id, container in containers.items():
+            if isinstance(container, dict):
+                containers[container_id] = _upgrade_container(record, container)
+    return store
+
+
+######## Helper Functions ########
+
+# Converts a user dict, moving its sessions and handle counter into the store
+def _upgrade_user(store, user):
+    now = int(time())
+    sessions = store.setdefault('sessions', {})
+    for session_id in user.get('session_list', ()):
+        sessions.setdefault(session_id, {
+            'user_id': user['user_id'],
+            'issued_at': now,
+            'last_seen': now,
+        })
+    if user.get('handle_rep'):
+        store.setdefault('handle_counts', {}).setdefault(user['handle'], user['handle_rep'])
+    return User._from_fields(user)
+
+
+# Converts a channel or dm dict along with its messages, pins and standup
+def _upgrade_container(record, container):
+    container = dict(container)
+    container['messages'] = [_upgrade_message(message) for message in container['messages']]
+    pinned = container.get('pinned_messages', {})
+    if isinstance(pinned, list):
+        container['pinned_messages'] = {pin['message_id']: pin['user_pin_id'] for pin in pinned}
+    standup = container.get('standup')
+    if standup is not None and 'message' in standup:
+        # The user who started the standup was not stored, so its summary is
+        # sent by the first owner of the channel
+        owners = container.get('owner_members', [])
+        container['standup'] = {
+            'active': standup['active'],
+            'buffer': standup['message'].split('\n') if standup['message'] else [],
+            'time_start': standup['time_start'],
+            'time_finish': standup['time_finish'],
+            'u_id': owners[0]['u_id'] if owners else -1,
+        }
+    return record._from_fields(container)
+
+
+def _upgrade_message(message):
+    if not isinstance(message, dict):
+        return message
+    message = dict(message)
+    message['reacts_list'] = [React._from_fields(react) if isinstance(react, dict) else react
+                              for react in message['reacts_list']]
+    return Message._from_fields(message)
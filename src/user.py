@@ -1,7 +1,9 @@
-from src.data import data
+from src.data import data, index
 from src.validator import is_token_valid
 from src.validator import is_user_id_valid
-from src.validator import decode_token, load, save
+from src.validator import decode_token, load
+from src.persistence import journal
+from src.history import user_history, workspace_history
 from datetime import datetime
 import src.error as er
 import re
@@ -17,7 +19,6 @@ def user_profile_v2(token, u_id):
         raise er.AccessError("Invalid Token")
     if not is_user_id_valid(u_id):
         raise er.InputError("Invalid user_id")
-    save(data)
     return {
         "user": {
             "u_id": u_id,
@@ -47,12 +48,10 @@ def user_profile_setname_v2(token, name_first, name_last):
         raise er.InputError("Invalid last name length")
 
     token_user_id = token_data_struct['token']['user_id']
-    email = data['user_list'][token_user_id]['email'] 
-
     data['user_list'][token_user_id]['first_name'] = name_first
     data['user_list'][token_user_id]['last_name'] = name_last
-    data['user_list'][email] = data['user_list'][token_user_id]
-    save(data)
+    journal('set', ('user_list', token_user_id, 'first_name'), name_first)
+    journal('set', ('user_list', token_user_id, 'last_name'), name_last)
     return { 
     }
 
@@ -65,20 +64,19 @@ def user_profile_setemail_v2(token, email):
     if not re.search(regexmailex, email):
         raise er.InputError("Invalid email format")
     #Verifying email isnt already taken
-    for users_email in data['user_list']:
-        if users_email == email:
-            raise er.InputError("Email is already used")
+    if email in index['emails']:
+        raise er.InputError("Email is already used")
 
     token_data_struct = decode_token(token)
     token_user_id = token_data_struct['token']['user_id']
 
     old_email = data['user_list'][token_user_id]['email'] 
-    data['user_list'].pop(old_email)
+    del index['emails'][old_email]
 
     data['user_list'][token_user_id]['email'] = email
-    data['user_list'][email] = data['user_list'][token_user_id]
+    index['emails'][email] = token_user_id
 
-    save(data)
+    journal('set', ('user_list', token_user_id, 'email'), email)
     return {
     }
 
@@ -91,17 +89,18 @@ def user_profile_sethandle_v1(token, handle_str):
     handle_len = len(handle_str)
     if not (handle_len >= 3 and handle_len <= 20):
         raise er.InputError("Invalid handle length")
-    for handles in data['user_list']:
-        if handles == handle_str:
-            raise er.InputError("Handle is taken")
+    if handle_str in index['handles']:
+        raise er.InputError("Handle is taken")
     token_data_struct = decode_token(token)
     token_user_id = token_data_struct['token']['user_id']
     
+    old_handle = data['user_list'][token_user_id]['handle']
+    del index['handles'][old_handle]
+
     data['user_list'][token_user_id]['handle'] = handle_str
-    data['user_list'][handle_str] = data['user_list'][token_user_id]
+    index['handles'][handle_str] = token_user_id
 
-    data['user_list'].pop(handle_str)
-    save(data)
+    journal('set', ('user_list', token_user_id, 'handle'), handle_str)
     return {
     }
 
@@ -116,24 +115,9 @@ def user_stats_v1(token):
 
     date_time = int(datetime.timestamp(datetime.now()))
 
-    num_channels = 0
-    for channel in data['user_list'][token_user_id]['in_channels']:
-        num_channels += 1
-
-    num_dms = 0
-    for dm in data['user_list'][token_user_id]['in_dms']:
-        num_dms +=1
-
-    num_messages = 0
-    for channel in data["channel_list"]:
-        for message in data["channel_list"][channel]["messages"]:
-            if message["u_id"] == token_user_id:
-                num_messages += 1
-
-    for dm in data["dm_list"]:
-        for message in data["dm_list"][dm]["messages"]:
-            if message["u_id"] == token_user_id:
-                num_messages += 1
+    num_channels = len(data['user_list'][token_user_id]['in_channels'])
+    num_dms = len(data['user_list'][token_user_id]['in_dms'])
+    num_messages = index['stats']['messages_sent'].get(token_user_id, 0)
 
     numerator = num_channels + num_dms + num_messages
     denominator = len(data["channel_list"]) + len(data["dm_list"]) + (data["message_id"])
@@ -171,35 +155,15 @@ def users_stats_v1(token):
     if not is_token_valid(token):
         raise er.AccessError
 
-    token_data_struct = decode_token(token)
-    token_user_id = token_data_struct['token']['user_id']
-
-
     date_time = int(datetime.timestamp(datetime.now()))
 
-    num_user = 0
-    user_joined = False
-    for _ in data["user_list"]:
-        for channel in data["channel_list"]:
-            for user in data["channel_list"][channel]['all_members']:
-                if token_user_id == user['u_id']:
-                    user_joined = True
+    num_messages = index['stats']['messages_exist']
 
-        if len(data['user_list'][token_user_id]['in_dms']) > 0:
-            user_joined = True
-        if user_joined is True:
-            num_user += 1
-
-    num_messages = 0
-    for channel in data["channel_list"]:
-        for _ in data["channel_list"][channel]["messages"]:
-                num_messages += 1
-
-    for dm in data["dm_list"]:
-        for _ in data["dm_list"][dm]["messages"]:
-                num_messages += 1
-
-    utilization_rate = num_user/len(data["user_list"])
+    #Users who are in at least one channel or dm
+    if data["user_list"]:
+        utilization_rate = len(index['stats']['active_users'])/len(data["user_list"])
+    else:
+        utilization_rate = 0
 
     channels_exist = {
         "num_channels_exist": len(data["channel_list"]),
@@ -220,3 +184,41 @@ def users_stats_v1(token):
         'messages_exist': [{messages_exist['num_messages_exist'], messages_exist['time_stamp']}],
         'utilization_rate': utilization_rate
     }
+
+
+# Returns the points of a user's stats series, oldest first
+def user_stats_history_v1(token):
+    if not is_token_valid(token):
+        raise er.AccessError
+
+    token_data_struct = decode_token(token)
+    token_user_id = token_data_struct['token']['user_id']
+
+    history = user_history(token_user_id)
+    return {
+        'channels_joined': _series_points(history['channels_joined'], 'num_channels_joined'),
+        'dms_joined': _series_points(history['dms_joined'], 'num_dms_joined'),
+        'messages_sent': _series_points(history['messages_sent'], 'num_messages_sent'),
+    }
+
+
+# Returns the points of the workspace's stats series, oldest first
+def users_stats_history_v1(token):
+    if not is_token_valid(token):
+        raise er.AccessError
+
+    history = workspace_history()
+    return {
+        'channels_exist': _series_points(history['channels_exist'], 'num_channels_exist'),
+        'dms_exist': _series_points(history['dms_exist'], 'num_dms_exist'),
+        'messages_exist': _series_points(history['messages_exist'], 'num_messages_exist'),
+        'users_active': _series_points(history['users_active'], 'num_users_active'),
+        'users_exist': _series_points(history['users_exist'], 'num_users_exist'),
+    }
+
+
+######## Helper Functions ########
+
+# Turns (timestamp, count) points into the dicts returned to clients
+def _series_points(series, count_key):
+    return [{count_key: count, 'time_stamp': time_stamp} for time_stamp, count in series]
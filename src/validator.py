@@ -1,54 +1,92 @@
-from src.data import data
+import threading
+from collections import OrderedDict
+from src.data import data, index
+from src.persistence import compact
+from src.sessions import is_session_valid
+from src.indexes import delivery_key
 import jwt
-import pickle
+import src.error as er
 
 SECRET = 'BLINKERTUES3'
 
 valid_react_ids = [1]
 
-# Decodes a token
-def decode_token(token):
-    global SECRET
-    return jwt.decode(token, SECRET, algorithms=['HS256'])
-
+# Number of recently decoded tokens kept so their signatures are only checked once
+TOKEN_CACHE_SIZE = 1024
 
-def is_ses_id_valid(ses_id, u_id):
-    data = load()
-    for session_ids in data['user_list'][u_id]['session_list']:
-        if ses_id == session_ids:
-            return True
-    return False
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
 
 
-# Checks to see if channel_id is a valid channel
+# Decodes a token, verifying its signature only if it is not one of the
+# TOKEN_CACHE_SIZE most recently used tokens
+def decode_token(token):
+    global SECRET
+    with _token_cache_lock:
+        token_data_struct = _token_cache.get(token)
+        if token_data_struct is not None:
+            _token_cache.move_to_end(token)
+            return token_data_struct
+
+    token_data_struct = jwt.decode(token, SECRET, algorithms=['HS256'])
+    with _token_cache_lock:
+        _token_cache[token] = token_data_struct
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return token_data_struct
+
+
+# Drops the cached tokens of a user, or of just one of their sessions, once
+# they can no longer be used
+def forget_tokens(user_id, session_id=None):
+    with _token_cache_lock:
+        for token, token_data_struct in list(_token_cache.items()):
+            if token_data_struct['token']['user_id'] == user_id and (
+                session_id is None or token_data_struct['token']['session_id'] == session_id):
+                del _token_cache[token]
+
+
+# Checks to see if a token belongs to a session that is logged in
 def is_token_valid(token):
     token_data_struct = decode_token(token)
     token_user_id = token_data_struct['token']['user_id']
     token_ses_id = token_data_struct['token']['session_id']
-    return bool(is_user_id_valid(token_user_id) and is_ses_id_valid(token_ses_id, token_user_id))
+    return bool(is_user_id_valid(token_user_id) and is_session_valid(token_ses_id, token_user_id))
+
+
+def authenticate(token):
+    '''
+    Verifies a token once for a whole request and returns its auth context,
+    {'user_id', 'session_id'}. Raises an AccessError if the session is not
+    logged in.
+    '''
+    token_data_struct = decode_token(token)['token']
+    if not (is_user_id_valid(token_data_struct['user_id']) and
+            is_session_valid(token_data_struct['session_id'], token_data_struct['user_id'])):
+        raise er.AccessError("Invalid token")
+    return {
+        'user_id': token_data_struct['user_id'],
+        'session_id': token_data_struct['session_id'],
+    }
 
 
 # Checks to see if channel_id is a valid channel
 def is_channel_id_valid(channel_id):
-    data = load()
     return channel_id in data['channel_list']
 
 
 # Checks to see if channel_id is a valid channel
 def is_user_id_valid(user_id):
-    data = load()
     return user_id in data['user_list']
 
 
 # Checks to see if the dm_id is valid
 def is_dm_id_valid(dm_id):
-    data = load()
     return dm_id in data['dm_id_list']
 
 
 # Checks to see if user_id is in channel
 def is_user_in_channel(user_id, channel_id):
-    data = load()
     if not is_user_id_valid(user_id):
         return False
     for dm in data['user_list'][user_id]['in_channels']:
@@ -59,30 +97,19 @@ def is_user_in_channel(user_id, channel_id):
 
 # Checks if user_id is an owner of a channel
 def is_user_channel_owner(user_id, channel_id):
-    data = load()
     for user in data['channel_list'][channel_id]['owner_members']:
         if user['u_id'] == user_id:
             return True
     return False
 
 
-# Checks if a message_id is valid (in a channel)
+# Checks if a message_id is valid (in a channel or dm)
 def is_message_id_valid(message_id):
-    data = load()
-    for channel_id in data['channel_list']:
-        for message in data['channel_list'][channel_id]['messages']:
-            if message['message_id'] == message_id:
-                return True
-    for dm_id in data['dm_list']:
-        for message in data['dm_list'][dm_id]['messages']:
-            if message['message_id'] == message_id:
-                return True
-    return False
+    return message_id in index['messages']
 
 
 # Checks to see if user_id is in dm
 def is_user_in_dm(user_id, dm_id):
-    data = load()
     for user in data['dm_list'][dm_id]['dm_members']:
         if user_id == user['u_id']:
             return True
@@ -91,7 +118,6 @@ def is_user_in_dm(user_id, dm_id):
 
 # Checks to see if user is the global owner:
 def is_user_global_owner(user_id):
-    data = load()
     return data['user_list'][user_id]['user_admin']
 
 
@@ -99,80 +125,144 @@ def is_user_global_owner(user_id):
 # Note this assumes correct/allowed input so security needs to be
 # checked before function is called
 def get_message_details(message_id):
-    data = load()
-    location = channeldm_id_from_message_id(message_id)
-    if location['dm_id'] == -1:
-        location_id = location['channel_id']
-        for message in data['channel_list'][location_id]['messages']:
-            if message['message_id'] == message_id:
-                return message
-
-    if location['channel_id'] == -1:
-        location_id = location['dm_id']
-        for message in data['dm_list'][location_id]['messages']:
-            if message['message_id'] == message_id:
-                return message
-    return {}
+    if message_id not in index['messages']:
+        return {}
+    kind, container_id, position = index['messages'][message_id]
+    return data[kind][container_id]['messages'][position]
+
+
+# Returns the (container kind, container id, position) of a message, where the
+# kind is either 'channel_list' or 'dm_list'
+# Note this assumes the message_id has already been checked to be valid
+def message_location(message_id):
+    return index['messages'][message_id]
 
 
 # Returns the channel id that contains the message_id
 def channeldm_id_from_message_id(message_id):
-    data = load()
-    for channel_id in data['channel_list']:
-        for message in data['channel_list'][channel_id]['messages']:
-            if message_id == message['message_id']:
-                return {
-                    'channel_id' : data['channel_list'][channel_id]['channel_id'],
-                        'dm_id': -1
-                    }
-
-    for dm_idx in data['dm_list']:
-        for message in data['dm_list'][dm_idx]['messages']:
-            if message['message_id'] == message_id:
-                return {'channel_id' : -1,
-                        'dm_id': data['dm_list'][dm_idx]['dm_id'],
-                    }
-    return {}
+    if message_id not in index['messages']:
+        return {}
+    kind, container_id, _ = index['messages'][message_id]
+    if kind == 'channel_list':
+        return {'channel_id': container_id, 'dm_id': -1}
+    return {'channel_id': -1, 'dm_id': container_id}
 
 # Checks to see if the user is the creator of the dm
 def is_user_dm_creator(user_id, dm_id):
-    data = load()
     if user_id == data['dm_list'][dm_id]['creator_id']:
         return True
 
     return False
 
 
-def user_specific_messages(messages, auth_user_id):
+def user_specific_messages(messages, auth_user_id, container=None):
     '''
-    Returns a personalised list of messages depending on the auth_user_id
+    Returns a personalised copy of each message depending on the auth_user_id.
+    If every message comes from the same channel or dm, pass it as container
+    so it doesn't have to be looked up for each message.
     '''
 
-    reacts = []
+    return_messages = []
     for message_ind in messages:
-        for react_id in valid_react_ids:
-            u_ids_list = []
-            for reaction in message_ind['reacts_list']:
-                if reaction['react_id'] == react_id:
-                    u_ids_list.append(reaction['u_id'])
-
-            is_this_user_reacted = auth_user_id in u_ids_list
-
-            reacts.append(
-                    {
-                        'react_id': react_id,
-                        'u_ids': u_ids_list,
-                        'is_this_user_reacted': is_this_user_reacted
-                    }
-                )
-
-        message_ind['reacts'] = reacts
-        message_deets = channeldm_id_from_message_id(message_ind['message_id'])
-        if is_pinned_message_in_list(message_ind['message'], message_ind['message_id'],
-                                     message_deets['dm_id'], message_deets['channel_id']):
-            message_ind['is_pinned'] = True
-        else: message_ind['is_pinned'] = False
-    return messages
+        if container is None:
+            kind, container_id, _ = index['messages'][message_ind['message_id']]
+            message_container = data[kind][container_id]
+        else:
+            message_container = container
+
+        return_messages.append({
+            'message_id': message_ind['message_id'],
+            'u_id': message_ind['u_id'],
+            'message': message_ind['message'],
+            'time_created': message_ind['time_created'],
+            'reacts': _react_summaries(message_ind, auth_user_id),
+            'is_pinned': message_ind['message_id'] in message_container['pinned_messages'],
+        })
+    return return_messages
+
+
+# Groups a message's reactions by react_id for the given user's view
+def _react_summaries(message, auth_user_id):
+    u_ids_by_react = {react_id: [] for react_id in valid_react_ids}
+    for reaction in message['reacts_list']:
+        if reaction['react_id'] in u_ids_by_react:
+            u_ids_by_react[reaction['react_id']].append(reaction['u_id'])
+
+    return [
+        {
+            'react_id': react_id,
+            'u_ids': u_ids,
+            'is_this_user_reacted': auth_user_id in u_ids,
+        }
+        for react_id, u_ids in u_ids_by_react.items()
+    ]
+
+
+# Returns the messages of a channel or dm from start to end, counted back from
+# the most recent message, in newest first order. Only the requested slice of
+# the history is copied.
+def newest_messages(container, start, end):
+    messages = container['messages']
+    history_length = len(messages)
+    first = max(history_length - end, 0)
+    last = max(history_length - start, 0)
+    return messages[first:last][::-1]
+
+
+# Returns the (container kind, container id, position) of a message used as a
+# page cursor. A removed message is placed where it used to sit, just after the
+# nearest older message that still exists. Returns None for an unknown id.
+def cursor_location(message_id):
+    if message_id in index['messages']:
+        return index['messages'][message_id]
+    removed = data['removed_messages'].get(message_id)
+    if removed is None:
+        return None
+    previous = removed['previous']
+    while previous != -1 and previous not in index['messages']:
+        previous = data['removed_messages'].get(previous, {'previous': -1})['previous']
+    position = 0 if previous == -1 else index['messages'][previous][2] + 1
+    return removed['kind'], removed['container_id'], position
+
+
+# Returns the delivery key (see src/indexes.py) of a message used as a page
+# cursor, placing a removed message where it used to sit. Returns None for an
+# unknown id.
+def cursor_delivery_key(message_id):
+    location = cursor_location(message_id)
+    if location is None:
+        return None
+    kind, container_id, position = location
+    if message_id in index['messages']:
+        time_created = data[kind][container_id]['messages'][position]['time_created']
+    else:
+        time_created = data['removed_messages'][message_id]['time_created']
+    return delivery_key(kind, container_id, position, time_created)
+
+
+# Checks to see if a message, or a removed message, belongs to the given
+# channel or dm, where kind is either 'channel_list' or 'dm_list'
+def is_cursor_in_container(message_id, kind, container_id):
+    location = cursor_location(message_id)
+    return location is not None and location[:2] == (kind, container_id)
+
+
+# Returns up to page_size messages of a channel or dm that are older than the
+# message before_id, newest first, along with the message_id to pass as the
+# next cursor (-1 once the oldest message is reached). A before_id of -1 starts
+# from the most recent message. Pages are stable as new messages arrive since
+# the cursor is a message rather than an offset, and the cursor can still be
+# used once its message has been removed.
+def messages_before(kind, container_id, before_id, page_size=50):
+    messages = data[kind][container_id]['messages']
+    if before_id == -1:
+        position = len(messages)
+    else:
+        position = cursor_location(before_id)[2]
+    first = max(position - page_size, 0)
+    page = messages[first:position][::-1]
+    end = page[-1]['message_id'] if first > 0 else -1
+    return page, end
 
 
 # A function to tell if a given message (and message_id) is in a list of messages send by
@@ -189,25 +279,21 @@ def _is_message_in_list(message, message_id, message_list, user_id):
     return False
 
 
+# Mutations are journaled as they happen (see src/persistence.py), so saving
+# only forces the journal to be folded into a fresh snapshot
 def save(data_struct):
-    with open("src/export.p", "wb") as FILE:
-        FILE.write(pickle.dumps(data_struct))
+    compact()
 
+# Returns the resident store
 def load():
-    with open("src/export.p", "rb") as INFILE:
-        return pickle.load(INFILE)
+    return data
 
 
-#Checks if the message is in pinned messages list
+#Checks if the message is pinned in its channel or dm. Pins are keyed by
+#message_id, so the message text is only kept for existing callers
 def is_pinned_message_in_list(message, message_id, dm_id, channel_id):
-    data = load()
     if dm_id == -1:
-        for pinned_message in data['channel_list'][channel_id]['pinned_messages']:
-            if message == pinned_message['message'] and message_id == pinned_message['message_id']:
-                return True
-        return False
+        return message_id in data['channel_list'][channel_id]['pinned_messages']
     if channel_id == -1:
-        for pinned_message in data['dm_list'][dm_id]['pinned_messages']:
-            if message == pinned_message['message'] and message_id == pinned_message['message_id']:
-                return True
-        return False
+        return message_id in data['dm_list'][dm_id]['pinned_messages']
+    return False
@@ -0,0 +1,181 @@
+import threading
+from src import archive, persistence
+from src.data import data
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_messages_v2
+from src.dm import dm_create_v1, dm_messages_v1
+from src.message import message_send_v2, message_senddm_v1, message_edit_v2
+from src.message import message_remove_v1, message_react_v1, message_pin_v1
+from src.other import clear_v1, search_v2
+
+
+def _setup(num_messages):
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'DwarfWharf', True)
+    sent = [message_send_v2(user['token'], channel['channel_id'], 'message %d' % num)['message_id']
+            for num in range(num_messages)]
+    return user, channel, sent
+
+
+def _all_messages(token, channel_id):
+    messages = []
+    start = 0
+    while True:
+        page = channel_messages_v2(token, channel_id, start)
+        messages += page['messages']
+        if page['end'] == -1 or len(page['messages']) < 50:
+            return messages
+        start = page['end']
+
+
+def test_archived_messages_read_the_same(tmp_path):
+    clear_v1()
+    user, channel, _ = _setup(120)
+    before = _all_messages(user['token'], channel['channel_id'])
+    before_search = search_v2(user['token'], 'message 1')
+
+    assert archive.archive_cold_messages(str(tmp_path), hot_messages=20, batch=50) == 1
+    history = data['channel_list'][channel['channel_id']]['messages']
+    assert len(history.hot) == 20
+    assert history.cold_count() == 100
+
+    assert _all_messages(user['token'], channel['channel_id']) == before
+    assert search_v2(user['token'], 'message 1') == before_search
+    clear_v1()
+
+
+def test_archive_waits_for_a_full_batch(tmp_path):
+    clear_v1()
+    _, channel, _ = _setup(60)
+    assert archive.archive_cold_messages(str(tmp_path), hot_messages=20, batch=50) == 0
+    assert data['channel_list'][channel['channel_id']]['messages'].cold_count() == 0
+    clear_v1()
+
+
+def test_change_archived_messages(tmp_path):
+    clear_v1()
+    user, channel, sent = _setup(30)
+    archive.archive_cold_messages(str(tmp_path), hot_messages=10, batch=10)
+
+    message_edit_v2(user['token'], sent[3], 'edited')
+    message_react_v1(user['token'], sent[4], 1)
+    message_pin_v1(user['token'], sent[4])
+    message_remove_v1(user['token'], sent[5])
+    message_send_v2(user['token'], channel['channel_id'], 'newest')
+
+    messages = _all_messages(user['token'], channel['channel_id'])[::-1]
+    assert len(messages) == 30
+    assert messages[3]['message'] == 'edited'
+    assert messages[4]['reacts'][0]['u_ids'] == [user['auth_user_id']]
+    assert messages[4]['is_pinned']
+    assert messages[5]['message_id'] == sent[6]
+    assert messages[-1]['message'] == 'newest'
+    assert [m['message_id'] for m in search_v2(user['token'], 'edited')['messages']] == [sent[3]]
+
+    # Changes made to archived messages carry over into the next segment
+    for num in range(10):
+        message_send_v2(user['token'], channel['channel_id'], 'more %d' % num)
+    archive.archive_cold_messages(str(tmp_path), hot_messages=10, batch=10)
+    assert _all_messages(user['token'], channel['channel_id'])[::-1][:30] == messages
+    clear_v1()
+
+
+def test_archived_dm_messages(tmp_path):
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    dm = dm_create_v1(user['token'], [])
+    for num in range(15):
+        message_senddm_v1(user['token'], dm['dm_id'], str(num))
+    archive.archive_cold_messages(str(tmp_path), hot_messages=5, batch=5)
+
+    messages = dm_messages_v1(user['token'], dm['dm_id'], 0)['messages']
+    assert [message['message'] for message in messages] == [str(num) for num in range(14, -1, -1)]
+    clear_v1()
+
+
+def test_archive_survives_restore(tmp_path):
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    user, channel, sent = _setup(30)
+    archive_dir = str(tmp_path / 'archive')
+    archive.archive_cold_messages(archive_dir, hot_messages=10, batch=10)
+    message_edit_v2(user['token'], sent[0], 'edited')
+    message_remove_v1(user['token'], sent[1])
+    before = _all_messages(user['token'], channel['channel_id'])
+
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert _all_messages(user['token'], channel['channel_id']) == before
+
+    # Compacting folds the archived history into the snapshot
+    persistence.compact()
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert _all_messages(user['token'], channel['channel_id']) == before
+    persistence.close()
+    clear_v1()
+
+
+def test_unused_segments_deleted(tmp_path):
+    clear_v1()
+    user, channel, _ = _setup(30)
+    archive.archive_cold_messages(str(tmp_path), hot_messages=10, batch=10)
+    for num in range(10):
+        message_send_v2(user['token'], channel['channel_id'], str(num))
+    archive.archive_cold_messages(str(tmp_path), hot_messages=10, batch=10)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # The replaced segment goes once the archiver has seen it unused twice
+    archive.archive_cold_messages(str(tmp_path), hot_messages=10, batch=10)
+    assert len(list(tmp_path.iterdir())) == 1
+    clear_v1()
+
+
+def test_changes_while_archiving(tmp_path, monkeypatch):
+    clear_v1()
+    user, channel, sent = _setup(30)
+    write_segment = archive.write_segment
+    changers = []
+
+    # Removes and edits messages from other threads while the segment is written
+    def _write_segment(path, messages):
+        changers.append(threading.Thread(target=message_remove_v1,
+                                         args=(user['token'], sent[5])))
+        changers.append(threading.Thread(target=message_edit_v2,
+                                         args=(user['token'], sent[3], 'edited')))
+        for changer in changers:
+            changer.start()
+            changer.join(0.1)
+        return write_segment(path, messages)
+
+    monkeypatch.setattr(archive, 'write_segment', _write_segment)
+    archive.archive_container('channel_list', channel['channel_id'], str(tmp_path),
+                              hot_messages=10, batch=10)
+    for changer in changers:
+        changer.join()
+
+    expected = ['edited' if num == 3 else 'message %d' % num
+                for num in range(30) if num != 5]
+    messages = _all_messages(user['token'], channel['channel_id'])
+    assert [message['message'] for message in reversed(messages)] == expected
+    clear_v1()
+
+
+def test_read_while_archiving(tmp_path):
+    clear_v1()
+    user, channel, sent = _setup(40)
+    archive.archive_container('channel_list', channel['channel_id'], str(tmp_path),
+                              hot_messages=20, batch=10)
+    message_remove_v1(user['token'], sent[5])
+    history = data['channel_list'][channel['channel_id']]['messages']
+
+    # A reader that took the messages just before the next archive reads them
+    # as they were, even once the archive has replaced the history's tiers
+    messages = history[:]
+    archive.archive_container('channel_list', channel['channel_id'], str(tmp_path),
+                              hot_messages=10, batch=10)
+    expected = [message_id for message_id in sent if message_id != sent[5]]
+    assert [message['message_id'] for message in messages] == expected
+    assert [message['message_id'] for message in history] == expected
+    clear_v1()
@@ -9,8 +9,9 @@ from src.other import admin_user_remove_v1
 from src.auth import auth_logout_v1
 from src.auth import _generate_token
 from src.validator import decode_token
-from src.user import user_profile_v2
+from src.user import user_profile_v2, user_profile_sethandle_v1
 from src.validator import is_token_valid
+from src import validator
 import src.error as er
 
 '''
@@ -172,6 +173,17 @@ def test_same_handle():
     }} == user_profile_v2(register1['token'], u_id4))
     clear_v1()
     
+# Test that a generated handle skips handles that users have set themselves
+def test_same_handle_skips_taken_handle():
+    clear_v1()
+    register1 = auth_register_v2('z123456@unsw.com','123abc!@#', 'First', 'Last')
+    register2 = auth_register_v2('z12345@unsw.com','123abc!@#', 'Other', 'User')
+    user_profile_sethandle_v1(register2['token'], 'firstlast0')
+    register3 = auth_register_v2('z1234@unsw.com','123abc!@#', 'First', 'Last')
+    assert user_profile_v2(register1['token'], register3['auth_user_id'])['user'][
+        'handle_str'] == 'firstlast1'
+    clear_v1()
+    
 #test for removed user
 def test_removed_user():
     clear_v1()
@@ -184,6 +196,37 @@ def test_removed_user():
         auth_login_v2('z12345@unsw.com', '123abc!@#')
     clear_v1()
 
+# Test that a removed user's existing sessions stop working straight away
+def test_removed_user_token_invalidated():
+    clear_v1()
+    register1 = auth_register_v2('z123456@unsw.com','123abc!@#', 'First', 'Last')
+    register2 = auth_register_v2('z12345@unsw.com','123abc!@#', 'First', 'Last')
+    assert is_token_valid(register2['token'])
+    admin_user_remove_v1(register1['token'], register2['auth_user_id'])
+    assert not is_token_valid(register2['token'])
+    assert is_token_valid(register1['token'])
+    clear_v1()
+
+# Test that logging out only ends the session of the given token
+def test_logout_keeps_other_sessions():
+    clear_v1()
+    register = auth_register_v2('z123456@unsw.com','123abc!@#', 'First', 'Last')
+    login = auth_login_v2('z123456@unsw.com', '123abc!@#')
+    auth_logout_v1(login['token'])
+    assert not is_token_valid(login['token'])
+    assert is_token_valid(register['token'])
+    clear_v1()
+
+# Test that the cache of decoded tokens stays bounded
+def test_token_cache_bounded():
+    clear_v1()
+    auth_register_v2('z123456@unsw.com','123abc!@#', 'First', 'Last')
+    for _ in range(validator.TOKEN_CACHE_SIZE + 10):
+        login = auth_login_v2('z123456@unsw.com', '123abc!@#')
+        assert is_token_valid(login['token'])
+    assert len(validator._token_cache) == validator.TOKEN_CACHE_SIZE
+    clear_v1()
+
 def test_password_reset_invalid_reset_code():
     with pytest.raises(er.InputError):
         auth_passwordreset_reset_v1("a", "abcdefgh")
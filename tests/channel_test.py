@@ -2,8 +2,8 @@ import pytest
 import src.error as er
 from src.data import data
 from src.other import clear_v1
-from src.channel import channel_messages_v2
-from src.message import message_send_v2
+from src.channel import channel_messages_v2, channel_messages_before_v1
+from src.message import message_send_v2, message_remove_v1
 from src.channel import channel_details_v2, _add_owner_to_channel, channel_removeowner_v1
 from src.validator import is_user_in_channel, is_channel_id_valid, is_user_id_valid, load
 from src.channel import channel_join_v2
@@ -250,6 +250,85 @@ def test_channel_messages_v2_valid():
     assert(messages['end'] == -1)
     clear_v1()
 
+# Paging near the oldest message returns only what is left of the history
+def test_channel_messages_v2_last_page():
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", True)
+    for num in range(60):
+        message_send_v2(user_dict['token'], channel_dict['channel_id'], str(num))
+
+    # Act
+    messages = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 40)
+
+    # Assert
+    assert([message['message'] for message in messages['messages']] ==
+           [str(num) for num in range(19, -1, -1)])
+    assert(messages['start'] == 40)
+    assert(messages['end'] == 90)
+    clear_v1()
+
+def test_channel_messages_before_v1_pages_with_cursor():
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", True)
+    for num in range(60):
+        message_send_v2(user_dict['token'], channel_dict['channel_id'], str(num))
+
+    # Act
+    first = channel_messages_before_v1(user_dict['token'], channel_dict['channel_id'], -1)
+    # A new message must not shift the following page
+    message_send_v2(user_dict['token'], channel_dict['channel_id'], "new")
+    second = channel_messages_before_v1(user_dict['token'], channel_dict['channel_id'],
+                                        first['end'])
+
+    # Assert
+    assert([message['message'] for message in first['messages']] ==
+           [str(num) for num in range(59, 9, -1)])
+    assert(first['end'] == first['messages'][-1]['message_id'])
+    assert([message['message'] for message in second['messages']] ==
+           [str(num) for num in range(9, -1, -1)])
+    assert(second['end'] == -1)
+    clear_v1()
+
+def test_channel_messages_before_v1_removed_cursor():
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", True)
+    sent = [message_send_v2(user_dict['token'], channel_dict['channel_id'], str(num))
+            for num in range(60)]
+    first = channel_messages_before_v1(user_dict['token'], channel_dict['channel_id'], -1)
+
+    # Act
+    # The cursor and the message just before it are removed between pages
+    message_remove_v1(user_dict['token'], first['end'])
+    message_remove_v1(user_dict['token'], sent[9]['message_id'])
+    second = channel_messages_before_v1(user_dict['token'], channel_dict['channel_id'],
+                                        first['end'])
+
+    # Assert
+    assert([message['message'] for message in second['messages']] ==
+           [str(num) for num in range(8, -1, -1)])
+    assert(second['end'] == -1)
+    clear_v1()
+
+def test_channel_messages_before_v1_foreign_message():
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", True)
+    other_dict = channels_create_v2(user_dict['token'], "other", True)
+    message_dict = message_send_v2(user_dict['token'], other_dict['channel_id'], "hi")
+
+    # Act & Assert
+    with pytest.raises(er.InputError):
+        channel_messages_before_v1(user_dict['token'], channel_dict['channel_id'],
+                                   message_dict['message_id'])
+    clear_v1()
+
 '''
 channel/join/v2 tests
 '''
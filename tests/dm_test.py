@@ -1,9 +1,9 @@
 import pytest
 import src.error as er
 from src.auth import auth_register_v2, auth_logout_v1
-from src.message import message_senddm_v1
+from src.message import message_senddm_v1, message_remove_v1
 from src.other import clear_v1
-from src.dm import dm_create_v1, dm_messages_v1
+from src.dm import dm_create_v1, dm_messages_v1, dm_messages_before_v1
 from src.auth import _generate_token
 from src.dm import dm_list_v1
 from src.dm import dm_details_v1
@@ -650,6 +650,62 @@ def test_dm_messages_valid():
     clear_v1()
 
 
+
+def test_dm_messages_before_cursor():
+    '''Testing that a cursor pages back from the given message'''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    dm_dict = dm_create_v1(user_dict['token'], [])
+    sent = [message_senddm_v1(user_dict['token'], dm_dict['dm_id'], str(num))
+            for num in range(5)]
+
+    # Act
+    messages = dm_messages_before_v1(user_dict['token'], dm_dict['dm_id'],
+                                     sent[3]['message_id'])
+
+    # Assert
+    assert [message['message'] for message in messages['messages']] == ['2', '1', '0']
+    assert messages['before'] == sent[3]['message_id']
+    assert messages['end'] == -1
+    clear_v1()
+
+
+def test_dm_messages_before_removed_cursor():
+    '''Testing that a removed cursor pages back from where its message was'''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    dm_dict = dm_create_v1(user_dict['token'], [])
+    sent = [message_senddm_v1(user_dict['token'], dm_dict['dm_id'], str(num))
+            for num in range(5)]
+    message_remove_v1(user_dict['token'], sent[3]['message_id'])
+
+    # Act
+    messages = dm_messages_before_v1(user_dict['token'], dm_dict['dm_id'],
+                                     sent[3]['message_id'])
+
+    # Assert
+    assert [message['message'] for message in messages['messages']] == ['2', '1', '0']
+    assert messages['end'] == -1
+    clear_v1()
+
+
+def test_dm_messages_before_invalid_cursor():
+    '''Testing a cursor that is not a message of the dm'''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Joe", "Mama")
+    dm_dict = dm_create_v1(user_dict['token'], [])
+
+    # Act & Assert
+    with pytest.raises(er.InputError):
+        dm_messages_before_v1(user_dict['token'], dm_dict['dm_id'], 42)
+    clear_v1()
+
 def test_dm_many_messages():
     '''Testing working cases with large amount of messages'''
 
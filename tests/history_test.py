@@ -0,0 +1,131 @@
+import random
+import threading
+from time import sleep
+import pytest
+from src import history, persistence
+from src.data import data
+from src.auth import auth_register_v2, _generate_token
+from src.channels import channels_create_v2
+from src.dm import dm_create_v1, dm_remove_v1
+from src.message import message_send_v2, message_senddm_v1
+from src.user import user_stats_history_v1, users_stats_history_v1
+from src.other import clear_v1
+import src.error as er
+
+
+def _counts(points, count_key):
+    return [point[count_key] for point in points]
+
+
+def test_stats_history_invalid_token():
+    clear_v1()
+    with pytest.raises(er.AccessError):
+        user_stats_history_v1(_generate_token(-1, -1))
+    with pytest.raises(er.AccessError):
+        users_stats_history_v1(_generate_token(-1, -1))
+    clear_v1()
+
+
+def test_user_stats_history(monkeypatch):
+    clear_v1()
+    now = [1000]
+    monkeypatch.setattr(history, 'time', lambda: now[0])
+    user1 = auth_register_v2('abc@unsw.com', '123abc!@#', 'First', 'Last')
+    user2 = auth_register_v2('xyz@unsw.com', '123xyz!@#', 'First', 'Last')
+    now[0] += 10
+    channel = channels_create_v2(user1['token'], 'ChannelName', True)
+    now[0] += 10
+    message_send_v2(user1['token'], channel['channel_id'], 'hello')
+    now[0] += 10
+    dm = dm_create_v1(user1['token'], [user2['auth_user_id']])
+    message_senddm_v1(user2['token'], dm['dm_id'], 'hi')
+
+    stats = user_stats_history_v1(user1['token'])
+    assert stats['channels_joined'] == [
+        {'num_channels_joined': 0, 'time_stamp': 1000},
+        {'num_channels_joined': 1, 'time_stamp': 1010},
+    ]
+    assert _counts(stats['messages_sent'], 'num_messages_sent') == [0, 1]
+    assert _counts(stats['dms_joined'], 'num_dms_joined') == [0, 1]
+
+    now[0] += 10
+    dm_remove_v1(user1['token'], dm['dm_id'])
+    workspace = users_stats_history_v1(user1['token'])
+    # Changes within the same second replace the last point
+    assert workspace['users_exist'] == [{'num_users_exist': 2, 'time_stamp': 1000}]
+    assert _counts(workspace['dms_exist'], 'num_dms_exist') == [0, 1, 0]
+    assert workspace['messages_exist'] == [
+        {'num_messages_exist': 0, 'time_stamp': 1000},
+        {'num_messages_exist': 1, 'time_stamp': 1020},
+        {'num_messages_exist': 2, 'time_stamp': 1030},
+        {'num_messages_exist': 1, 'time_stamp': 1040},
+    ]
+    assert _counts(workspace['users_active'], 'num_users_active') == [0, 1, 2, 1]
+    assert _counts(user_stats_history_v1(user2['token'])['messages_sent'],
+                   'num_messages_sent') == [0, 1, 0]
+    clear_v1()
+
+
+def test_history_downsampled(monkeypatch):
+    clear_v1()
+    monkeypatch.setattr(history, 'HISTORY_POINTS', 10)
+    monkeypatch.setattr(history, 'HISTORY_RETENTION', 100)
+    now = [1000]
+    monkeypatch.setattr(history, 'time', lambda: now[0])
+    user = auth_register_v2('abc@unsw.com', '123abc!@#', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'ChannelName', True)
+    for num in range(10):
+        now[0] += 20
+        message_send_v2(user['token'], channel['channel_id'], str(num))
+
+    # Points older than 1100 go apart from the newest of them, then the older
+    # half of the rest keeps every second point
+    points = users_stats_history_v1(user['token'])['messages_exist']
+    assert [point['time_stamp'] for point in points] == [1100, 1140, 1160, 1180, 1200]
+    assert _counts(points, 'num_messages_exist') == [5, 7, 8, 9, 10]
+    clear_v1()
+
+
+def test_history_survives_restore(tmp_path):
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    user = auth_register_v2('abc@unsw.com', '123abc!@#', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'ChannelName', True)
+    message_send_v2(user['token'], channel['channel_id'], 'hello')
+    expected = users_stats_history_v1(user['token'])
+
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert users_stats_history_v1(user['token']) == expected
+    persistence.close()
+    clear_v1()
+
+
+def test_history_concurrent_sends_restore(tmp_path, monkeypatch):
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    user = auth_register_v2('abc@unsw.com', '123abc!@#', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'ChannelName', True)
+
+    # Gives other threads the chance to run between a change and its record
+    def _slow_journal(*args):
+        sleep(random.random() / 1000)
+        persistence.journal(*args)
+    monkeypatch.setattr(history, 'journal', _slow_journal)
+
+    def _send():
+        for num in range(10):
+            message_send_v2(user['token'], channel['channel_id'], str(num))
+
+    senders = [threading.Thread(target=_send) for _ in range(8)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    expected = users_stats_history_v1(user['token'])
+
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert users_stats_history_v1(user['token']) == expected
+    persistence.close()
+    clear_v1()
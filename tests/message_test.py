@@ -8,12 +8,17 @@ from src.auth import auth_register_v2, auth_logout_v1, _generate_token
 from src.channel import channel_join_v2, channel_messages_v2
 from src.message import message_send_v2, message_edit_v2, message_remove_v1, message_senddm_v1
 from src.message import message_share_v1, message_sendlater_v1, message_sendlaterdm_v1
+from src.message import message_sendlater_list_v1, message_sendlater_cancel_v1
+from src.message import schedule_pending_messages
 from src.message import message_react_v1
-from src.dm import dm_messages_v1, dm_create_v1
+from src.dm import dm_messages_v1, dm_create_v1, dm_remove_v1
 from src.message import message_pin_v1, message_unpin_v1, message_react_v1, message_unreact_v1
 from src.validator import is_pinned_message_in_list
 from src.other import clear_v1
 from src.channels import channels_create_v2
+from src import scheduler, persistence
+from src import message as message_module
+from src.data import data
 
 
 ########## MESSAGE SEND TESTS ##########
@@ -612,6 +617,48 @@ def test_message_remove_mutiple_channel_messages():
     clear_v1()
 
 
+def test_message_remove_then_edit_later_message():
+    '''Messages after a removed one can still be found and edited'''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", False)
+    message_1 = message_send_v2(user_dict['token'], channel_dict['channel_id'], "One")
+    message_2 = message_send_v2(user_dict['token'], channel_dict['channel_id'], "Two")
+    message_3 = message_send_v2(user_dict['token'], channel_dict['channel_id'], "Three")
+
+    # Act
+    message_remove_v1(user_dict['token'], message_1['message_id'])
+    message_edit_v2(user_dict['token'], message_3['message_id'], "Edited")
+
+    # Assert
+    messages = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)
+    assert [message['message'] for message in messages['messages']] == ["Edited", "Two"]
+    with pytest.raises(InputError):
+        message_edit_v2(user_dict['token'], message_1['message_id'], "Gone")
+    message_remove_v1(user_dict['token'], message_2['message_id'])
+    clear_v1()
+
+
+def test_message_in_removed_dm_is_invalid():
+    '''Messages of a removed DM can no longer be reacted to'''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    dm_dict = dm_create_v1(user_dict['token'], [])
+    message = message_senddm_v1(user_dict['token'], dm_dict['dm_id'], "One")
+
+    # Act
+    dm_remove_v1(user_dict['token'], dm_dict['dm_id'])
+
+    # Assert
+    with pytest.raises(InputError):
+        message_react_v1(user_dict['token'], message['message_id'], 1)
+    clear_v1()
+
+
 
 ########## MESSAGE SENDDM TESTS ##########
 
@@ -1066,7 +1113,8 @@ def test_message_share_more_than_1000():
 
 def test_message_sendlater_time_check():
     '''
-    Tests to make sure function takes 5 seconds to successfully send the message
+    Tests to make sure the message_id is returned straight away and the message only
+    appears once time_sent is reached
     '''
 
     clear_v1()
@@ -1075,14 +1123,43 @@ def test_message_sendlater_time_check():
     channel_dict = channels_create_v2(user_dict['token'], "channel1", False)
 
     # Act
-    pre_time = datetime.now()
-    message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "Message",
-                         int(mktime(pre_time.timetuple())) + 2)
-    post_time = datetime.now()
+    time_sent = int(mktime(datetime.now().timetuple())) + 60
+    message_dict = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'],
+                                        "Message", time_sent)
+    before = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
+    scheduler.run_due(time_sent)
+    after = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
 
     # Assert
-    assert abs(post_time.second - pre_time.second) == 2 or (
-           abs(post_time.second - pre_time.second)) == 58
+    assert before == []
+    assert [message['message_id'] for message in after] == [message_dict['message_id']]
+    assert after[0]['message'] == "Message"
+
+
+def test_message_sendlater_delivered_in_time_order():
+    '''
+    Tests that scheduled messages are delivered in order of time_sent, not the order
+    they were scheduled in
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict['token'], "channel1", False)
+    now = int(mktime(datetime.now().timetuple()))
+
+    # Act
+    for offset in (30, 10, 20):
+        message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], str(offset),
+                             now + offset)
+    scheduler.run_due(now + 20)
+    sent = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
+
+    # Assert
+    assert [message['message'] for message in sent] == ['20', '10']
+    assert scheduler.pending_count() == 1
+    clear_v1()
+    assert scheduler.pending_count() == 0
 
 
 def test_message_sendlater_invalid_channel_id():
@@ -1177,7 +1254,8 @@ def test_message_sendlater_not_in_channel():
 
 def test_message_send_later_dm_simple():
     '''
-    Tests to make sure function takes 5 seconds to successfully send the message
+    Tests to make sure the message_id is returned straight away and the message only
+    appears once time_sent is reached
     '''
 
     clear_v1()
@@ -1186,14 +1264,36 @@ def test_message_send_later_dm_simple():
     dm_dict = dm_create_v1(user_dict['token'], [])
 
     # Act
-    pre_time = datetime.now()
-    message_sendlaterdm_v1(user_dict['token'], dm_dict['dm_id'], "Message",
-                      int(mktime(pre_time.timetuple())) + 2)
-    post_time = datetime.now()
+    time_sent = int(mktime(datetime.now().timetuple())) + 60
+    message_dict = message_sendlaterdm_v1(user_dict['token'], dm_dict['dm_id'], "Message",
+                                          time_sent)
+    before = dm_messages_v1(user_dict['token'], dm_dict['dm_id'], 0)['messages']
+    scheduler.run_due(time_sent)
+    after = dm_messages_v1(user_dict['token'], dm_dict['dm_id'], 0)['messages']
+
+    # Assert
+    assert before == []
+    assert [message['message_id'] for message in after] == [message_dict['message_id']]
+
+
+def test_message_send_later_dm_removed():
+    '''
+    Tests that a scheduled message is dropped if its DM is removed before it is due
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    dm_dict = dm_create_v1(user_dict['token'], [])
+    time_sent = int(mktime(datetime.now().timetuple())) + 60
+    message_sendlaterdm_v1(user_dict['token'], dm_dict['dm_id'], "Message", time_sent)
+
+    # Act
+    dm_remove_v1(user_dict['token'], dm_dict['dm_id'])
 
     # Assert
-    assert abs(post_time.second - pre_time.second) == 2 or (
-           abs(post_time.second - pre_time.second)) == 58
+    assert scheduler.run_due(time_sent) == 1
+    assert data['dm_list'] == {}
 
 
 def test_message_send_later_dm_invalid_dm_id():
@@ -1286,6 +1386,130 @@ def test_message_send_later_dm_not_in_dm():
 
 
 
+########## MESSAGE SEND LATER LIST AND CANCEL TESTS ##########
+
+def test_message_sendlater_list_and_cancel():
+    '''
+    Tests that a user sees only their own pending messages, soonest first, and that a
+    cancelled message is never sent
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    user_dict_2 = auth_register_v2("z5555556@unsw.com", "password", "Second", "User")
+    channel_dict = channels_create_v2(user_dict['token'], "channel1", True)
+    channel_join_v2(user_dict_2['token'], channel_dict['channel_id'])
+    dm_dict = dm_create_v1(user_dict['token'], [])
+    now = int(mktime(datetime.now().timetuple()))
+    later = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "Later",
+                                 now + 60)
+    sooner = message_sendlaterdm_v1(user_dict['token'], dm_dict['dm_id'], "Sooner", now + 30)
+    message_sendlater_v1(user_dict_2['token'], channel_dict['channel_id'], "Other", now + 45)
+
+    # Act
+    listed = message_sendlater_list_v1(user_dict['token'])['messages']
+    message_sendlater_cancel_v1(user_dict['token'], later['message_id'])
+    scheduler.run_due(now + 60)
+
+    # Assert
+    assert listed == [
+        {'message_id': sooner['message_id'], 'channel_id': -1, 'dm_id': dm_dict['dm_id'],
+         'message': "Sooner", 'time_sent': now + 30},
+        {'message_id': later['message_id'], 'channel_id': channel_dict['channel_id'],
+         'dm_id': -1, 'message': "Later", 'time_sent': now + 60},
+    ]
+    sent = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
+    assert [message['message'] for message in sent] == ["Other"]
+    assert message_sendlater_list_v1(user_dict['token'])['messages'] == []
+
+
+def test_message_sendlater_cancel_errors():
+    '''
+    Tests that only pending messages can be cancelled, and only by the user who
+    scheduled them
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    user_dict_2 = auth_register_v2("z5555556@unsw.com", "password", "Second", "User")
+    channel_dict = channels_create_v2(user_dict['token'], "channel1", True)
+    sent = message_send_v2(user_dict['token'], channel_dict['channel_id'], "Now")
+    scheduled = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "Later",
+                                     int(mktime(datetime.now().timetuple())) + 60)
+
+    # Act and Assert
+    with pytest.raises(InputError):
+        message_sendlater_cancel_v1(user_dict['token'], sent['message_id'])
+    with pytest.raises(AccessError):
+        message_sendlater_cancel_v1(user_dict_2['token'], scheduled['message_id'])
+    clear_v1()
+
+
+def test_message_sendlater_cancel_while_sending(monkeypatch):
+    '''
+    Tests that a message sent after it was checked for cancelling, but before it was
+    taken out of the store, is reported as no longer waiting to be sent
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict['token'], "channel1", True)
+    time_sent = int(mktime(datetime.now().timetuple())) + 60
+    scheduled = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "Later",
+                                     time_sent)
+    unschedule = message_module._unschedule_message
+
+    def send_first(message_id):
+        monkeypatch.setattr(message_module, '_unschedule_message', unschedule)
+        scheduler.run_due(time_sent)
+        return unschedule(message_id)
+
+    monkeypatch.setattr(message_module, '_unschedule_message', send_first)
+
+    # Act and Assert
+    with pytest.raises(InputError):
+        message_sendlater_cancel_v1(user_dict['token'], scheduled['message_id'])
+    sent = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
+    assert [message['message'] for message in sent] == ["Later"]
+    clear_v1()
+
+
+def test_message_sendlater_survives_restart(tmp_path):
+    '''
+    Tests that messages still waiting to be sent when the server stops are sent, in
+    order, once it is restored
+    '''
+
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict['token'], "channel1", True)
+    now = int(mktime(datetime.now().timetuple()))
+    second = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "Second",
+                                  now + 60)
+    first = message_sendlater_v1(user_dict['token'], channel_dict['channel_id'], "First",
+                                 now + 30)
+
+    # Act
+    scheduler.cancel_all()
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    schedule_pending_messages()
+    scheduler.run_due(now + 90)
+
+    # Assert
+    sent = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)['messages']
+    assert [message['message_id'] for message in sent] == [second['message_id'],
+                                                          first['message_id']]
+    assert data['scheduled_messages'] == {}
+    persistence.close()
+    clear_v1()
+
+
 ########## MESSAGE REACT TESTS ##########
 
 
@@ -1395,6 +1619,32 @@ def test_message_react_simple_channel():
     clear_v1()
 
 
+def test_message_react_only_on_reacted_message():
+    '''
+    Testing that each message on a page gets its own list of reactions
+    '''
+
+    clear_v1()
+    # Arrange
+    user_dict = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict['token'], "channel", False)
+    message = message_send_v2(user_dict['token'], channel_dict['channel_id'], "Message")
+    message_send_v2(user_dict['token'], channel_dict['channel_id'], "Other message")
+
+    # Act
+    message_react_v1(user_dict['token'], message['message_id'], 1)
+
+    # Assert
+    messages = channel_messages_v2(user_dict['token'], channel_dict['channel_id'], 0)
+    assert messages['messages'][0]['reacts'] == [
+        {'react_id': 1, 'u_ids': [], 'is_this_user_reacted': False}
+    ]
+    assert messages['messages'][1]['reacts'] == [
+        {'react_id': 1, 'u_ids': [user_dict['auth_user_id']], 'is_this_user_reacted': True}
+    ]
+    clear_v1()
+
+
 def test_message_react_simple_dm():
     '''
     Testing simple case of reaction for a message in a channel
@@ -1519,6 +1769,20 @@ def test_corret_message_pin():
     clear_v1()
 
 
+def test_pinned_message_stays_pinned_after_edit():
+    clear_v1()
+    user1 = auth_register_v2('z123456@unsw.com','123abc!@#', 'First', 'Last')
+    channel_dict_1 = channels_create_v2(user1['token'], "channel1", False)
+    message = message_send_v2(user1['token'], channel_dict_1['channel_id'], "Hi there everyone")
+    message_pin_v1(user1['token'], message['message_id'])
+    message_edit_v2(user1['token'], message['message_id'], "Hi there")
+    messages = channel_messages_v2(user1['token'], channel_dict_1['channel_id'], 0)
+    assert messages['messages'][0]['is_pinned']
+    with pytest.raises(InputError):
+        message_pin_v1(user1['token'], message['message_id'])
+    clear_v1()
+
+
 '''
 MESSAGE UNPIN TESTS
 '''
@@ -1781,3 +2045,17 @@ def _is_message_in_list(message, message_id, message_list, user_id):
             user_id == -1):
             return True
     return False
+
+
+def test_message_removed_before_lock():
+    clear_v1()
+    user = auth_register_v2("validemail@gmail.com", "password123", "First", "Last")
+    channel = channels_create_v2(user['token'], "Channel", True)
+    sent = message_send_v2(user['token'], channel['channel_id'], "hello")
+    message_remove_v1(user['token'], sent['message_id'])
+
+    # A request that validated the message before it was removed
+    with pytest.raises(InputError):
+        with message_module._locked_message(sent['message_id']):
+            pass
+    clear_v1()
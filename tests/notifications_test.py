@@ -0,0 +1,113 @@
+import pickle
+from src import persistence
+from src.data import data
+from src.notifications import NotificationRing
+from src.records import User
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_invite_v2
+from src.message import message_send_v2
+from src.other import clear_v1, notifications_get_v1
+
+
+def test_ring_newest_first():
+    ring = NotificationRing(capacity=3)
+    assert list(ring) == []
+    for number in range(2):
+        ring.push(number)
+    assert list(ring) == [1, 0]
+    for number in range(2, 7):
+        ring.push(number)
+    assert list(ring) == [6, 5, 4]
+    assert len(ring) == 3
+
+
+def test_ring_pickles():
+    ring = NotificationRing(capacity=3)
+    for number in range(5):
+        ring.push(number)
+    copy = pickle.loads(pickle.dumps(ring))
+    assert copy == ring
+    copy.push(5)
+    assert list(copy) == [5, 4, 3]
+
+
+def test_notifications_survive_restore(tmp_path):
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    user1 = auth_register_v2('abc@unsw.com', '123abc!@#', 'First', 'Last')
+    user2 = auth_register_v2('xyz@unsw.com', '123xyz!@#', 'Second', 'Last')
+    for number in range(25):
+        channel = channels_create_v2(user1['token'], 'Channel%d' % number, True)
+        channel_invite_v2(user1['token'], channel['channel_id'], user2['auth_user_id'])
+    expected = notifications_get_v1(user2['token'])
+    assert len(expected['notifications']) == 19
+    assert expected['notifications'][0]['notification_message'] == \
+        'firstlast added you to Channel24'
+
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert notifications_get_v1(user2['token']) == expected
+    persistence.compact()
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert notifications_get_v1(user2['token']) == expected
+    persistence.close()
+    clear_v1()
+
+
+# Pickles as a user record of the layout that kept a notification_count
+class _OldUser:
+    def __init__(self, user_id, notifications, user_admin):
+        self.values = ('First', 'Last', 'user%d@unsw.com' % user_id, 'password', user_id,
+                       'firstlast%d' % user_id, [], '', [], False, notifications,
+                       len(notifications), user_admin)
+
+    def __reduce__(self):
+        return (User, self.values)
+
+
+def test_restore_old_user_layout(tmp_path):
+    clear_v1()
+    store = dict(data)
+    store['user_list'] = {0: _OldUser(0, [], 1), 1: _OldUser(1, ['first', 'second'], 0)}
+    with open(tmp_path / 'export.p', 'wb') as outfile:
+        pickle.dump((0, store), outfile)
+    # A journal tail written by the same version
+    with open(tmp_path / 'export.journal', 'wb') as outfile:
+        for record in [(1, 'append', ('user_list', 1, 'notifications'), 'third'),
+                       (2, 'set', ('user_list', 1, 'notification_count'), 3)]:
+            payload = pickle.dumps(record)
+            outfile.write(persistence._HEADER.pack(len(payload)) + payload)
+
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    owner, user = data['user_list'][0], data['user_list'][1]
+    assert (owner['user_admin'], user['user_admin']) == (1, 0)
+    assert list(user['notifications']) == ['third', 'second', 'first']
+    user['notifications'].push('fourth')
+    assert len(user['notifications']) == 4
+    persistence.close()
+    clear_v1()
+
+
+def test_tags_journaled_together(tmp_path):
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    users = [auth_register_v2('user%d@unsw.com' % number, '123abc!@#', 'First', 'Last%s' % name)
+             for number, name in enumerate(('a', 'b', 'c'))]
+    channel = channels_create_v2(users[0]['token'], 'Channel', True)
+    for user in users[1:]:
+        channel_invite_v2(users[0]['token'], channel['channel_id'], user['auth_user_id'])
+    records = len(list(persistence._read_journal(str(tmp_path / 'export.journal'))))
+    message_send_v2(users[0]['token'], channel['channel_id'], '@firstlastb @firstlastc hi')
+    new_records = list(persistence._read_journal(str(tmp_path / 'export.journal')))[records:]
+    assert [record[1] for record in new_records].count('batch') == 1
+    expected = [notifications_get_v1(user['token']) for user in users]
+
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    assert [notifications_get_v1(user['token']) for user in users] == expected
+    assert expected[2]['notifications'][0]['notification_message'].startswith(
+        'firstlasta tagged you in Channel')
+    persistence.close()
+    clear_v1()
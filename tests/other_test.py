@@ -1,8 +1,13 @@
 import pytest
+from datetime import datetime, timedelta
+from time import time
+from src import scheduler
+from src import indexes
+from src import message as message_module
 from src.auth import auth_register_v2, _generate_token, auth_logout_v1
 from src.channels import channels_create_v2
 from src.channel import channel_addowner_v1
-from src.other  import clear_v1, search_v2
+from src.other  import clear_v1, search_v2, search_page_v1
 from src.validator import is_user_id_valid, is_user_in_channel, is_user_in_dm, get_message_details
 from src.other import users_all_v1
 from src.other import admin_user_remove_v1, is_user_admin
@@ -10,6 +15,7 @@ from src.other import admin_userpermission_change_v1, notifications_get_v1
 import src.error as er
 from src.dm import dm_create_v1, dm_messages_v1, dm_invite_v1
 from src.message import message_send_v2, message_senddm_v1, message_react_v1, message_edit_v2
+from src.message import message_remove_v1, message_sendlater_v1
 from src.channel import channel_invite_v2, channel_messages_v2
 
 '''
@@ -193,6 +199,23 @@ def test_correct_notifications_tagged_dmchannel():
         {'channel_id': 0, 'dm_id': -1, 'notification_message': 'firstlast tagged you in DwarfWharf: Hey @jeffnguyen'}, 
         {'channel_id': 0, 'dm_id': -1, 'notification_message': 'firstlast added you to DwarfWharf'}]}
 
+def test_tagged_notifications_members_only_once():
+    clear_v1()
+    user1 = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    user2 = auth_register_v2('jeff@gmail.com', '12321abc!', 'jeff', 'nguyen')
+    user3 = auth_register_v2('sam@gmail.com', '12321abc!', 'sam', 'smith')
+    channel1 = channels_create_v2(user1['token'], 'DwarfWharf', True)
+    channel_invite_v2(user1['token'], channel1['channel_id'], user2['auth_user_id'])
+    message_send_v2(user1['token'], channel1['channel_id'],
+                    "@jeffnguyen @samsmith @nobody @jeffnguyen")
+    assert notifications_get_v1(user2['token'])['notifications'][0] == {
+        'channel_id': 0, 'dm_id': -1,
+        'notification_message': 'firstlast tagged you in DwarfWharf: @jeffnguyen @samsmit'}
+    assert len(notifications_get_v1(user2['token'])['notifications']) == 2
+    assert notifications_get_v1(user3['token']) == {'notifications': []}
+    clear_v1()
+
+
 def test_correct_react_notifications_channel():
     clear_v1()
     user1 = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
@@ -442,6 +465,204 @@ def test_search_many_messages_some_unreturned():
     clear_v1()
 
 
+
+def test_search_follows_edits_and_removals():
+    '''Edited and removed messages are searched by their current text'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    edited = message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "old words")
+    removed = message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "new words")
+    message_edit_v2(user_dict_owner['token'], edited['message_id'], "Brand new text")
+    message_remove_v1(user_dict_owner['token'], removed['message_id'])
+
+    # Act
+    old_search = search_v2(user_dict_owner['token'], "old")
+    new_search = search_v2(user_dict_owner['token'], "and new te")
+
+    #Assert
+    assert old_search == {'messages': []}
+    assert [message['message_id'] for message in new_search['messages']] == [
+        edited['message_id']]
+    clear_v1()
+
+
+def test_search_punctuation_query():
+    '''A query with no words in it still matches by substring'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "hello")
+    message_info = message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "what?!")
+
+    # Act
+    search = search_v2(user_dict_owner['token'], "?!")
+
+    #Assert
+    assert [message['message_id'] for message in search['messages']] == [
+        message_info['message_id']]
+    clear_v1()
+
+
+def test_search_matches_inside_words():
+    '''Substrings of longer and shorter lengths match anywhere in a message'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    texts = ["UNSW dreams", "daydreaming", "dram", "Dr. Eam", "ea"]
+    for text in texts:
+        message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], text)
+
+    for query in ["dream", "ream", "ea", "e", "dr", ". e", "eams"]:
+        # Act
+        search = search_v2(user_dict_owner['token'], query)
+
+        #Assert
+        assert sorted(message['message'] for message in search['messages']) == sorted(
+            text for text in texts if query in text.lower())
+    clear_v1()
+
+
+# Stands in for datetime in src.message so each message is sent a second after the last
+class _Clock(datetime):
+    ticks = 0
+
+    @classmethod
+    def now(cls, tz=None):
+        _Clock.ticks += 1
+        return datetime.now(tz) + timedelta(seconds=_Clock.ticks)
+
+
+def test_search_page_newest_first_across_containers(monkeypatch):
+    '''Pages of matches are merged across channels and dms, newest first'''
+
+    clear_v1()
+    monkeypatch.setattr(message_module, 'datetime', _Clock)
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    dm_dict = dm_create_v1(user_dict_owner['token'], [])
+    sent = []
+    for num in range(5):
+        sent.append(message_send_v2(user_dict_owner['token'], channel_dict['channel_id'],
+                                    f"find me {num}")['message_id'])
+        sent.append(message_senddm_v1(user_dict_owner['token'], dm_dict['dm_id'],
+                                      f"find me too {num}")['message_id'])
+        message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "hidden")
+
+    # Act
+    first = search_page_v1(user_dict_owner['token'], "find me", 6, -1)
+    second = search_page_v1(user_dict_owner['token'], "find me", 6, first['end'])
+
+    #Assert
+    assert [message['message_id'] for message in first['messages']] == sent[::-1][:6]
+    assert first['end'] == sent[::-1][5]
+    assert [message['message_id'] for message in second['messages']] == sent[::-1][6:]
+    assert second['end'] == -1
+    clear_v1()
+
+
+def test_search_page_follows_delivery_order(monkeypatch):
+    '''A message sent later is paged in the order it was delivered, not by its message_id'''
+
+    clear_v1()
+    monkeypatch.setattr(message_module, 'datetime', _Clock)
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    first = message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "find A")
+    later = message_sendlater_v1(user_dict_owner['token'], channel_dict['channel_id'],
+                                 "find L", int(time()) + 3600)
+    second = message_send_v2(user_dict_owner['token'], channel_dict['channel_id'], "find B")
+    scheduler.run_due(time() + 3600)
+
+    # Act
+    found = []
+    before = -1
+    while True:
+        page = search_page_v1(user_dict_owner['token'], "find", 1, before)
+        found += [message['message_id'] for message in page['messages']]
+        if page['end'] == -1:
+            break
+        before = page['end']
+
+    # Assert
+    assert found == [later['message_id'], second['message_id'], first['message_id']]
+    clear_v1()
+
+
+def test_search_page_removed_cursor():
+    '''A page can start from a match that has since been removed'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    sent = [message_send_v2(user_dict_owner['token'], channel_dict['channel_id'],
+                            f"find me {num}")['message_id'] for num in range(4)]
+    first = search_page_v1(user_dict_owner['token'], "find me", 2, -1)
+    message_remove_v1(user_dict_owner['token'], first['end'])
+
+    # Act
+    second = search_page_v1(user_dict_owner['token'], "find me", 2, first['end'])
+
+    # Assert
+    assert [message['message_id'] for message in second['messages']] == [sent[1], sent[0]]
+    with pytest.raises(er.InputError):
+        search_page_v1(user_dict_owner['token'], "find me", 2, 42)
+    clear_v1()
+
+
+def test_search_page_deep_cursor(monkeypatch):
+    '''A page deep into the matches does not read the matches newer than its cursor'''
+
+    clear_v1()
+    monkeypatch.setattr(message_module, 'datetime', _Clock)
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "Channel", True)
+    sent = [message_send_v2(user_dict_owner['token'], channel_dict['channel_id'],
+                            f"ab {num}")['message_id'] for num in range(100)]
+    keys_read = []
+    delivery_key = indexes.delivery_key
+
+    def counted_delivery_key(*args):
+        keys_read.append(args)
+        return delivery_key(*args)
+
+    monkeypatch.setattr(indexes, 'delivery_key', counted_delivery_key)
+
+    # Act
+    short = search_page_v1(user_dict_owner['token'], "ab", 2, sent[3])
+    long = search_page_v1(user_dict_owner['token'], "ab 1", 2, sent[12])
+
+    # Assert
+    assert [message['message_id'] for message in short['messages']] == [sent[2], sent[1]]
+    assert [message['message_id'] for message in long['messages']] == [sent[11], sent[10]]
+    assert len(keys_read) < 30
+    clear_v1()
+
+
+def test_search_page_invalid_limit():
+    '''Limits outside of 1 to 50 are rejected'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+
+    # Act & Assert
+    with pytest.raises(er.InputError):
+        search_page_v1(user_dict_owner['token'], "find me", 0, -1)
+    with pytest.raises(er.InputError):
+        search_page_v1(user_dict_owner['token'], "find me", 51, -1)
+    clear_v1()
+
 def add_owner_to_channel_notifications_fetched():
     clear_v1()
     user_dict_owner = auth_register_v2("sheriff.woody@andysroom.com", "qazwsx!!", "sheriff", "woody")
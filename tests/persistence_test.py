@@ -0,0 +1,184 @@
+import os
+import pickle
+import shutil
+import threading
+import pytest
+from src import persistence
+from src.data import data
+from src.auth import auth_register_v2, auth_login_v2
+from src.channels import channels_create_v2, channels_listall_v2
+from src.channel import channel_messages_v2
+from src.dm import dm_messages_v1
+from src.message import message_send_v2, message_react_v1, message_remove_v1
+from src.message import message_pin_v1, message_unpin_v1
+from src.other import clear_v1, users_all_v1, notifications_get_v1
+from src.validator import get_message_details
+
+
+def _open_store(tmp_path):
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+
+
+def _crash_and_restore(tmp_path):
+    # Drop the resident store without journaling anything, then reload it
+    data.clear()
+    _open_store(tmp_path)
+
+
+def test_journal_replayed_on_restore(tmp_path):
+    clear_v1()
+    _open_store(tmp_path)
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'DwarfWharf', True)
+    message_send_v2(user['token'], channel['channel_id'], 'first')
+    message = message_send_v2(user['token'], channel['channel_id'], 'second')
+    message_send_v2(user['token'], channel['channel_id'], 'third')
+    message_react_v1(user['token'], message['message_id'], 1)
+    message_remove_v1(user['token'], 0)
+
+    _crash_and_restore(tmp_path)
+    assert channels_listall_v2(user['token']) == {
+        'channels': [{'channel_id': 0, 'name': 'DwarfWharf'}]
+    }
+    messages = channel_messages_v2(user['token'], channel['channel_id'], 0)['messages']
+    assert [m['message'] for m in messages] == ['third', 'second']
+    assert [react.to_dict() for react in
+            get_message_details(message['message_id'])['reacts_list']] == [
+        {'react_id': 1, 'u_id': user['auth_user_id']}
+    ]
+    persistence.close()
+    clear_v1()
+
+
+def test_compact_folds_journal_into_snapshot(tmp_path):
+    clear_v1()
+    _open_store(tmp_path)
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    channels_create_v2(user['token'], 'DwarfWharf', True)
+    persistence.compact()
+    assert os.path.getsize(tmp_path / 'export.journal') == 0
+
+    channels_create_v2(user['token'], 'Second', True)
+    _crash_and_restore(tmp_path)
+    assert channels_listall_v2(user['token']) == {
+        'channels': [
+            {'channel_id': 0, 'name': 'DwarfWharf'},
+            {'channel_id': 1, 'name': 'Second'},
+        ]
+    }
+    persistence.close()
+    clear_v1()
+
+
+def test_journal_closed_after_failed_restore(tmp_path):
+    clear_v1()
+    _open_store(tmp_path)
+    with open(tmp_path / 'export.journal', 'ab') as outfile:
+        payload = pickle.dumps((1, 'set', ('missing', 'key'), 0))
+        outfile.write(persistence._HEADER.pack(len(payload)) + payload)
+
+    with pytest.raises(KeyError):
+        _crash_and_restore(tmp_path)
+    # Nothing is journaled to the closed file
+    persistence.journal('set', ('user_id',), 0)
+    persistence.close()
+    clear_v1()
+
+
+def test_restore_missing_snapshot(tmp_path):
+    clear_v1()
+    _open_store(tmp_path)
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    assert user['auth_user_id'] == 0
+    persistence.close()
+    clear_v1()
+
+
+def test_restore_store_without_newer_keys(tmp_path):
+    clear_v1()
+    # The bare store pickled before sessions, stats and the other later keys
+    with open(tmp_path / 'export.p', 'wb') as outfile:
+        pickle.dump({'user_id': 0, 'channel_id': 0, 'message_id': 0, 'user_list': {},
+                     'channel_list': {}, 'channel_id_list': [], 'session_id': 0,
+                     'dm_id_list': [], 'dm_id': 0, 'dm_list': {}}, outfile)
+    data.clear()
+    _open_store(tmp_path)
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    channels_create_v2(user['token'], 'DwarfWharf', True)
+    persistence.compact()
+
+    _crash_and_restore(tmp_path)
+    assert channels_listall_v2(user['token']) == {
+        'channels': [{'channel_id': 0, 'name': 'DwarfWharf'}]
+    }
+    persistence.close()
+    clear_v1()
+
+
+def test_concurrent_sends_replay_in_order(tmp_path):
+    clear_v1()
+    _open_store(tmp_path)
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    channel = channels_create_v2(user['token'], 'DwarfWharf', True)
+
+    def _send_and_remove(sender):
+        for number in range(20):
+            message = message_send_v2(user['token'], channel['channel_id'],
+                                      '%d-%d' % (sender, number))
+            if number % 3 == 0:
+                message_remove_v1(user['token'], message['message_id'])
+
+    senders = [threading.Thread(target=_send_and_remove, args=(sender,)) for sender in range(6)]
+    for sender in senders:
+        sender.start()
+    for sender in senders:
+        sender.join()
+    expected = list(data['channel_list'][channel['channel_id']]['messages'])
+    assert len(expected) == 6 * 13
+
+    _crash_and_restore(tmp_path)
+    assert list(data['channel_list'][channel['channel_id']]['messages']) == expected
+    for message in expected:
+        assert get_message_details(message['message_id']) == message
+    persistence.close()
+    clear_v1()
+
+
+def test_restore_store_pickled_before_journal(tmp_path):
+    clear_v1()
+    # Written by the version that pickled the whole store on every change:
+    # three users, the first two sharing a handle, a channel with a tagged,
+    # reacted and pinned message and an active standup, and a dm with a pin
+    shutil.copy(os.path.join(os.path.dirname(__file__), 'baseline_export.p'),
+                tmp_path / 'export.p')
+    data.clear()
+    _open_store(tmp_path)
+    owner = auth_login_v2('owner@unsw.com', 'password')
+    member = auth_login_v2('member@unsw.com', 'password')
+    other = auth_login_v2('other@unsw.com', 'password')
+
+    assert [user['handle_str'] for user in users_all_v1(owner['token'])['users']] == [
+        'janecitizen', 'janecitizen0', 'samsmith'
+    ]
+    messages = channel_messages_v2(owner['token'], 0, 0)['messages']
+    assert [(m['message'], m['is_pinned']) for m in messages] == [
+        ('hi there', False), ('hello @janecitizen0', True)
+    ]
+    assert messages[1]['reacts'][0]['u_ids'] == [member['auth_user_id']]
+    assert dm_messages_v1(other['token'], 0, 0)['messages'][0]['is_pinned']
+    assert data['channel_list'][0]['standup']['buffer'] == [
+        'janecitizen: first line', 'janecitizen0: second line'
+    ]
+
+    message_unpin_v1(owner['token'], 0)
+    message_pin_v1(owner['token'], 1)
+    message_send_v2(owner['token'], 0, '@janecitizen0 again')
+    assert notifications_get_v1(member['token'])['notifications'][0][
+        'notification_message'] == 'janecitizen tagged you in General: @janecitizen0 again'
+    assert auth_register_v2('new@unsw.com', 'password', 'Jane', 'Citizen')['auth_user_id'] == 3
+    assert data['user_list'][3]['handle'] == 'janecitizen1'
+
+    # Tokens issued before the upgrade still work
+    assert len(users_all_v1(data['user_list'][0]['token'])['users']) == 4
+    persistence.close()
+    clear_v1()
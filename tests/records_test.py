@@ -0,0 +1,48 @@
+import pickle
+import pytest
+from src.records import Message, React
+
+
+def _message():
+    return Message(
+        message_id=0,
+        u_id=1,
+        message='hello',
+        time_created=1618000000,
+        reacts_list=[React(react_id=1, u_id=1)],
+    )
+
+
+def test_record_item_access():
+    message = _message()
+    message['message'] = 'edited'
+    assert message['message'] == 'edited'
+    assert message.message == 'edited'
+    assert 'reacts_list' in message
+    assert message.get('is_pinned') is None
+    with pytest.raises(KeyError):
+        message['is_pinned'] = True
+
+
+def test_record_rejects_extra_values():
+    with pytest.raises(TypeError):
+        React(1, 1, 1)
+
+
+def test_record_to_dict():
+    assert _message().to_dict() == {
+        'message_id': 0,
+        'u_id': 1,
+        'message': 'hello',
+        'time_created': 1618000000,
+        'reacts_list': [React(react_id=1, u_id=1)],
+    }
+
+
+def test_record_pickles_smaller_than_dict():
+    messages = [_message() for _ in range(100)]
+    as_dicts = [dict(message.to_dict(),
+                     reacts_list=[react.to_dict() for react in message.reacts_list])
+                for message in messages]
+    assert pickle.loads(pickle.dumps(messages)) == messages
+    assert len(pickle.dumps(messages)) < len(pickle.dumps(as_dicts))
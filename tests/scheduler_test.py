@@ -0,0 +1,45 @@
+import threading
+from time import time
+from src import scheduler
+
+# Far enough ahead that the dispatcher never runs these jobs itself
+LATER = time() + 3600
+
+
+def test_jobs_run_in_time_order():
+    scheduler.cancel_all()
+    ran = []
+    for when in (30, 10, 20):
+        scheduler.schedule(LATER + when, ran.append, when)
+    assert scheduler.run_due(LATER + 25) == 2
+    assert ran == [10, 20]
+    assert scheduler.pending_count() == 1
+    scheduler.cancel_all()
+
+
+def test_cancel_job():
+    scheduler.cancel_all()
+    ran = []
+    job_id = scheduler.schedule(LATER + 10, ran.append, 'cancelled')
+    scheduler.schedule(LATER + 20, ran.append, 'kept')
+    scheduler.cancel(job_id)
+    scheduler.cancel(job_id)
+    assert scheduler.pending_count() == 1
+    assert scheduler.run_due(LATER + 30) == 1
+    assert ran == ['kept']
+
+
+def test_failing_job_does_not_stop_others():
+    scheduler.cancel_all()
+    ran = []
+    scheduler.schedule(LATER + 10, lambda: 1 / 0)
+    scheduler.schedule(LATER + 20, ran.append, 'after')
+    assert scheduler.run_due(LATER + 30) == 2
+    assert ran == ['after']
+
+
+def test_dispatcher_runs_due_jobs():
+    scheduler.cancel_all()
+    done = threading.Event()
+    scheduler.schedule(time() + 0.1, done.set)
+    assert done.wait(5)
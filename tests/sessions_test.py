@@ -0,0 +1,58 @@
+from src import sessions
+from src.data import data
+from src.auth import auth_register_v2, auth_login_v2, auth_logout_v1
+from src.other import clear_v1
+from src.validator import decode_token, is_token_valid
+
+
+def _session_id(token):
+    return decode_token(token)['token']['session_id']
+
+
+def test_login_opens_session():
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    login = auth_login_v2('abc@gmail.com', '123abc!')
+    session = data['sessions'][_session_id(login['token'])]
+    assert session['user_id'] == user['auth_user_id']
+    assert session['issued_at'] == session['last_seen']
+    clear_v1()
+
+
+def test_logout_closes_session():
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    auth_logout_v1(user['token'])
+    assert _session_id(user['token']) not in data['sessions']
+    clear_v1()
+
+
+def test_sweep_closes_idle_sessions():
+    clear_v1()
+    idle = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    active = auth_register_v2('def@gmail.com', '123abc!', 'First', 'Last')
+    data['sessions'][_session_id(idle['token'])]['last_seen'] -= 600
+
+    assert sessions.sweep_sessions(300) == 1
+    assert not is_token_valid(idle['token'])
+    assert is_token_valid(active['token'])
+    clear_v1()
+
+
+def test_sweep_without_timeout_keeps_sessions():
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    data['sessions'][_session_id(user['token'])]['last_seen'] -= 10 ** 6
+    assert sessions.sweep_sessions() == 0
+    assert is_token_valid(user['token'])
+    clear_v1()
+
+
+def test_use_refreshes_last_seen():
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    session = data['sessions'][_session_id(user['token'])]
+    session['last_seen'] -= 600
+    assert is_token_valid(user['token'])
+    assert sessions.sweep_sessions(300) == 0
+    clear_v1()
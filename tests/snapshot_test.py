@@ -0,0 +1,109 @@
+import pickle
+import sys
+from datetime import datetime
+from src import persistence
+from src.records import Record
+from src.data import data
+from src.snapshot import SnapshotReader, is_snapshot, read_snapshot, write_snapshot
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2, channels_listall_v2
+from src.channel import channel_messages_v2
+from src.message import message_send_v2, message_react_v1
+from src.other import clear_v1
+
+
+def _store():
+    clear_v1()
+    user = auth_register_v2('abc@gmail.com', '123abc!', 'First', 'Last')
+    for name in ('first', 'second'):
+        channel = channels_create_v2(user['token'], name, True)
+        message = message_send_v2(user['token'], channel['channel_id'], 'hello ' + name)
+    message_react_v1(user['token'], message['message_id'], 1)
+    return user
+
+
+def test_snapshot_round_trip(tmp_path):
+    user = _store()
+    data['reset_codes']['abcde'] = 'abc@gmail.com'
+    path = str(tmp_path / 'export.p')
+    write_snapshot(path, 42, data)
+
+    lsn, store = read_snapshot(path)
+    assert lsn == 42
+    assert store['user_list'] == data['user_list']
+    assert store['sessions'] == data['sessions']
+    assert store['reset_codes'] == {'abcde': 'abc@gmail.com'}
+    for channel_id in (0, 1):
+        stored = store['channel_list'][channel_id]
+        assert list(stored['messages']) == list(data['channel_list'][channel_id]['messages'])
+        assert stored['all_members'] == data['channel_list'][channel_id]['all_members']
+    clear_v1()
+
+
+def test_snapshot_reads_containers_lazily(tmp_path):
+    _store()
+    path = str(tmp_path / 'export.p')
+    write_snapshot(path, 0, data)
+
+    with SnapshotReader(path) as reader:
+        assert reader.container_ids('channel_list') == [0, 1]
+        assert reader.root()['channel_list'] == {}
+        channel = reader.container('channel_list', 1)
+        assert channel['channel_name'] == 'second'
+        assert channel['messages'][0]['message'] == 'hello second'
+    clear_v1()
+
+
+def test_snapshot_other_values(tmp_path):
+    path = str(tmp_path / 'export.p')
+    store = {
+        'big': 2 ** 70,
+        'negative': -5,
+        'float': 1.5,
+        'tuple': (1, 'a', None),
+        'set': {1, 2},
+        'when': datetime(2021, 4, 1),
+        'channel_list': {},
+        'dm_list': {},
+    }
+    write_snapshot(path, 0, store)
+    assert read_snapshot(path) == (0, store)
+
+
+class Point(Record):
+    __slots__ = ('x', 'y')
+
+
+def test_snapshot_records_read_by_name(tmp_path, monkeypatch):
+    path = str(tmp_path / 'export.p')
+    write_snapshot(path, 0, {'point': Point(1, 2), 'channel_list': {}, 'dm_list': {}})
+
+    # The class has since dropped a field, added one and been reordered
+    class NewPoint(Record):
+        __slots__ = ('z', 'y')
+    monkeypatch.setattr(sys.modules[__name__], 'Point', NewPoint)
+    point = read_snapshot(path)[1]['point']
+    assert type(point) is NewPoint
+    assert point.to_dict() == {'z': None, 'y': 2}
+
+
+def test_restore_pickled_snapshot(tmp_path):
+    user = _store()
+    expected = channel_messages_v2(user['token'], 1, 0)
+    path = tmp_path / 'export.p'
+    with open(path, 'wb') as outfile:
+        pickle.dump((0, dict(data)), outfile)
+
+    data.clear()
+    persistence.restore(str(path), str(tmp_path / 'export.journal'))
+    assert channel_messages_v2(user['token'], 1, 0) == expected
+
+    # The next compaction rewrites it in the binary format
+    channels_create_v2(user['token'], 'third', True)
+    persistence.compact()
+    assert is_snapshot(str(path))
+    data.clear()
+    persistence.restore(str(path), str(tmp_path / 'export.journal'))
+    assert len(channels_listall_v2(user['token'])['channels']) == 3
+    persistence.close()
+    clear_v1()
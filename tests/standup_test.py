@@ -5,6 +5,7 @@ src.validator imports importal global helperfunctions
 src.error import types of errors
 '''
 import time
+import threading
 import datetime
 from datetime import timezone, datetime
 import pytest
@@ -14,6 +15,9 @@ from src.channel import channel_messages_v2, channel_join_v2
 from src.other import clear_v1
 from src.standup import standup_start_v1, standup_active_v1
 from src.standup import standup_send_v1, _is_channel_standup_active
+from src.standup import schedule_active_standups
+from src import scheduler, persistence
+from src.data import data
 import src.error as er
 
 
@@ -357,3 +361,120 @@ these tests out in order to pass the pipeline.
 #    channel_messages = channel_messages_v2(user_dict_owner['token'], channel_dict['channel_id'], 0)
 #    assert channel_messages['messages'][0]['time_created'] == pre_time + 1
 #    clear_v1()
+
+
+######################## standup scheduling Tests ########################
+
+def test_standup_ends_when_due():
+    '''Test the standup is ended by the scheduler and its messages sent in one message'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    user1 = auth_register_v2('z555555@unsw.com','123abc!@#', 'First', 'Last')
+    channel_dict = channels_create_v2(user_dict_owner['token'], "channel", True)
+    channel_join_v2(user1['token'], channel_dict['channel_id'])
+    standup_start_v1(user_dict_owner['token'], channel_dict['channel_id'], 60)
+    standup_send_v1(user_dict_owner['token'], channel_dict['channel_id'], "Please be my friend")
+    standup_send_v1(user1['token'], channel_dict['channel_id'], "Hmm..")
+
+    # Act
+    scheduler.run_due(time.time() + 30)
+    messages_before = channel_messages_v2(user_dict_owner['token'], channel_dict['channel_id'], 0)
+    scheduler.run_due(time.time() + 60)
+    messages_after = channel_messages_v2(user_dict_owner['token'], channel_dict['channel_id'], 0)
+
+    # Assert
+    assert messages_before['messages'] == []
+    assert [message['message'] for message in messages_after['messages']] == [
+        'globalowner: Please be my friend\nfirstlast: Hmm..']
+    assert messages_after['messages'][0]['u_id'] == user_dict_owner['auth_user_id']
+    assert not _is_channel_standup_active(channel_dict['channel_id'])
+    clear_v1()
+
+
+def test_standup_survives_restart(tmp_path):
+    '''Test a standup that was running when the server stopped still ends after a restore'''
+
+    clear_v1()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "channel", True)
+    standup_start_v1(user_dict_owner['token'], channel_dict['channel_id'], 60)
+    standup_send_v1(user_dict_owner['token'], channel_dict['channel_id'], "Still here")
+
+    # Act
+    scheduler.cancel_all()
+    data.clear()
+    persistence.restore(str(tmp_path / 'export.p'), str(tmp_path / 'export.journal'))
+    schedule_active_standups()
+    scheduler.run_due(time.time() + 60)
+
+    # Assert
+    messages = channel_messages_v2(user_dict_owner['token'], channel_dict['channel_id'], 0)
+    assert [message['message'] for message in messages['messages']] == [
+        'globalowner: Still here']
+    persistence.close()
+    clear_v1()
+
+
+def test_standup_buffer_starts_empty():
+    '''Test each standup only sends the lines sent during it'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "channel", True)
+    standup_start_v1(user_dict_owner['token'], channel_dict['channel_id'], 60)
+    standup_send_v1(user_dict_owner['token'], channel_dict['channel_id'], "First")
+    scheduler.run_due(time.time() + 60)
+
+    # Act
+    standup_start_v1(user_dict_owner['token'], channel_dict['channel_id'], 60)
+    standup_send_v1(user_dict_owner['token'], channel_dict['channel_id'], "Second")
+    standup_send_v1(user_dict_owner['token'], channel_dict['channel_id'], "Third")
+    scheduler.run_due(time.time() + 60)
+
+    # Assert
+    messages = channel_messages_v2(user_dict_owner['token'], channel_dict['channel_id'], 0)
+    assert [message['message'] for message in messages['messages']] == [
+        'globalowner: Second\nglobalowner: Third', 'globalowner: First']
+    assert data['channel_list'][channel_dict['channel_id']]['standup']['buffer'] == []
+    clear_v1()
+
+
+def test_standup_concurrent_senders():
+    '''Test every line accepted while the standup ends from another thread is sent once'''
+
+    clear_v1()
+    # Arrange
+    user_dict_owner = auth_register_v2("z5555555@unsw.com", "password", "Global", "Owner")
+    channel_dict = channels_create_v2(user_dict_owner['token'], "channel", True)
+    channel_id = channel_dict['channel_id']
+    standup_start_v1(user_dict_owner['token'], channel_id, 60)
+    accepted = []
+
+    def _send_lines(sender):
+        for line in range(50):
+            text = '%d-%d' % (sender, line)
+            try:
+                standup_send_v1(user_dict_owner['token'], channel_id, text)
+            except er.InputError:
+                return
+            accepted.append('globalowner: ' + text)
+
+    # Act
+    senders = [threading.Thread(target=_send_lines, args=(sender,)) for sender in range(8)]
+    for sender in senders:
+        sender.start()
+    scheduler.run_due(time.time() + 60)
+    for sender in senders:
+        sender.join()
+
+    # Assert
+    messages = channel_messages_v2(user_dict_owner['token'], channel_id, 0)['messages']
+    sent_lines = messages[0]['message'].split('\n') if messages else []
+    assert sorted(sent_lines) == sorted(accepted)
+    assert not _is_channel_standup_active(channel_id)
+    clear_v1()
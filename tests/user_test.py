@@ -10,9 +10,9 @@ from src.auth import auth_register_v2
 from src.auth import auth_login_v2
 from src.auth import _generate_token
 from src.user import user_stats_v1, users_stats_v1
-from src.message import message_send_v2, message_senddm_v1
+from src.message import message_send_v2, message_senddm_v1, message_remove_v1
 from src.other import clear_v1
-from src.dm import dm_create_v1
+from src.dm import dm_create_v1, dm_remove_v1
 from src.auth import auth_logout_v1
 from src.validator import decode_token
 import src.error as er
@@ -181,6 +181,26 @@ def test_profile_sethandle():
         'handle_str': 'abcdef',
     }} == user_profile_v2(token1, 1))
     clear_v1()
+def test_profile_sethandle_frees_old_handle():
+    clear_v1()
+    auth_return1 = auth_register_v2('abc@unsw.com','123abc!@#', 'First', 'Last')
+    auth_return2 = auth_register_v2('abc123@unsw.com', '123abc!@#', 'Other', 'User')
+    user_profile_sethandle_v1(auth_return1['token'], 'abcdef')
+    user_profile_sethandle_v1(auth_return2['token'], 'firstlast')
+    with pytest.raises(er.InputError):
+        user_profile_sethandle_v1(auth_return2['token'], 'abcdef')
+    clear_v1()
+
+def test_profile_setemail_frees_old_email():
+    clear_v1()
+    auth_return1 = auth_register_v2('abc@unsw.com','123abc!@#', 'First', 'Last')
+    user_profile_setemail_v2(auth_return1['token'], 'new@unsw.com')
+    auth_register_v2('abc@unsw.com','123abc!@#', 'Other', 'User')
+    with pytest.raises(er.InputError):
+        auth_register_v2('new@unsw.com','123abc!@#', 'Other', 'User')
+    auth_login_v2('new@unsw.com', '123abc!@#')
+    clear_v1()
+
 def test_profile_removing_email():
     auth_return1 = auth_register_v2('abc@unsw.com','123abc!@#', 'First', 'Last')
     auth_return2 = auth_register_v2('abc123@unsw.com', '123abc!@#', 'First', 'Last')
@@ -421,3 +441,28 @@ def test_users_stats_working5():
         "utilization_rate": 1,
     }
     assert users_stats1 == expected_output
+
+
+def test_users_stats_counts_removed_messages():
+    clear_v1()
+    user1 = auth_register_v2("abc@unsw.com", "123abc!@#", "First", "Last")
+    user2 = auth_register_v2("xyz@unsw.com", "123xyz!@#", "First", "Last")
+    auth_register_v2("def@unsw.com", "123def!@#", "First", "Last")
+    channel = channels_create_v2(user1["token"], "ChannelName", True)
+    message = message_send_v2(user1["token"], channel['channel_id'], 'first')
+    message_send_v2(user1["token"], channel['channel_id'], 'second')
+    dm_1 = dm_create_v1(user1['token'], [user2['auth_user_id']])
+    message_senddm_v1(user2['token'], dm_1['dm_id'], 'third')
+
+    message_remove_v1(user1['token'], message['message_id'])
+    dm_remove_v1(user1['token'], dm_1['dm_id'])
+
+    users_stats1 = users_stats_v1(user1["token"])
+    date_time = int(datetime.timestamp(datetime.now()))
+    assert users_stats1['messages_exist'] == [{1, date_time}]
+    assert users_stats1['dms_exist'] == [{0, date_time}]
+    # user2 is no longer in any channel or dm
+    assert users_stats1['utilization_rate'] == 1/3
+    # user1 is in 1 channel and has 1 message, out of 1 channel, 0 dms and 3 message ids
+    assert user_stats_v1(user1["token"])['involvement_rate'] == 2/4
+    clear_v1()